@@ -6,6 +6,19 @@ import plotly.express as px
 import plotly.graph_objects as go
 import json
 import os
+import uuid
+from config import DEFAULT_SETTINGS
+from storage import get_journal_store
+from sqlite_store import get_sqlite_store
+from inventory import SharedInventory
+from inventory_engine import InventoryEngine, InventoryError
+from jobs import FINISHED_STATUSES, get_job_runner
+from bulk import BULK_JOBS
+from metrics import recorder, timer
+from profiling import profile_call
+from metrics_exporter import MetricsExporter, SessionTracker, start_http_exporter, start_textfile_writer
+from utils import empty_activity_summary
+from ingestion import HIDDEN_REVIEW_COLUMNS, UploadCache, aggregate_easy_ship, catalog_frame, drop_applied_orders, fba_review, order_lines, read_easy_ship_upload, read_fba_upload, read_upload, review_styles, upload_digest
 
 # Configure page
 st.set_page_config(
@@ -17,17 +30,27 @@ st.set_page_config(
 
 # Data persistence
 DATA_FILE = "stock_data.json"
+JOURNAL_FILE = "stock_data.journal"
+SQLITE_FILE = "stock_data.db"
+JOBS_FILE = "stock_jobs.db"
+METRICS_FILE = "stock_metrics.jsonl"
 
-def initialize_sample_data():
+def get_store():
+    """Get the persistence store (snapshot + transaction journal, or SQLite)"""
+    if DEFAULT_SETTINGS.get("storage_backend") == "sqlite":
+        return get_sqlite_store(SQLITE_FILE)
+    return get_journal_store(DATA_FILE, JOURNAL_FILE)
+
+def initialize_sample_data(inventory):
     """Initialize with sample data"""
-    st.session_state.parent_items = {
+    inventory.parent_items = {
         "RICE_BASMATI": {"name": "Basmati Rice Premium", "unit": "kg", "category": "Rice", "reorder_level": 10.0},
         "RICE_JASMINE": {"name": "Jasmine Rice Fragrant", "unit": "kg", "category": "Rice", "reorder_level": 5.0},
         "WHEAT_FLOUR": {"name": "Wheat Flour Organic", "unit": "kg", "category": "Flour", "reorder_level": 8.0},
         "PULSES_TOOR": {"name": "Toor Dal Premium", "unit": "kg", "category": "Pulses", "reorder_level": 3.0}
     }
     
-    st.session_state.packet_variations = {
+    inventory.packet_variations = {
         "RICE_BASMATI": {
             "B07BASMATI1KG": {"weight": 1, "asin": "B07BASMATI1KG", "description": "1kg Basmati Rice Pack", "mrp": 120},
             "B07BASMATI5KG": {"weight": 5, "asin": "B07BASMATI5KG", "description": "5kg Basmati Rice Pack", "mrp": 580}
@@ -46,421 +69,212 @@ def initialize_sample_data():
     }
     
     # Initialize stock data
-    st.session_state.stock_data = {}
-    for parent_id in st.session_state.parent_items:
-        st.session_state.stock_data[parent_id] = {
+    inventory.stock_data = {}
+    for parent_id in inventory.parent_items:
+        inventory.stock_data[parent_id] = {
             "loose_stock": 0,
             "packed_stock": {},
             "opening_stock": 0,
             "last_updated": datetime.datetime.now().isoformat()
         }
-        for asin in st.session_state.packet_variations.get(parent_id, {}):
-            st.session_state.stock_data[parent_id]["packed_stock"][asin] = 0
+        for asin in inventory.packet_variations.get(parent_id, {}):
+            inventory.stock_data[parent_id]["packed_stock"][asin] = 0
     
-    st.session_state.transactions = []
+    inventory.transactions = []
     
     # Initialize return data
-    st.session_state.return_data = {}
-    for parent_id in st.session_state.parent_items:
-        st.session_state.return_data[parent_id] = {
+    inventory.return_data = {}
+    for parent_id in inventory.parent_items:
+        inventory.return_data[parent_id] = {
             "loose_return": {"good": 0, "bad": 0},
             "packed_return": {}
         }
-        for asin in st.session_state.packet_variations.get(parent_id, {}):
-            st.session_state.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
+        for asin in inventory.packet_variations.get(parent_id, {}):
+            inventory.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
     
-    st.session_state.return_transactions = []
+    inventory.return_transactions = []
 
 def save_data():
-    """Save data to JSON file"""
-    data = {
-        "stock_data": st.session_state.stock_data,
-        "transactions": st.session_state.transactions,
-        "parent_items": st.session_state.parent_items,
-        "packet_variations": st.session_state.packet_variations,
-        "daily_opening_stock": getattr(st.session_state, 'daily_opening_stock', {}),
-        "return_data": getattr(st.session_state, 'return_data', {}),
-        "return_transactions": getattr(st.session_state, 'return_transactions', []),
-        "last_updated": datetime.datetime.now().isoformat()
-    }
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    """Save a full snapshot to the configured store"""
+    inventory.save()
+
+@st.cache_resource
+def get_inventory():
+    """Load the inventory once per process; every session shares it"""
+    inventory = SharedInventory(get_store())
+    try:
+        inventory.load(initialize_sample_data)
+    except Exception as e:
+        inventory.load_error = str(e)
+        initialize_sample_data(inventory)
+        inventory.upgrade()
+        inventory.rebuild_asin_index()
+    return inventory
+
+# Shared by all sessions - session state only keeps UI state
+inventory = get_inventory()
+if inventory.load_error:
+    st.error(f"Error loading data: {inventory.load_error}")
+
+# Every stock change goes through the engine; the pages only collect input and show results
+engine = InventoryEngine(inventory)
+
+@st.cache_resource
+def get_upload_cache():
+    """Parsed uploads shared by every session, so reruns don't parse the same file again"""
+    return UploadCache()
+
+upload_cache = get_upload_cache()
+
+# Timings from every session go to one metrics log
+if recorder.log_file != METRICS_FILE:
+    recorder.log_to(METRICS_FILE)
+
+@st.cache_resource
+def get_session_tracker():
+    """Last-seen times of every browser session, for the active session gauge"""
+    return SessionTracker()
+
+sessions = get_session_tracker()
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+sessions.touch(st.session_state.session_id)
 
-def load_data():
-    """Load data from JSON file"""
-    if os.path.exists(DATA_FILE):
+@st.cache_resource
+def get_metrics_exporter():
+    """Prometheus exporter shared by every session, serving the configured port and/or textfile"""
+    exporter = MetricsExporter(inventory, [DATA_FILE, JOURNAL_FILE, SQLITE_FILE], sessions)
+    exporter.status = []
+    port = DEFAULT_SETTINGS.get("metrics_http_port")
+    if port:
         try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                st.session_state.stock_data = data.get("stock_data", {})
-                st.session_state.transactions = data.get("transactions", [])
-                st.session_state.parent_items = data.get("parent_items", {})
-                st.session_state.packet_variations = data.get("packet_variations", {})
-                st.session_state.daily_opening_stock = data.get("daily_opening_stock", {})
-                st.session_state.return_data = data.get("return_data", {})
-                st.session_state.return_transactions = data.get("return_transactions", [])
-        except Exception as e:
-            st.error(f"Error loading data: {e}")
-            initialize_sample_data()
-    else:
-        initialize_sample_data()
+            start_http_exporter(exporter, port)
+            exporter.status.append(f"Serving http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            exporter.status.append(f"Could not serve metrics on port {port}: {e}")
+    textfile = DEFAULT_SETTINGS.get("metrics_textfile")
+    if textfile:
+        start_textfile_writer(exporter, textfile, DEFAULT_SETTINGS.get("metrics_textfile_interval", 15))
+        exporter.status.append(f"Writing {textfile} every {DEFAULT_SETTINGS.get('metrics_textfile_interval', 15)}s")
+    return exporter
 
-# Initialize session state
-if 'initialized' not in st.session_state:
-    st.session_state.initialized = False
+metrics_exporter = get_metrics_exporter()
 
-if not st.session_state.initialized:
-    load_data()
-    # Ensure return data is initialized for existing users
-    if not hasattr(st.session_state, 'return_data') or not st.session_state.return_data:
-        st.session_state.return_data = {}
-        for parent_id in st.session_state.parent_items:
-            st.session_state.return_data[parent_id] = {
-                "loose_return": {"good": 0, "bad": 0},
-                "packed_return": {}
-            }
-            for asin in st.session_state.packet_variations.get(parent_id, {}):
-                st.session_state.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
-    
-    if not hasattr(st.session_state, 'return_transactions') or not st.session_state.return_transactions:
-        st.session_state.return_transactions = []
-    
-    # Add reorder level to existing parent items (backward compatibility)
-    for parent_id, parent_info in st.session_state.parent_items.items():
-        if "reorder_level" not in parent_info:
-            parent_info["reorder_level"] = 5.0  # Default reorder level of 5kg
-    
-    st.session_state.initialized = True
+# Bulk uploads run on a background worker shared by all sessions
+job_runner = get_job_runner(JOBS_FILE, inventory, BULK_JOBS)
 
-def record_transaction(transaction_type, parent_id, asin=None, quantity=0, weight=0, notes="", batch_id=None, transaction_date=None):
-    """Record a transaction and return transaction ID"""
-    transaction_id = len(st.session_state.transactions) + 1
-    
-    # Use provided date or default to today
-    if transaction_date is None:
-        transaction_date = datetime.date.today()
-    
-    transaction = {
-        "id": transaction_id,
-        "timestamp": datetime.datetime.now().isoformat(),
-        "date": transaction_date.isoformat(),
-        "type": transaction_type,
-        "parent_id": parent_id,
-        "parent_name": st.session_state.parent_items[parent_id]["name"],
-        "asin": asin,
-        "quantity": quantity,
-        "weight": weight,
-        "notes": notes
-    }
+def job_in_progress(job_key):
+    """Whether the background job kept under job_key in session state is still queued or running"""
+    job_id = st.session_state.get(job_key)
+    job = job_runner.get(job_id) if job_id else None
+    return job is not None and job["status"] not in FINISHED_STATUSES
+
+def show_job_status(job_key, show_result):
+    """Show the background job whose ID is kept under job_key in session state, polling until it finishes"""
+    job_id = st.session_state.get(job_key)
+    if not job_id:
+        return
     
-    # Add batch information if provided
-    if batch_id:
-        transaction["batch_id"] = batch_id
+    job = job_runner.get(job_id)
+    if job is None:
+        del st.session_state[job_key]
+    elif job["status"] not in FINISHED_STATUSES:
+        poll_job(job_id)
+    elif job["status"] == "done":
+        show_result(job["result"])
+    else:
+        st.error(f"❌ **Background job {job['status']}:** {job['error']}")
+
+@st.fragment(run_every=1)
+def poll_job(job_id):
+    """Progress of a running background job, refreshed every second until it finishes"""
+    job = job_runner.get(job_id)
+    if job["status"] in FINISHED_STATUSES:
+        # Rerun the whole page so it shows the result and the updated stock
+        st.rerun()
     
-    st.session_state.transactions.append(transaction)
-    save_data()
-    return transaction_id
+    st.progress(job["progress"] or 0.0, text=f"⏳ {job['message']}")
+    st.caption(f"Job `{job_id}` is running in the background - you can leave this page and come back for the result")
+
+def cached_upload(uploaded_file):
+    """Read an uploaded file into one DataFrame, reusing the result while the same file stays uploaded"""
+    key = ("upload", uploaded_file.name.lower(), upload_digest(uploaded_file))
+    return upload_cache.get_or_build(key, lambda: read_upload(uploaded_file))
 
 def get_clean_product_description(parent_id, asin):
     """Get a clean product description, handling NaN and empty values"""
-    if (parent_id not in st.session_state.packet_variations or 
-        asin not in st.session_state.packet_variations[parent_id]):
+    if (parent_id not in inventory.packet_variations or 
+        asin not in inventory.packet_variations[parent_id]):
         return f"Unknown Product ({asin})"
     
-    details = st.session_state.packet_variations[parent_id][asin]
+    details = inventory.packet_variations[parent_id][asin]
     weight = details.get('weight', 1.0)
     description = details.get('description', '')
     
     # Clean up description - handle NaN and empty values
     if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-        parent_name = st.session_state.parent_items.get(parent_id, {}).get('name', 'Unknown Product')
+        parent_name = inventory.parent_items.get(parent_id, {}).get('name', 'Unknown Product')
         description = f"{weight}kg {parent_name}"
     
     return f"{description} ({weight}kg)"
 
 def can_undo_transaction(transaction_id):
     """Check if a transaction can be undone (based on recording time, not transaction date)"""
-    from config import DEFAULT_SETTINGS
-    
-    if not st.session_state.transactions:
-        return False, "No transactions found"
-    
-    # Find transaction
-    transaction = None
-    for t in st.session_state.transactions:
-        if t["id"] == transaction_id:
-            transaction = t
-            break
-    
-    if not transaction:
-        return False, "Transaction not found"
-    
-    # Get configuration
-    undo_window_hours = DEFAULT_SETTINGS.get("undo_window_hours", 24)
-    max_recent_transactions = DEFAULT_SETTINGS.get("max_recent_transactions", 50)
-    
-    # Check if transaction was recorded recently (within configured window)
-    # Use timestamp (when recorded) not date (transaction date)
-    try:
-        recorded_time = datetime.datetime.fromisoformat(transaction["timestamp"])
-        current_time = datetime.datetime.now()
-        time_diff = current_time - recorded_time
-        
-        # Allow undo if recorded within configured window
-        if time_diff.total_seconds() > undo_window_hours * 60 * 60:  # Convert hours to seconds
-            return False, f"Can only undo transactions recorded within last {undo_window_hours} hours"
-    except:
-        # Fallback to old logic if timestamp parsing fails
-        today = datetime.date.today().isoformat()
-        if transaction.get("date") != today:
-            return False, "Can only undo transactions from today"
-    
-    # Check if it's one of the recent transactions (safety limit)
-    recent_transactions = st.session_state.transactions[-max_recent_transactions:]
-    if transaction not in recent_transactions:
-        return False, f"Can only undo recent transactions (last {max_recent_transactions})"
-    
-    return True, "OK"
+    return engine.can_undo_transaction(transaction_id)
 
 def undo_transaction(transaction_id):
     """Undo a specific transaction and reverse its effects"""
     try:
-        # Find the transaction
-        transaction = None
-        transaction_index = None
-        for i, t in enumerate(st.session_state.transactions):
-            if t["id"] == transaction_id:
-                transaction = t
-                transaction_index = i
-                break
-        
-        if not transaction:
-            st.error("Transaction not found!")
-            return False
-        
-        # Check if can undo
-        can_undo, reason = can_undo_transaction(transaction_id)
-        if not can_undo:
-            st.error(f"Cannot undo: {reason}")
-            return False
-        
-        # Reverse the transaction effects
-        parent_id = transaction["parent_id"]
-        trans_type = transaction["type"]
-        quantity = transaction.get("quantity", 0)
-        weight = transaction.get("weight", 0)
-        asin = transaction.get("asin")
-        
-        if parent_id not in st.session_state.stock_data:
-            st.error("Parent product not found!")
-            return False
-        
-        # Reverse based on transaction type
-        if trans_type == "Stock Inward":
-            # Check if we can safely remove the inward stock
-            current_loose = st.session_state.stock_data[parent_id]["loose_stock"]
-            if current_loose < weight:
-                st.error(f"Cannot undo: Would result in negative stock (Current: {current_loose} kg, Trying to remove: {weight} kg)")
-                return False
-            # Remove the inward stock
-            st.session_state.stock_data[parent_id]["loose_stock"] -= weight
-            
-        elif trans_type == "Packing":
-            # Check if we can safely reverse packing
-            if asin and asin in st.session_state.stock_data[parent_id]["packed_stock"]:
-                current_packed = st.session_state.stock_data[parent_id]["packed_stock"][asin]
-                if current_packed < quantity:
-                    st.error(f"Cannot undo: Would result in negative packed stock (Current: {current_packed}, Trying to remove: {quantity})")
-                    return False
-            # Reverse packing: add back loose stock, remove packed units
-            st.session_state.stock_data[parent_id]["loose_stock"] += weight
-            if asin and asin in st.session_state.stock_data[parent_id]["packed_stock"]:
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity
-            
-        elif "Sale" in trans_type:
-            # Reverse sale: add back packed stock
-            if asin and asin in st.session_state.stock_data[parent_id]["packed_stock"]:
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] += quantity
-        
-        # Remove the transaction from history
-        st.session_state.transactions.pop(transaction_index)
-        
-        # Update timestamp
-        st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-        
-        # Save data
-        save_data()
-        
-        # Show success message with details
-        if trans_type == "Stock Inward":
-            st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (-{weight} kg)")
-        elif trans_type == "Packing":
-            st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (+{weight} kg loose, -{quantity} packed)")
-        elif "Sale" in trans_type:
-            st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (+{quantity} units)")
-        else:
-            st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']}")
-        return True
-        
+        transaction = engine.undo_transaction(transaction_id)
+    except InventoryError as e:
+        st.error(str(e))
+        return False
     except Exception as e:
         st.error(f"Error undoing transaction: {e}")
         return False
+            
+    # Show success message with details
+    trans_type = transaction["type"]
+    if trans_type == "Stock Inward":
+        st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (-{transaction.get('weight', 0)} kg)")
+    elif trans_type == "Packing":
+        st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (+{transaction.get('weight', 0)} kg loose, -{transaction.get('quantity', 0)} packed)")
+    elif "Sale" in trans_type:
+        st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']} (+{transaction.get('quantity', 0)} units)")
+    else:
+        st.success(f"✅ Successfully undone: {trans_type} for {transaction['parent_name']}")
+    return True
 
 def can_undo_batch(batch_id):
     """Check if an entire batch can be undone (based on recording time)"""
-    from config import DEFAULT_SETTINGS
-    
-    # Find all transactions in the batch
-    batch_transactions = [t for t in st.session_state.transactions if t.get("batch_id") == batch_id]
-    
-    if not batch_transactions:
-        return False, "Batch not found"
-    
-    # Get configuration
-    undo_window_hours = DEFAULT_SETTINGS.get("undo_window_hours", 24)
-    
-    # Check if batch was recorded recently (within configured window)
-    try:
-        # Get the latest transaction timestamp in the batch
-        latest_timestamp = max(t.get("timestamp") for t in batch_transactions)
-        recorded_time = datetime.datetime.fromisoformat(latest_timestamp)
-        current_time = datetime.datetime.now()
-        time_diff = current_time - recorded_time
-        
-        # Allow undo if recorded within configured window
-        if time_diff.total_seconds() > undo_window_hours * 60 * 60:  # Convert hours to seconds
-            return False, f"Can only undo batches recorded within last {undo_window_hours} hours"
-    except:
-        # Fallback to old logic if timestamp parsing fails
-        today = datetime.date.today().isoformat()
-        for transaction in batch_transactions:
-            if transaction.get("date") != today:
-                return False, "Can only undo batches from today"
-    
-    # Check if there are subsequent transactions affecting the same ASINs
-    batch_asins = set(t.get("asin") for t in batch_transactions if t.get("asin"))
-    latest_batch_time = max(t.get("timestamp") for t in batch_transactions)
-    
-    # Look for any transactions after the batch that affect the same ASINs
-    for transaction in st.session_state.transactions:
-        if (transaction.get("timestamp", "") > latest_batch_time and 
-            transaction.get("asin") in batch_asins and
-            transaction.get("batch_id") != batch_id):
-            return False, f"Cannot undo: Activity found after batch on ASIN {transaction.get('asin')}"
-    
-    return True, "OK"
+    return engine.can_undo_batch(batch_id)
 
 def undo_batch(batch_id):
     """Undo an entire batch of transactions"""
-    try:
-        # Check if batch has already been undone
-        if 'undone_batches' in st.session_state and batch_id in st.session_state.undone_batches:
-            st.error("❌ This batch has already been undone!")
-            return False
-        
-        # Validate batch can be undone
-        can_undo, reason = can_undo_batch(batch_id)
-        if not can_undo:
-            st.error(f"Cannot undo batch: {reason}")
-            return False
-        
-        # Find all transactions in the batch
-        batch_transactions = [t for t in st.session_state.transactions if t.get("batch_id") == batch_id]
-        
-        if not batch_transactions:
-            st.error("Batch not found!")
-            return False
-        
-        # Group transactions by parent and ASIN for efficient processing
-        stock_adjustments = {}
-        
-        for transaction in batch_transactions:
-            parent_id = transaction["parent_id"]
-            asin = transaction.get("asin")
-            quantity = transaction.get("quantity", 0)
-            weight = transaction.get("weight", 0)
-            trans_type = transaction["type"]
-            
-            if parent_id not in stock_adjustments:
-                stock_adjustments[parent_id] = {"loose": 0, "packed": {}}
-            
-            # Calculate stock adjustment needed based on transaction type
-            if "Sale" in trans_type:
-                # For all types of sales (FBA Sale, Easy Ship Sale, etc.), add stock back
-                if asin:
-                    if asin not in stock_adjustments[parent_id]["packed"]:
-                        stock_adjustments[parent_id]["packed"][asin] = 0
-                    stock_adjustments[parent_id]["packed"][asin] += quantity
-            elif trans_type == "Stock Inward":
-                # For stock inward, remove the added loose stock
-                stock_adjustments[parent_id]["loose"] -= weight
-            elif trans_type == "Packing":
-                # For packing, add back loose stock and remove packed units
-                stock_adjustments[parent_id]["loose"] += weight
-                if asin:
-                    if asin not in stock_adjustments[parent_id]["packed"]:
-                        stock_adjustments[parent_id]["packed"][asin] = 0
-                    stock_adjustments[parent_id]["packed"][asin] -= quantity
-        
-        # Apply stock adjustments
-        for parent_id, adjustments in stock_adjustments.items():
-            # Ensure parent exists in stock data
-            if parent_id not in st.session_state.stock_data:
-                st.error(f"Parent product {parent_id} not found in stock data!")
-                continue
-            
-            # Apply loose stock adjustments
-            if adjustments["loose"] != 0:
-                if "loose_stock" not in st.session_state.stock_data[parent_id]:
-                    st.session_state.stock_data[parent_id]["loose_stock"] = 0
-                st.session_state.stock_data[parent_id]["loose_stock"] += adjustments["loose"]
-            
-            # Apply packed stock adjustments
-            for asin, quantity_to_add in adjustments["packed"].items():
-                # Ensure packed_stock structure exists
-                if "packed_stock" not in st.session_state.stock_data[parent_id]:
-                    st.session_state.stock_data[parent_id]["packed_stock"] = {}
-                
-                # Ensure ASIN exists in packed_stock
-                if asin not in st.session_state.stock_data[parent_id]["packed_stock"]:
-                    st.session_state.stock_data[parent_id]["packed_stock"][asin] = 0
-                
-                # Apply the adjustment
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] += quantity_to_add
+    # Check if batch has already been undone
+    if 'undone_batches' in st.session_state and batch_id in st.session_state.undone_batches:
+        st.error("❌ This batch has already been undone!")
+        return False
             
-            st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-        
-        # Remove all transactions in the batch
-        st.session_state.transactions = [
-            t for t in st.session_state.transactions 
-            if t.get("batch_id") != batch_id
-        ]
-        
-        save_data()
-        
-        batch_size = len(batch_transactions)
-        batch_type = batch_transactions[0].get("type", "Unknown")
-        
-        st.success(f"✅ Successfully undone batch: {batch_type} ({batch_size} transactions)")
-        return True
-        
+    try:
+        batch_transactions = engine.undo_batch(batch_id)
+    except InventoryError as e:
+        st.error(str(e))
+        return False
     except Exception as e:
         st.error(f"Error undoing batch: {e}")
         return False
+            
+    batch_type = batch_transactions[0].get("type", "Unknown")
+    st.success(f"✅ Successfully undone batch: {batch_type} ({len(batch_transactions)} transactions)")
+    return True
 
 def get_recent_transactions(limit=8):
     """Get recent transactions from today"""
     today = datetime.date.today().isoformat()
-    today_transactions = []
-    
-    # Get all transactions from today
-    for transaction in reversed(st.session_state.transactions):
-        if transaction.get("date") == today:
-            today_transactions.append(transaction)
-            if len(today_transactions) >= limit:
-                break
     
-    return today_transactions
+    # Newest first, straight from today's bucket
+    return inventory.transactions_on(today)[::-1][:limit]
 
 def show_debug_info():
     """Show debug information about current state"""
@@ -473,15 +287,15 @@ def show_debug_info():
         st.sidebar.write(f"Show Undo: {st.session_state.last_transaction.get('show_undo', False)}")
     
     st.sidebar.write("**Recent Transactions:**")
-    if st.session_state.transactions:
-        recent = st.session_state.transactions[-3:]
+    if inventory.transactions:
+        recent = inventory.transactions[-3:]
         for t in recent:
             st.sidebar.write(f"• {t['id']}: {t['type']} - {t.get('weight', 0)}kg")
     
     st.sidebar.write("**Stock Data Sample:**")
-    if st.session_state.stock_data:
-        for pid, stock in list(st.session_state.stock_data.items())[:2]:
-            product_name = st.session_state.parent_items.get(pid, {}).get('name', pid)
+    if inventory.stock_data:
+        for pid, stock in list(inventory.snapshot("stock_data").items())[:2]:
+            product_name = inventory.parent_items.get(pid, {}).get('name', pid)
             st.sidebar.write(f"• {product_name}: {stock.get('loose_stock', 0)} kg")
 
 def show_immediate_undo(transaction_id, transaction_summary):
@@ -514,123 +328,27 @@ def show_batch_undo_option(batch_id, batch_description, batch_size):
 def get_today_transactions():
     """Get all transactions from today"""
     today = datetime.date.today().isoformat()
-    today_transactions = []
-    
-    for transaction in st.session_state.transactions:
-        if transaction.get("date") == today:
-            today_transactions.append(transaction)
-    
-    return today_transactions
+    return inventory.transactions_on(today)
 
 def calculate_opening_stock():
     """Calculate or retrieve opening stock for today"""
     today = datetime.date.today().isoformat()
     
-    # Check if we have opening stock data for today
-    if "daily_opening_stock" not in st.session_state:
-        st.session_state.daily_opening_stock = {}
-    
-    if today not in st.session_state.daily_opening_stock:
-        # If no opening stock for today, use current stock as opening
-        # (This happens on first run or new day)
-        opening_stock = {}
-        for parent_id, stock_data in st.session_state.stock_data.items():
-            opening_stock[parent_id] = {
-                "loose_stock": stock_data.get("loose_stock", 0),
-                "packed_stock": stock_data.get("packed_stock", {}).copy()
-            }
-        st.session_state.daily_opening_stock[today] = opening_stock
-        save_data()
-    
-    return st.session_state.daily_opening_stock[today]
-
-def calculate_activity_summary(parent_id, today_transactions):
-    """Calculate activity summary for a parent product today"""
-    activity = {
-        "stock_inward": 0,
-        "packing_out": 0,  # loose stock used in packing
-        "packing_in": {},  # units created by packing per ASIN
-        "fba_sales": {},   # FBA sales per ASIN
-        "easy_ship_sales": {},  # Easy Ship sales per ASIN
-        "other_changes": 0,
-        "activity_details": []
-    }
-    
-    for transaction in today_transactions:
-        if transaction.get("parent_id") == parent_id:
-            trans_type = transaction.get("type", "")
-            weight = transaction.get("weight", 0)
-            quantity = transaction.get("quantity", 0)
-            asin = transaction.get("asin", "")
-            timestamp = transaction.get("timestamp", "")
-            
-            # Parse time for display
-            try:
-                time_obj = datetime.datetime.fromisoformat(timestamp)
-                time_str = time_obj.strftime("%H:%M")
-            except:
-                time_str = "00:00"
-            
-            if trans_type == "Stock Inward":
-                activity["stock_inward"] += weight
-                activity["activity_details"].append({
-                    "time": time_str,
-                    "type": "Stock Inward",
-                    "amount": weight,
-                    "unit": "kg",
-                    "notes": transaction.get("notes", "")
-                })
-                
-            elif trans_type == "Packing":
-                activity["packing_out"] += weight  # loose stock used
-                if asin not in activity["packing_in"]:
-                    activity["packing_in"][asin] = 0
-                activity["packing_in"][asin] += quantity
-                activity["activity_details"].append({
-                    "time": time_str,
-                    "type": "Packing",
-                    "amount": f"-{weight}kg → +{quantity} units",
-                    "asin": asin,
-                    "notes": transaction.get("notes", "")
-                })
-                
-            elif "FBA Sale" in trans_type:
-                if asin not in activity["fba_sales"]:
-                    activity["fba_sales"][asin] = 0
-                activity["fba_sales"][asin] += quantity
-                activity["activity_details"].append({
-                    "time": time_str,
-                    "type": "FBA Sale",
-                    "amount": quantity,
-                    "asin": asin,
-                    "notes": transaction.get("notes", "")
-                })
-                
-            elif "Easy Ship Sale" in trans_type:
-                if asin not in activity["easy_ship_sales"]:
-                    activity["easy_ship_sales"][asin] = 0
-                activity["easy_ship_sales"][asin] += quantity
-                activity["activity_details"].append({
-                    "time": time_str,
-                    "type": "Easy Ship Sale",
-                    "amount": quantity,
-                    "asin": asin,
-                    "notes": transaction.get("notes", "")
-                })
-                
-            else:
-                # Other changes (adjustments, etc.)
-                if "weight" in transaction:
-                    activity["other_changes"] += weight
-                activity["activity_details"].append({
-                    "time": time_str,
-                    "type": trans_type,
-                    "amount": weight if weight else quantity,
-                    "asin": asin,
-                    "notes": transaction.get("notes", "")
-                })
+    # Check if we have opening stock data for today (under the lock, so only one session creates it)
+    with inventory.lock:
+        if today not in inventory.daily_opening_stock:
+            # If no opening stock for today, use current stock as opening
+            # (This happens on first run or new day)
+            opening_stock = {}
+            for parent_id, stock_data in inventory.stock_data.items():
+                opening_stock[parent_id] = {
+                    "loose_stock": stock_data.get("loose_stock", 0),
+                    "packed_stock": stock_data.get("packed_stock", {}).copy()
+                }
+            inventory.daily_opening_stock[today] = opening_stock
+            save_data()
     
-    return activity
+        return inventory.daily_opening_stock[today]
 
 def show_live_stock_view():
     """Display the Live Stock View dashboard in tabular format"""
@@ -652,8 +370,12 @@ def show_live_stock_view():
             export_daily_report()
     
     # Get today's data
-    today_transactions = get_today_transactions()
     opening_stock = calculate_opening_stock()
+    activities = inventory.activity_on(today)
+    # Copies taken under the lock, so writes from other sessions can't change them mid-render
+    parent_items = inventory.snapshot("parent_items")
+    stock_data = inventory.snapshot("stock_data")
+    packet_variations = inventory.snapshot("packet_variations")
     
     # Filter options
     st.subheader("🎛️ View Options")
@@ -670,13 +392,13 @@ def show_live_stock_view():
     # Build table data
     table_data = []
     
-    for parent_id, parent_info in st.session_state.parent_items.items():
+    for parent_id, parent_info in parent_items.items():
         # Get current and opening stock
-        current_stock = st.session_state.stock_data.get(parent_id, {})
+        current_stock = stock_data.get(parent_id, {})
         opening_data = opening_stock.get(parent_id, {})
         
-        # Calculate activity
-        activity = calculate_activity_summary(parent_id, today_transactions)
+        # Today's activity
+        activity = activities.get(parent_id) or empty_activity_summary()
         
         # Check if item has activity or stock
         has_activity = (activity["stock_inward"] != 0 or 
@@ -714,7 +436,7 @@ def show_live_stock_view():
         # Add loose stock row with reorder level highlighting
         opening_loose = opening_data.get("loose_stock", 0)
         loose_change = current_loose - opening_loose
-        reorder_level = st.session_state.parent_items.get(parent_id, {}).get("reorder_level", 5.0)
+        reorder_level = parent_items.get(parent_id, {}).get("reorder_level", 5.0)
         
         # Format values with colors
         def format_change(value, unit=""):
@@ -745,8 +467,8 @@ def show_live_stock_view():
         })
         
         # Add packed stock variations
-        if parent_id in st.session_state.packet_variations:
-            variations = st.session_state.packet_variations[parent_id]
+        if parent_id in packet_variations:
+            variations = packet_variations[parent_id]
             packed_stock = current_stock.get("packed_stock", {})
             opening_packed = opening_data.get("packed_stock", {})
             
@@ -768,7 +490,7 @@ def show_live_stock_view():
                 
                 # Clean up description - remove 'nan' and create proper description
                 if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                    parent_name = st.session_state.parent_items[parent_id]["name"]
+                    parent_name = parent_items[parent_id]["name"]
                     description = f"{weight}kg {parent_name}"
                 
                 # Determine prefix (├ or └)
@@ -863,31 +585,31 @@ def show_live_stock_view():
         st.markdown(html_table, unsafe_allow_html=True)
         
         # Activity summary
-        if today_transactions:
+        if activities:
             st.subheader("📊 Today's Activity Summary")
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                total_inward = sum(t.get("weight", 0) for t in today_transactions if t.get("type") == "Stock Inward")
+                total_inward = sum(a["stock_inward"] for a in activities.values())
                 st.metric("Stock Inward", f"{total_inward:.1f} kg")
             
             with col2:
-                total_packed = len([t for t in today_transactions if t.get("type") == "Packing"])
+                total_packed = sum(a["packing_operations"] for a in activities.values())
                 st.metric("Packing Operations", total_packed)
             
             with col3:
-                total_fba = sum(t.get("quantity", 0) for t in today_transactions if "FBA Sale" in t.get("type", ""))
+                total_fba = sum(sum(a["fba_sales"].values()) for a in activities.values())
                 st.metric("FBA Sales", f"{total_fba} units")
             
             with col4:
-                total_easy_ship = sum(t.get("quantity", 0) for t in today_transactions if "Easy Ship Sale" in t.get("type", ""))
+                total_easy_ship = sum(sum(a["easy_ship_sales"].values()) for a in activities.values())
                 st.metric("Easy Ship Sales", f"{total_easy_ship} units")
         
         # Reorder Level Alerts Summary
         st.subheader("🚨 Reorder Level Alerts")
         reorder_alerts = []
-        for parent_id, parent_info in st.session_state.parent_items.items():
-            current_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
+        for parent_id, parent_info in parent_items.items():
+            current_loose = stock_data.get(parent_id, {}).get("loose_stock", 0)
             reorder_level = parent_info.get("reorder_level", 5.0)
             if current_loose <= reorder_level:
                 reorder_alerts.append({
@@ -917,15 +639,19 @@ def show_live_stock_view():
 def export_daily_report():
     """Export today's stock report in clean format without emojis"""
     today = datetime.date.today()
-    today_transactions = get_today_transactions()
     opening_stock = calculate_opening_stock()
+    activities = inventory.activity_on(today)
+    # Copies taken under the lock, so writes from other sessions can't change them mid-render
+    parent_items = inventory.snapshot("parent_items")
+    stock_data = inventory.snapshot("stock_data")
+    packet_variations = inventory.snapshot("packet_variations")
     
     report_data = []
     
-    for parent_id, parent_info in st.session_state.parent_items.items():
-        current_stock = st.session_state.stock_data.get(parent_id, {})
+    for parent_id, parent_info in parent_items.items():
+        current_stock = stock_data.get(parent_id, {})
         opening_data = opening_stock.get(parent_id, {})
-        activity = calculate_activity_summary(parent_id, today_transactions)
+        activity = activities.get(parent_id) or empty_activity_summary()
         
         # Calculate total loose change
         opening_loose = opening_data.get("loose_stock", 0)
@@ -969,8 +695,8 @@ def export_daily_report():
         })
         
         # Add ALL packed stock variations (clean format)
-        if parent_id in st.session_state.packet_variations:
-            variations = st.session_state.packet_variations[parent_id]
+        if parent_id in packet_variations:
+            variations = packet_variations[parent_id]
             packed_stock = current_stock.get("packed_stock", {})
             opening_packed = opening_data.get("packed_stock", {})
             
@@ -984,7 +710,7 @@ def export_daily_report():
                 
                 # Clean up description (same logic as Live Stock View)
                 if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                    parent_name = st.session_state.parent_items[parent_id]["name"]
+                    parent_name = parent_items[parent_id]["name"]
                     clean_description = f"{weight}kg {parent_name}"
                 else:
                     clean_description = description
@@ -1030,7 +756,28 @@ def main():
         "Select Page",
         ["Live Stock View", "Stock Inward", "Packing Operations", "FBA Sales", "Easy Ship Sales", "Returns", "Products Management"]
     )
+    show_metrics = st.sidebar.checkbox("📈 Show performance metrics")
+    
+    # Profile this render if asked from the sidebar or with ?profile=1 (which is then dropped, so only one render is profiled)
+    profile = st.sidebar.button("🔬 Profile next render", help="Render this page once under cProfile and tracemalloc")
+    if st.query_params.get("profile") == "1":
+        profile = True
+        del st.query_params["profile"]
+    
+    with timer(f"page: {page}", profiled=profile):
+        if profile:
+            _, st.session_state.last_profile = profile_call(page, show_page, page)
+        else:
+            show_page(page)
+    
+    if st.session_state.get("last_profile"):
+        show_profile_results(st.session_state.last_profile)
     
+    if show_metrics:
+        show_metrics_panel()
+
+def show_page(page):
+    """Render the selected page"""
     if page == "Live Stock View":
         show_live_stock_view()
     elif page == "Stock Inward":
@@ -1046,17 +793,79 @@ def main():
     elif page == "Products Management":
         show_products_management_protected()
 
+def show_profile_results(capture):
+    """Inline summary of the last profiled render, with the pstats and tracemalloc dumps to download"""
+    top_n = DEFAULT_SETTINGS.get("profile_top_n", 25)
+    
+    st.markdown("---")
+    st.subheader(f"🔬 Profile: {capture.name}")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Render Time", f"{capture.seconds:.3f} s")
+    with col2:
+        st.metric("Peak Traced Memory", f"{capture.peak_bytes / (1024 * 1024):,.1f} MB")
+    
+    st.write(f"**Top {top_n} functions by cumulative time:**")
+    st.code(capture.top_functions(top_n), language="text")
+    
+    st.write(f"**Top {top_n} allocation sites still held after the render:**")
+    st.dataframe(pd.DataFrame(capture.top_allocations(top_n)), use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("📥 Download pstats", capture.stats_bytes(), file_name=capture.file_name("pstats"), use_container_width=True)
+    with col2:
+        st.download_button("📥 Download tracemalloc snapshot", capture.snapshot_bytes(), file_name=capture.file_name("tracemalloc"), use_container_width=True)
+    with col3:
+        if st.button("Dismiss profile", use_container_width=True):
+            del st.session_state.last_profile
+            st.rerun()
+
+def show_metrics_panel():
+    """Admin panel with the recent page, save/load and bulk timings and the running counters"""
+    st.markdown("---")
+    st.subheader("📈 Performance Metrics")
+    st.caption(f"Last {recorder.events.maxlen} timings in memory; every timing is also appended to {METRICS_FILE}")
+    st.caption("Prometheus exporter: " + ("; ".join(metrics_exporter.status) or "off (set metrics_http_port or metrics_textfile in config.py)"))
+    
+    counters = recorder.counter_values()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Rows Processed", f"{counters.get('rows_processed', 0):,}")
+    with col2:
+        st.metric("Bytes Written", f"{counters.get('bytes_written', 0) / (1024 * 1024):,.2f} MB")
+    
+    summary = recorder.summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+        with st.expander("Recent timings"):
+            st.dataframe(pd.DataFrame(recorder.recent(100)), use_container_width=True, hide_index=True)
+    else:
+        st.info("No timings recorded yet")
+    
+    with st.expander("Prometheus metrics"):
+        st.code(metrics_exporter.render(), language="text")
+    
+    if st.button("Clear recent timings"):
+        recorder.clear()
+        st.rerun()
+
 def show_dashboard():
     """Display main dashboard"""
     st.header("Stock Dashboard")
     
+    # Copies taken under the lock, so writes from other sessions can't change them mid-render
+    parent_items = inventory.snapshot("parent_items")
+    stock_data = inventory.snapshot("stock_data")
+    packet_variations = inventory.snapshot("packet_variations")
+    
     # Quick stats
     col1, col2, col3, col4 = st.columns(4)
     
-    total_loose = sum(stock.get("loose_stock", 0) for stock in st.session_state.stock_data.values())
-    total_packed_items = sum(sum(stock.get("packed_stock", {}).values()) for stock in st.session_state.stock_data.values())
-    total_products = len(st.session_state.parent_items)
-    total_asins = sum(len(variations) for variations in st.session_state.packet_variations.values())
+    total_loose = sum(stock.get("loose_stock", 0) for stock in stock_data.values())
+    total_packed_items = sum(sum(stock.get("packed_stock", {}).values()) for stock in stock_data.values())
+    total_products = len(parent_items)
+    total_asins = sum(len(variations) for variations in packet_variations.values())
     
     with col1:
         st.metric("Total Loose Stock", f"{total_loose:.2f} kg")
@@ -1070,21 +879,21 @@ def show_dashboard():
     # Current Stock Overview
     st.subheader("Current Stock Overview")
     
-    if st.session_state.stock_data:
+    if stock_data:
         stock_overview = []
-        for parent_id, stock in st.session_state.stock_data.items():
+        for parent_id, stock in stock_data.items():
             total_packed_weight = 0
             total_packed_units = 0
             
             for asin, units in stock.get("packed_stock", {}).items():
-                if asin in st.session_state.packet_variations.get(parent_id, {}):
-                    weight_per_unit = st.session_state.packet_variations[parent_id][asin]["weight"]
+                if asin in packet_variations.get(parent_id, {}):
+                    weight_per_unit = packet_variations[parent_id][asin]["weight"]
                     total_packed_weight += units * weight_per_unit
                     total_packed_units += units
             
             stock_overview.append({
-                "Product": st.session_state.parent_items[parent_id]["name"],
-                "Category": st.session_state.parent_items[parent_id].get("category", "General"),
+                "Product": parent_items[parent_id]["name"],
+                "Category": parent_items[parent_id].get("category", "General"),
                 "Loose Stock (kg)": stock.get("loose_stock", 0),
                 "Packed Units": total_packed_units,
                 "Packed Weight (kg)": total_packed_weight,
@@ -1209,8 +1018,8 @@ def show_stock_inward():
         with st.form("stock_inward_form"):
             parent_id = st.selectbox(
                 "Select Product",
-                options=list(st.session_state.parent_items.keys()),
-                format_func=lambda x: st.session_state.parent_items[x]["name"]
+                options=list(inventory.parent_items.keys()),
+                format_func=lambda x: inventory.parent_items[x]["name"]
             )
             
             weight = st.number_input("Weight (kg)", min_value=0.0, step=0.1, format="%.2f")
@@ -1219,26 +1028,24 @@ def show_stock_inward():
             submitted = st.form_submit_button("Add Stock")
             
             if submitted and weight > 0:
-                if parent_id not in st.session_state.stock_data:
-                    st.session_state.stock_data[parent_id] = {"loose_stock": 0, "packed_stock": {}}
-                
-                # Store original stock before adding
-                original_stock = st.session_state.stock_data[parent_id]["loose_stock"]
-                
-                st.session_state.stock_data[parent_id]["loose_stock"] += weight
-                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                
-                transaction_id = record_transaction("Stock Inward", parent_id, weight=weight, notes=notes)
-                
-                # Store transaction details for undo outside form
-                st.session_state.last_transaction = {
-                    "id": transaction_id,
-                    "summary": f"{weight} kg of {st.session_state.parent_items[parent_id]['name']} to loose stock",
-                    "show_undo": True,
-                    "original_stock": original_stock,
-                    "new_stock": st.session_state.stock_data[parent_id]["loose_stock"]
-                }
-                # Don't call st.rerun() immediately - let the undo show first
+                with inventory.lock:
+                    # Store original stock before adding
+                    original_stock = engine.loose_stock(parent_id)
+                    
+                    try:
+                        transaction_id = engine.stock_inward(parent_id, weight, notes)
+                    except InventoryError as e:
+                        st.error(str(e))
+                    else:
+                        # Store transaction details for undo outside form
+                        st.session_state.last_transaction = {
+                            "id": transaction_id,
+                            "summary": f"{weight} kg of {inventory.parent_items[parent_id]['name']} to loose stock",
+                            "show_undo": True,
+                            "original_stock": original_stock,
+                            "new_stock": inventory.stock_data[parent_id]["loose_stock"]
+                        }
+                        # Don't call st.rerun() immediately - let the undo show first
     
     # Show immediate undo outside the form - SIMPLIFIED VERSION
     if hasattr(st.session_state, 'last_transaction') and st.session_state.last_transaction.get('show_undo'):
@@ -1249,8 +1056,8 @@ def show_stock_inward():
         st.write(f"**Added:** {transaction_info['summary']}")
         
         # Show current stock levels for verification
-        parent_id = list(st.session_state.parent_items.keys())[0]  # Get first product for testing
-        current_stock = st.session_state.stock_data.get(parent_id, {}).get('loose_stock', 0)
+        parent_id = list(inventory.parent_items.keys())[0]  # Get first product for testing
+        current_stock = inventory.stock_data.get(parent_id, {}).get('loose_stock', 0)
         st.write(f"**Current loose stock:** {current_stock} kg")
         
         col1, col2 = st.columns([1, 1])
@@ -1270,11 +1077,11 @@ def show_stock_inward():
     
     with col2:
         st.subheader("Current Loose Stock")
-        if st.session_state.stock_data:
+        if inventory.stock_data:
             loose_stock_data = []
-            for parent_id, stock in st.session_state.stock_data.items():
+            for parent_id, stock in inventory.snapshot("stock_data").items():
                 loose_stock_data.append({
-                    "Product": st.session_state.parent_items[parent_id]["name"],
+                    "Product": inventory.parent_items[parent_id]["name"],
                     "Stock (kg)": stock.get("loose_stock", 0)
                 })
             
@@ -1293,20 +1100,20 @@ def show_packing_operations():
         # Product selection outside form for dynamic updates
         parent_id = st.selectbox(
             "Select Product to Pack",
-            options=list(st.session_state.parent_items.keys()),
-            format_func=lambda x: st.session_state.parent_items[x]["name"],
+            options=list(inventory.parent_items.keys()),
+            format_func=lambda x: inventory.parent_items[x]["name"],
             key="pack_parent_select"
         )
         
-        if parent_id and parent_id in st.session_state.packet_variations:
+        if parent_id and parent_id in inventory.packet_variations:
             def format_packet_option(asin_key):
-                details = st.session_state.packet_variations[parent_id][asin_key]
+                details = inventory.packet_variations[parent_id][asin_key]
                 weight = details.get('weight', 1.0)
                 description = details.get('description', '')
                 
                 # Clean up description - remove 'nan' and empty values
                 if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                    parent_name = st.session_state.parent_items[parent_id]["name"]
+                    parent_name = inventory.parent_items[parent_id]["name"]
                     description = f"{weight}kg {parent_name}"
                 
                 return f"{description} ({weight}kg)"
@@ -1314,14 +1121,14 @@ def show_packing_operations():
             # ASIN selection outside form for dynamic updates
             asin = st.selectbox(
                 "Select Packet Size",
-                options=list(st.session_state.packet_variations[parent_id].keys()),
+                options=list(inventory.packet_variations[parent_id].keys()),
                 format_func=format_packet_option,
                 key="pack_asin_select"
             )
             
             if asin:
-                packet_weight = st.session_state.packet_variations[parent_id][asin]["weight"]
-                available_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
+                packet_weight = inventory.packet_variations[parent_id][asin]["weight"]
+                available_loose = inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
                 max_packets = int(available_loose / packet_weight) if packet_weight > 0 else 0
                 
                 # Dynamic info that updates with selection changes
@@ -1343,27 +1150,23 @@ def show_packing_operations():
                     submitted = st.form_submit_button("Pack Products")
                     
                     if submitted and packets_to_pack > 0:
-                        total_weight_used = packets_to_pack * packet_weight
-                        
-                        st.session_state.stock_data[parent_id]["loose_stock"] -= total_weight_used
-                        
-                        if asin not in st.session_state.stock_data[parent_id]["packed_stock"]:
-                            st.session_state.stock_data[parent_id]["packed_stock"][asin] = 0
-                        st.session_state.stock_data[parent_id]["packed_stock"][asin] += packets_to_pack
-                        
-                        st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                        
-                        transaction_id = record_transaction("Packing", parent_id, asin, packets_to_pack, total_weight_used, notes)
-                        
-                        # Store transaction details for undo outside form
-                        description = get_clean_product_description(parent_id, asin)
-                        
-                        st.session_state.last_transaction = {
-                            "id": transaction_id,
-                            "summary": f"Packed {packets_to_pack} packets of {description} using {total_weight_used} kg",
-                            "show_undo": True
-                        }
-                        # Don't call st.rerun() immediately - let the undo show first
+                        with inventory.lock:
+                            total_weight_used = packets_to_pack * packet_weight
+                            
+                            try:
+                                transaction_id = engine.pack(parent_id, asin, packets_to_pack, notes)
+                            except InventoryError as e:
+                                st.error(str(e))
+                            else:
+                                # Store transaction details for undo outside form
+                                description = get_clean_product_description(parent_id, asin)
+                                
+                                st.session_state.last_transaction = {
+                                    "id": transaction_id,
+                                    "summary": f"Packed {packets_to_pack} packets of {description} using {total_weight_used} kg",
+                                    "show_undo": True
+                                }
+                                # Don't call st.rerun() immediately - let the undo show first
             
             # Show immediate undo outside the form - SIMPLIFIED VERSION
             if hasattr(st.session_state, 'last_transaction') and st.session_state.last_transaction.get('show_undo'):
@@ -1374,8 +1177,8 @@ def show_packing_operations():
                 st.write(f"**Operation:** {transaction_info['summary']}")
                 
                 # Show current stock levels for verification
-                current_loose = st.session_state.stock_data.get(parent_id, {}).get('loose_stock', 0)
-                current_packed = st.session_state.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
+                current_loose = inventory.stock_data.get(parent_id, {}).get('loose_stock', 0)
+                current_packed = inventory.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
                 st.write(f"**Current loose stock:** {current_loose} kg")
                 st.write(f"**Current packed units:** {current_packed}")
                 
@@ -1400,18 +1203,18 @@ def show_packing_operations():
     
     with col2:
         st.subheader("Packed Stock Summary")
-        if st.session_state.stock_data:
+        if inventory.stock_data:
             packed_summary = []
-            for parent_id, stock in st.session_state.stock_data.items():
+            for parent_id, stock in inventory.snapshot("stock_data").items():
                 for asin, units in stock.get("packed_stock", {}).items():
-                    if units > 0 and asin in st.session_state.packet_variations.get(parent_id, {}):
+                    if units > 0 and asin in inventory.packet_variations.get(parent_id, {}):
                         packed_summary.append({
-                            "Product": st.session_state.parent_items[parent_id]["name"],
+                            "Product": inventory.parent_items[parent_id]["name"],
                             "ASIN": asin,
-                            "Description": st.session_state.packet_variations[parent_id][asin]["description"],
+                            "Description": inventory.packet_variations[parent_id][asin]["description"],
                             "Units": units,
-                            "Weight per Unit": st.session_state.packet_variations[parent_id][asin]["weight"],
-                            "Total Weight": units * st.session_state.packet_variations[parent_id][asin]["weight"]
+                            "Weight per Unit": inventory.packet_variations[parent_id][asin]["weight"],
+                            "Total Weight": units * inventory.packet_variations[parent_id][asin]["weight"]
                         })
             
             if packed_summary:
@@ -1435,20 +1238,20 @@ def show_fba_sales():
             # Product selection outside form for dynamic updates
             parent_id = st.selectbox(
                 "Select Product",
-                options=list(st.session_state.parent_items.keys()),
-                format_func=lambda x: st.session_state.parent_items[x]["name"],
+                options=list(inventory.parent_items.keys()),
+                format_func=lambda x: inventory.parent_items[x]["name"],
                 key="fba_parent_select"
             )
             
-            if parent_id and parent_id in st.session_state.packet_variations:
+            if parent_id and parent_id in inventory.packet_variations:
                 def format_product_option(asin_key):
-                    details = st.session_state.packet_variations[parent_id][asin_key]
+                    details = inventory.packet_variations[parent_id][asin_key]
                     weight = details.get('weight', 1.0)
                     description = details.get('description', '')
                     
                     # Clean up description
                     if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                        parent_name = st.session_state.parent_items[parent_id]["name"]
+                        parent_name = inventory.parent_items[parent_id]["name"]
                         description = f"{weight}kg {parent_name}"
                     
                     return f"{description} ({weight}kg)"
@@ -1456,15 +1259,15 @@ def show_fba_sales():
                 # Weight variation selection
                 asin = st.selectbox(
                     "Select Weight Variation",
-                    options=list(st.session_state.packet_variations[parent_id].keys()),
+                    options=list(inventory.packet_variations[parent_id].keys()),
                     format_func=format_product_option,
                     key="fba_asin_select"
                 )
                 
                 if asin:
                     # Get current stock and product details
-                    available_units = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-                    product_details = st.session_state.packet_variations[parent_id][asin]
+                    available_units = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                    product_details = inventory.packet_variations[parent_id][asin]
                     weight = product_details.get('weight', 1.0)
                     mrp = product_details.get('mrp', 0)
                     
@@ -1536,43 +1339,40 @@ def show_fba_sales():
                         submitted = st.form_submit_button("🚚 Record FBA Sale", type="primary", use_container_width=True)
                         
                         if submitted:
-                            if available_units >= quantity_sold:
-                                # Update stock
-                                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity_sold
-                                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                                
-                                # Prepare transaction notes
-                                transaction_notes = f"FBA Sale"
-                                if order_id:
-                                    transaction_notes += f" | Order: {order_id}"
-                                if selling_price != mrp:
-                                    transaction_notes += f" | Price: ₹{selling_price}/unit"
-                                if notes:
-                                    transaction_notes += f" | {notes}"
-                                
-                                # Record transaction
-                                weight_sold = quantity_sold * weight
-                                transaction_id = record_transaction(
-                                    transaction_type="FBA Sale", 
-                                    parent_id=parent_id, 
-                                    asin=asin, 
-                                    quantity=quantity_sold, 
-                                    weight=weight_sold, 
-                                    notes=transaction_notes, 
-                                    batch_id=None, 
-                                    transaction_date=sale_date
-                                )
-                                
-                                # Store transaction details for undo outside form
-                                st.session_state.last_transaction = {
-                                    "id": transaction_id,
-                                    "summary": f"FBA sale: {quantity_sold} units of {format_product_option(asin)}",
-                                    "show_undo": True
-                                }
-                                st.balloons()
-                                # Don't call st.rerun() immediately - let the undo show first
-                            else:
-                                st.error(f"❌ Insufficient stock! Available: {available_units}, Requested: {quantity_sold}")
+                            with inventory.lock:
+                                if available_units >= quantity_sold:
+                                    # Prepare transaction notes
+                                    transaction_notes = f"FBA Sale"
+                                    if order_id:
+                                        transaction_notes += f" | Order: {order_id}"
+                                    if selling_price != mrp:
+                                        transaction_notes += f" | Price: ₹{selling_price}/unit"
+                                    if notes:
+                                        transaction_notes += f" | {notes}"
+                                    
+                                    # Record transaction
+                                    try:
+                                        transaction_id = engine.sell(
+                                            parent_id, 
+                                            asin, 
+                                            quantity_sold, 
+                                            transaction_type="FBA Sale", 
+                                            notes=transaction_notes, 
+                                            transaction_date=sale_date
+                                        )
+                                    except InventoryError as e:
+                                        st.error(str(e))
+                                    else:
+                                        # Store transaction details for undo outside form
+                                        st.session_state.last_transaction = {
+                                            "id": transaction_id,
+                                            "summary": f"FBA sale: {quantity_sold} units of {format_product_option(asin)}",
+                                            "show_undo": True
+                                        }
+                                        st.balloons()
+                                        # Don't call st.rerun() immediately - let the undo show first
+                                else:
+                                    st.error(f"❌ Insufficient stock! Available: {available_units}, Requested: {quantity_sold}")
                 else:
                     st.info("Please select a weight variation to continue")
             else:
@@ -1587,12 +1387,12 @@ def show_fba_sales():
             st.write(f"**Sale:** {transaction_info['summary']}")
             
             # Show current stock for verification (get the product info from recent transaction)
-            if st.session_state.transactions:
-                last_trans = st.session_state.transactions[-1]
+            if inventory.transactions:
+                last_trans = inventory.transactions[-1]
                 parent_id = last_trans.get('parent_id')
                 asin = last_trans.get('asin')
                 if parent_id and asin:
-                    current_packed = st.session_state.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
+                    current_packed = inventory.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
                     st.write(f"**Current stock for {asin}:** {current_packed} units")
             
             col1, col2 = st.columns([1, 1])
@@ -1612,7 +1412,7 @@ def show_fba_sales():
         
         with col2:
             st.subheader("📈 Recent FBA Sales")
-            fba_transactions = [t for t in st.session_state.transactions if "FBA Sale" in t.get("type", "")]
+            fba_transactions = [t for t in inventory.transactions if "FBA Sale" in t.get("type", "")]
             if fba_transactions:
                 recent_fba = pd.DataFrame(fba_transactions[-5:])
                 recent_fba = recent_fba.sort_values('timestamp', ascending=False)
@@ -1629,93 +1429,58 @@ def show_fba_sales():
     
     with tab2:
         st.subheader("📁 Bulk Upload FBA Sales")
-        st.info("📋 Upload your FBA sales Excel file. Review the data carefully before confirming.")
+        st.info("📋 Upload your FBA sales Excel file or Amazon report (.txt/.tsv/.csv). Review the data carefully before confirming.")
         
         # File upload
         uploaded_file = st.file_uploader(
-            "Choose your FBA Sales Excel file", 
-            type=['xlsx', 'xls'],
-            help="Excel file should contain 'ASIN' and 'Shipped' columns",
+            "Choose your FBA Sales file", 
+            type=['xlsx', 'xls', 'csv', 'txt', 'tsv'],
+            help="File should contain 'ASIN' and 'Shipped' columns",
             key="fba_file_uploader"
         )
         
+        # Confirmed uploads run on the background worker; their result stays here until the next one
+        show_job_status("fba_sales_job", show_confirmed_fba_results)
+        
         if uploaded_file is not None:
             try:
-                # Read the Excel file
-                df = pd.read_excel(uploaded_file)
+                read_status = st.empty()
+                digest = upload_digest(uploaded_file)
                 
-                # Check required columns
-                required_cols = ['ASIN', 'Shipped']
-                missing_cols = [col for col in required_cols if col not in df.columns]
+                # Sales rows only depend on the file; the review is rebuilt once stock changes
+                columns, missing_cols, sales = upload_cache.get_or_build(
+                    ("fba_parsed", digest),
+                    lambda: read_fba_upload(uploaded_file, lambda rows_read: read_status.caption(f"📥 Read {rows_read:,} rows"))
+                )
+                read_status.empty()
                 
                 if missing_cols:
                     st.error(f"❌ Missing required columns: {missing_cols}")
-                    st.write("**Available columns:** ", list(df.columns))
+                    st.write("**Available columns:** ", columns)
                 else:
-                    # Filter and prepare data for review
-                    sales_data = df[df['Shipped'] > 0].copy()
-                    
-                    if len(sales_data) == 0:
+                    if len(sales) == 0:
                         st.warning("⚠️ No sales data found (no rows with Shipped > 0)")
                         return
                     
-                    # Enrich data with product information for better review
-                    enriched_data = []
-                    
-                    for _, row in sales_data.iterrows():
-                        asin = str(row['ASIN']).strip()
-                        shipped_qty = int(row['Shipped'])
-                        
-                        # Get product info
-                        parent_id = None
-                        product_name = "Unknown Product"
-                        weight = "Unknown"
-                        current_stock = "Unknown"
-                        
-                        # Find parent_id for this ASIN
-                        for pid, variations in st.session_state.packet_variations.items():
-                            if asin in variations:
-                                parent_id = pid
-                                variation_info = variations[asin]
-                                weight = f"{variation_info.get('weight', 0)}kg"
-                                
-                                # Get product name
-                                description = variation_info.get('description', '')
-                                if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                                    parent_name = st.session_state.parent_items.get(pid, {}).get('name', 'Unknown')
-                                    product_name = f"{weight} {parent_name}"
-                                else:
-                                    product_name = description
-                                
-                                # Get current stock
-                                current_stock = st.session_state.stock_data.get(pid, {}).get("packed_stock", {}).get(asin, 0)
-                                break
-                        
-                        # Additional columns from Excel
-                        merchant_sku = str(row.get('Merchant SKU', '')).strip() if 'Merchant SKU' in row else ''
-                        fnsku = str(row.get('FNSKU', '')).strip() if 'FNSKU' in row else ''
-                        
-                        enriched_data.append({
-                            'ASIN': asin,
-                            'Product Name': product_name,
-                            'Weight': weight,
-                            'Current Stock': current_stock,
-                            'Merchant SKU': merchant_sku,
-                            'FNSKU': fnsku,
-                            'Shipped Qty': shipped_qty,
-                            'Status': 'Ready' if parent_id else 'Not Found',
-                            'parent_id': parent_id  # Hidden field for processing
-                        })
+                    # Orders already recorded by an earlier upload are left out
+                    sales, skipped_count = drop_applied_orders(sales, inventory.applied_orders, "FBA Sale")
+                    if skipped_count:
+                        st.info(f"⏭️ Skipped {skipped_count} order lines already recorded by an earlier upload")
+                    if len(sales) == 0:
+                        st.success("✅ Every order in this file has already been recorded")
+                        return
                     
-                    # Create review dataframe
-                    review_df = pd.DataFrame(enriched_data)
+                    review_df = upload_cache.get_or_build(
+                        ("fba_review", digest, inventory.version),
+                        lambda: fba_review(sales, catalog_frame(inventory))
+                    )
                     
                     # Show summary
                     st.subheader("📊 Upload Summary")
                     col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
-                        st.metric("Total Rows", len(sales_data))
+                        st.metric("Total Rows", len(review_df))
                     with col2:
                         st.metric("Total Units", review_df['Shipped Qty'].sum())
                     with col3:
@@ -1729,20 +1494,11 @@ def show_fba_sales():
                     st.subheader("📋 Review Data Before Processing")
                     st.warning("⚠️ **Please review this data carefully before confirming. Once processed, you'll need to use manual corrections for any errors.**")
                     
-                    # Display table without the hidden parent_id column
-                    display_df = review_df.drop(columns=['parent_id'])
-                    
-                    # Apply styling to highlight issues
-                    def highlight_issues(row):
-                        if row['Status'] == 'Not Found':
-                            return ['background-color: #ffebee'] * len(row)
-                        elif row['Current Stock'] != 'Unknown' and isinstance(row['Current Stock'], (int, float)) and row['Current Stock'] < row['Shipped Qty']:
-                            return ['background-color: #fff3e0'] * len(row)
-                        else:
-                            return [''] * len(row)
+                    # Display table without the hidden processing columns
+                    display_df = review_df.drop(columns=HIDDEN_REVIEW_COLUMNS)
                     
-                    # Show styled dataframe
-                    styled_df = display_df.style.apply(highlight_issues, axis=1)
+                    # Show styled dataframe, highlighting issues
+                    styled_df = display_df.style.apply(lambda _: review_styles(review_df)[display_df.columns], axis=None)
                     st.dataframe(styled_df, use_container_width=True, hide_index=True)
                     
                     # Legend for colors
@@ -1762,17 +1518,11 @@ def show_fba_sales():
                                 st.write(f"• {asin}")
                     
                     # Check for insufficient stock
-                    stock_issues = []
-                    for _, row in review_df.iterrows():
-                        if (row['Status'] == 'Ready' and 
-                            isinstance(row['Current Stock'], (int, float)) and 
-                            row['Current Stock'] < row['Shipped Qty']):
-                            stock_issues.append({
-                                'ASIN': row['ASIN'],
-                                'Product': row['Product Name'],
-                                'Available': row['Current Stock'],
-                                'Requested': row['Shipped Qty']
-                            })
+                    stock_issues = review_df[review_df['Insufficient Stock']].rename(columns={
+                        'Product Name': 'Product',
+                        'Current Stock': 'Available',
+                        'Shipped Qty': 'Requested'
+                    }).to_dict('records')
                     
                     if stock_issues:
                         st.warning(f"⚠️ **{len(stock_issues)} products have insufficient stock**. These will result in errors.")
@@ -1816,119 +1566,53 @@ def show_fba_sales():
                                     if st.button("❌ Cancel", type="secondary", use_container_width=True):
                                         st.info("Processing cancelled. You can upload a different file or make corrections.")
                             else:
-                                # Processing is in progress - process data directly without extra message
-                                # Process the data
+                                # Hand the confirmed rows to the background worker
                                 ready_rows = review_df[review_df['Status'] == 'Ready']
-                                process_confirmed_fba_sales(ready_rows)
+                                submitted = submit_confirmed_fba_sales(ready_rows)
                                 
-                                # Clear processing flag and confirmation checkbox after completion
+                                # Clear processing flag and confirmation checkbox, then show the job above
                                 st.session_state[processing_key] = False
                                 if "confirm_fba_processing" in st.session_state:
                                     del st.session_state["confirm_fba_processing"]
+                                if submitted:
+                                    st.rerun()
                         else:
                             st.info("👆 Please review the data and check the confirmation box to proceed.")
                     else:
                         st.error("❌ No products are ready to process. Please check your data and product catalog.")
                         
             except Exception as e:
-                st.error(f"❌ Error reading Excel file: {str(e)}")
-                st.write("Please ensure your file is a valid Excel format (.xlsx or .xls)")
+                st.error(f"❌ Error reading file: {str(e)}")
+                st.write("Please ensure your file is a valid Excel file (.xlsx or .xls) or tab/comma separated report (.txt, .tsv or .csv)")
 
-def process_confirmed_fba_sales(ready_rows):
-    """Process confirmed FBA sales data (simple version without undo complexity)"""
-    import datetime
-    
-    st.write("🔄 **Processing confirmed FBA sales...**")
-    
-    # Create progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Generate batch ID for this upload
+def submit_confirmed_fba_sales(ready_rows):
+    """Queue the confirmed rows of a reviewed FBA upload on the background worker (False if one is still running)"""
+    if job_in_progress("fba_sales_job"):
+        st.warning("⏳ The previous FBA upload is still being processed - wait for it to finish before confirming another")
+        return False
     batch_id = f"FBA_CONFIRMED_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+    st.session_state.fba_sales_job = job_runner.submit("fba_sales", ready_rows, batch_id)
+    return True
     
-    success_count = 0
-    error_count = 0
-    success_details = []
-    error_details = []
-    
-    total_rows = len(ready_rows)
-    
-    for index, row in ready_rows.iterrows():
-        try:
-            # Update progress
-            progress = (index + 1) / total_rows
-            progress_bar.progress(progress)
-            status_text.text(f"Processing: {row['Product Name']}")
-            
-            asin = row['ASIN']
-            parent_id = row['parent_id']
-            quantity = row['Shipped Qty']
-            
-            # Check stock availability (final check)
-            available_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-            
-            if available_stock >= quantity:
-                # Update stock
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity
-                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                
-                # Record transaction
-                weight_sold = quantity * st.session_state.packet_variations[parent_id][asin]["weight"]
-                notes = f"FBA Sale - Bulk Upload"
-                if row['Merchant SKU']:
-                    notes += f" | SKU: {row['Merchant SKU']}"
-                
-                transaction_id = record_transaction(
-                    transaction_type="FBA Sale", 
-                    parent_id=parent_id, 
-                    asin=asin, 
-                    quantity=quantity, 
-                    weight=weight_sold, 
-                    notes=notes
-                )
-                
-                success_count += 1
-                success_details.append({
-                    "ASIN": asin,
-                    "Product": row['Product Name'],
-                    "Quantity": quantity,
-                    "Stock Before": available_stock,
-                    "Stock After": available_stock - quantity
-                })
-                
-            else:
-                error_count += 1
-                error_details.append({
-                    "ASIN": asin,
-                    "Product": row['Product Name'],
-                    "Issue": "Insufficient Stock",
-                    "Available": available_stock,
-                    "Requested": quantity
-                })
-                
-        except Exception as e:
-            error_count += 1
-            error_details.append({
-                "ASIN": row.get('ASIN', 'Unknown'),
-                "Product": row.get('Product Name', 'Unknown'),
-                "Issue": f"Processing Error: {str(e)}",
-                "Available": "N/A",
-                "Requested": row.get('Shipped Qty', 0)
-            })
-    
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
+def show_confirmed_fba_results(result):
+    """Show the outcome of a finished FBA sales job"""
+    success_details = result["success_details"]
+    error_details = result["error_details"]
     
     # Show results
     st.success(f"✅ **FBA Processing Complete!**")
     
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("✅ Successful", success_count)
+        st.metric("✅ Successful", result["processed_count"])
     with col2:
-        st.metric("❌ Errors", error_count)
+        st.metric("❌ Errors", len(error_details))
+    
+    # The whole upload can be undone from Recent Transactions by this batch
+    if result["processed_count"] > 0:
+        st.markdown("---")
+        st.write(f"**📦 Batch ID:** `{result['batch_id']}`")
+        st.write(f"**📊 Total Transactions:** {result['processed_count']}")
     
     # Show successful transactions
     if success_details:
@@ -1942,9 +1626,8 @@ def process_confirmed_fba_sales(ready_rows):
         error_df = pd.DataFrame(error_details)
         st.dataframe(error_df, use_container_width=True, hide_index=True)
     
-    # Success celebration
-    if success_count > 0:
-        st.balloons()
+    # Shown again on every rerun while the result is kept, so no balloons here
+    if success_details:
         st.info("💡 **Stock levels updated successfully!** Check Live Stock View for current inventory.")
     
     # Next steps
@@ -1959,437 +1642,22 @@ def process_confirmed_fba_sales(ready_rows):
         
     with col2:
         st.write("**🔄 For Any Corrections:**")
-        st.write("• Use Manual Entry for individual sales")
-        st.write("• Check Products Management if ASINs missing")
-
-def process_fba_sales_excel(df, batch_id_override=None):
-    """Process the uploaded FBA sales Excel file with improved status reporting and undo functionality"""
-    import datetime
-    
-    processed_transactions = []
-    success_details = []
-    errors = []
-    warnings = []
-    
-    # Filter only rows with sales (Shipped > 0)
-    sales_data = df[df['Shipped'] > 0].copy()
-    
-    st.write(f"🔄 Processing {len(sales_data)} rows with sales data...")
-    
-    # Create progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Generate batch ID for this upload (use override if provided)
-    if batch_id_override:
-        batch_id = batch_id_override
-    else:
-        batch_id = f"BULK_FBA_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
-    
-    def get_product_display_name(asin, parent_id):
-        """Get user-friendly product name with weight"""
-        if parent_id and parent_id in st.session_state.packet_variations:
-            if asin in st.session_state.packet_variations[parent_id]:
-                variation = st.session_state.packet_variations[parent_id][asin]
-                weight = variation.get('weight', 0)
-                description = variation.get('description', '')
-                parent_name = st.session_state.parent_items.get(parent_id, {}).get('name', 'Unknown Product')
-                
-                # Clean up description
-                if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                    description = f"{weight}kg {parent_name}"
-                
-                return f"{description} ({weight}kg)"
-        return f"Unknown Product (ASIN: {asin})"
-    
-    for index, row in sales_data.iterrows():
-        try:
-            asin = str(row['ASIN']).strip()
-            quantity = int(row['Shipped'])
-            
-            # Additional info from Excel
-            merchant_sku = str(row.get('Merchant SKU', '')).strip() if 'Merchant SKU' in row else ''
-            title = str(row.get('Title', '')).strip() if 'Title' in row else ''
-            
-            # Update progress
-            progress = (index + 1) / len(sales_data)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing ASIN: {asin}")
-            
-            # Find parent_id for this ASIN
-            parent_id = None
-            for pid, variations in st.session_state.packet_variations.items():
-                if asin in variations:
-                    parent_id = pid
-                    break
-            
-            # Get user-friendly product name
-            product_display = get_product_display_name(asin, parent_id)
-            
-            if not parent_id:
-                warnings.append({
-                    "type": "Product Not Found",
-                    "asin": asin,
-                    "product": product_display,
-                    "message": f"ASIN {asin} not found in your product catalog",
-                    "details": f"SKU: {merchant_sku}" if merchant_sku else "No SKU provided",
-                    "quantity": quantity
-                })
-                continue
-            
-            if quantity <= 0:
-                warnings.append({
-                    "type": "Invalid Quantity",
-                    "asin": asin,
-                    "product": product_display,
-                    "message": f"Invalid quantity: {quantity}",
-                    "details": "Quantity must be greater than 0",
-                    "quantity": quantity
-                })
-                continue
-            
-            # Check stock availability
-            available_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-            
-            if available_stock >= quantity:
-                # Update stock
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity
-                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                
-                # Record transaction
-                weight_sold = quantity * st.session_state.packet_variations[parent_id][asin]["weight"]
-                notes = f"FBA Bulk upload"
-                if merchant_sku:
-                    notes += f" | SKU: {merchant_sku}"
-                if title:
-                    notes += f" | Title: {title[:50]}"
-                
-                transaction_id = record_transaction(
-                    transaction_type="FBA Sale (Bulk)", 
-                    parent_id=parent_id, 
-                    asin=asin, 
-                    quantity=quantity, 
-                    weight=weight_sold, 
-                    notes=notes,
-                    batch_id=batch_id
-                )
-                
-                # Track successful transaction
-                processed_transactions.append(transaction_id)
-                success_details.append({
-                    "asin": asin,
-                    "product": product_display,
-                    "quantity": quantity,
-                    "weight": weight_sold,
-                    "stock_before": available_stock,
-                    "stock_after": available_stock - quantity,
-                    "sku": merchant_sku
-                })
-                
-            else:
-                errors.append({
-                    "type": "Insufficient Stock",
-                    "asin": asin,
-                    "product": product_display,
-                    "message": f"Insufficient stock",
-                    "details": f"Available: {available_stock}, Requested: {quantity}",
-                    "quantity": quantity,
-                    "available": available_stock
-                })
-                
-        except Exception as e:
-            errors.append({
-                "type": "Processing Error",
-                "asin": asin if 'asin' in locals() else "Unknown",
-                "product": "Unknown Product",
-                "message": f"Error processing row {index + 1}",
-                "details": str(e),
-                "quantity": 0
-            })
-    
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
-    
-    # Show detailed results
-    show_fba_processing_results(
-        success_details=success_details,
-        errors=errors,
-        warnings=warnings,
-        batch_id=batch_id,
-        processed_count=len(processed_transactions)
-    )
-
-def show_fba_processing_results(success_details, errors, warnings, batch_id, processed_count):
-    """Display detailed processing results with undo option"""
-    
-    # Check if this batch has already been undone
-    batch_exists = any(t.get("batch_id") == batch_id for t in st.session_state.transactions)
-    
-    # Summary metrics
-    st.success(f"✅ **FBA Bulk Processing Complete!**")
-    
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("✅ Successful", processed_count, delta=None)
-    with col2:
-        st.metric("⚠️ Warnings", len(warnings), delta=None)
-    with col3:
-        st.metric("❌ Errors", len(errors), delta=None)
-    
-    # Undo option for successful transactions (only if batch still exists)
-    if processed_count > 0:
-        st.markdown("---")
-        col1, col2 = st.columns([3, 1])
-        
-        with col1:
-            st.write(f"**📦 Batch ID:** `{batch_id}`")
-            st.write(f"**🕒 Processed:** {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            st.write(f"**📊 Total Transactions:** {processed_count}")
-            
-            if not batch_exists:
-                st.warning("⚠️ **This batch has already been undone**")
-        
-        with col2:
-            if batch_exists:
-                can_undo, reason = can_undo_batch(batch_id)
-                if can_undo:
-                    # Create a unique key for this batch undo button
-                    undo_key = f"undo_batch_{batch_id}_{processed_count}"
-                    
-                    if st.button("🔄 Undo Entire Batch", type="secondary", use_container_width=True, 
-                               help="Undo all transactions from this upload", key=undo_key):
-                        st.write("🔄 **Processing undo request...**")
-                        
-                        # Prevent multiple undos by setting a flag
-                        undo_flag_key = f"undoing_{batch_id}"
-                        if undo_flag_key not in st.session_state:
-                            st.session_state[undo_flag_key] = True
-                            
-                            if undo_batch(batch_id):
-                                st.success("✅ Batch undone successfully!")
-                                # Track that this batch was undone
-                                if 'undone_batches' not in st.session_state:
-                                    st.session_state.undone_batches = set()
-                                st.session_state.undone_batches.add(batch_id)
-                                
-                                # Remove the processing flag
-                                del st.session_state[undo_flag_key]
-                                st.rerun()
-                            else:
-                                st.error("❌ Failed to undo batch")
-                                del st.session_state[undo_flag_key]
-                        else:
-                            st.warning("⚠️ Undo already in progress...")
-                else:
-                    st.button("🔄 Undo Entire Batch", disabled=True, help=reason, use_container_width=True)
-            else:
-                st.button("🔄 Undo Entire Batch", disabled=True, help="Batch already undone", use_container_width=True)
-    
-    # Detailed success results
-    if success_details:
-        st.subheader("✅ Successfully Processed Sales")
-        
-        success_df = pd.DataFrame([
-            {
-                "Product": detail["product"],
-                "ASIN": detail["asin"],
-                "Quantity Sold": detail["quantity"],
-                "Weight (kg)": detail["weight"],
-                "Stock Before": detail["stock_before"],
-                "Stock After": detail["stock_after"],
-                "SKU": detail["sku"] if detail["sku"] else "N/A"
-            }
-            for detail in success_details
-        ])
-        
-        st.dataframe(success_df, use_container_width=True, hide_index=True)
-        
-        # Export option
-        csv_data = success_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Export Successful Transactions",
-            data=csv_data,
-            file_name=f"fba_successful_transactions_{datetime.date.today()}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
-    
-    # Detailed error results
-    if errors:
-        st.subheader("❌ Processing Errors")
-        
-        error_df = pd.DataFrame([
-            {
-                "Error Type": error["type"],
-                "Product": error["product"],
-                "ASIN": error["asin"],
-                "Issue": error["message"],
-                "Details": error["details"],
-                "Requested Qty": error["quantity"],
-                "Available Stock": error.get("available", "N/A")
-            }
-            for error in errors
-        ])
-        
-        st.dataframe(error_df, use_container_width=True, hide_index=True)
-        
-        # Export option
-        csv_data = error_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Export Error Report",
-            data=csv_data,
-            file_name=f"fba_errors_{datetime.date.today()}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
-    
-    # Detailed warning results
-    if warnings:
-        st.subheader("⚠️ Processing Warnings")
-        
-        warning_df = pd.DataFrame([
-            {
-                "Warning Type": warning["type"],
-                "Product": warning["product"],
-                "ASIN": warning["asin"],
-                "Issue": warning["message"],
-                "Details": warning["details"],
-                "Quantity": warning["quantity"]
-            }
-            for warning in warnings
-        ])
-        
-        st.dataframe(warning_df, use_container_width=True, hide_index=True)
-        
-        # Export option
-        csv_data = warning_df.to_csv(index=False)
-        st.download_button(
-            label="📥 Export Warning Report",
-            data=csv_data,
-            file_name=f"fba_warnings_{datetime.date.today()}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
-    
-    # Celebration for successful processing
-    if processed_count > 0:
-        st.balloons()
-        st.info("💡 **Next Steps:** Check the Live Stock View to see updated inventory levels, or visit the Dashboard for an overview.")
-    
-    # Helpful tips
-    if errors or warnings:
-        st.markdown("---")
-        st.subheader("💡 Troubleshooting Tips")
-        
-        if any(error["type"] == "Product Not Found" for error in errors + warnings):
-            st.write("🔍 **Product Not Found:** Add missing ASINs in Products Management > ASIN Products")
-        
-        if any(error["type"] == "Insufficient Stock" for error in errors):
-            st.write("📦 **Insufficient Stock:** Record stock inward or check current inventory levels")
-        
-        if any(error["type"] == "Invalid Quantity" for error in errors + warnings):
-            st.write("📊 **Invalid Quantity:** Ensure all quantity values are positive numbers")
-
-def process_confirmed_easy_ship_sales(ready_rows):
-    """Process confirmed Easy Ship sales data (matching FBA style)"""
-    import datetime
-    
-    st.write("🔄 **Processing confirmed Easy Ship sales...**")
-    
-    # Create progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Generate batch ID for this upload
-    batch_id = f"EASY_SHIP_CONFIRMED_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
-    
-    success_count = 0
-    error_count = 0
-    success_details = []
-    error_details = []
-    
-    total_rows = len(ready_rows)
-    
-    for index, row in ready_rows.iterrows():
-        try:
-            # Update progress
-            progress = (index + 1) / total_rows
-            progress_bar.progress(progress)
-            status_text.text(f"Processing: {row['Product Name']}")
-            
-            asin = row['ASIN']
-            parent_id = row['parent_id']
-            quantity = row['Quantity Purchased']
-            
-            # Check stock availability (final check)
-            available_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-            
-            if available_stock >= quantity:
-                # Update stock
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity
-                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                
-                # Record transaction
-                weight_sold = quantity * st.session_state.packet_variations[parent_id][asin]["weight"]
-                notes = f"Easy Ship Sale - Bulk Upload"
-                if row['Order ID']:
-                    notes += f" | Order: {row['Order ID']}"
-                if row['SKU']:
-                    notes += f" | SKU: {row['SKU']}"
-                
-                transaction_id = record_transaction(
-                    transaction_type="Easy Ship Sale", 
-                    parent_id=parent_id, 
-                    asin=asin, 
-                    quantity=quantity, 
-                    weight=weight_sold, 
-                    notes=notes,
-                    batch_id=batch_id
-                )
-                
-                success_count += 1
-                success_details.append({
-                    "ASIN": asin,
-                    "Product": row['Product Name'],
-                    "Quantity": quantity,
-                    "Stock Before": available_stock,
-                    "Stock After": available_stock - quantity,
-                    "Order ID": row['Order ID'] if row['Order ID'] else "N/A",
-                    "SKU": row['SKU'] if row['SKU'] else "N/A"
-                })
-                
-            else:
-                error_count += 1
-                error_details.append({
-                    "ASIN": asin,
-                    "Product": row['Product Name'],
-                    "Issue": "Insufficient Stock",
-                    "Available": available_stock,
-                    "Requested": quantity
-                })
-                
-        except Exception as e:
-            error_count += 1
-            error_details.append({
-                "ASIN": row.get('ASIN', 'Unknown'),
-                "Product": row.get('Product Name', 'Unknown'),
-                "Issue": f"Processing Error: {str(e)}",
-                "Available": "N/A",
-                "Requested": row.get('Quantity Purchased', 0)
-            })
-    
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
+        st.write("• Use Manual Entry for individual sales")
+        st.write("• Check Products Management if ASINs missing")
+
+def submit_confirmed_easy_ship_sales(ready_rows, orders):
+    """Queue the confirmed rows of a reviewed Easy Ship upload on the background worker (False if one is still running)"""
+    if job_in_progress("easy_ship_sales_job"):
+        st.warning("⏳ The previous Easy Ship upload is still being processed - wait for it to finish before confirming another")
+        return False
     
-    # Show results using the enhanced processing results function
-    show_easy_ship_processing_results(
-        success_details=success_details,
-        error_details=error_details,
-        batch_id=batch_id,
-        processed_count=success_count
-    )
+    # Each row takes the order lines it aggregates along, kept on its transaction for audit
+    lines = order_lines(orders)
+    ready_rows = ready_rows.copy()
+    ready_rows['Order Lines'] = [lines.get(key, []) for key in zip(ready_rows['ASIN'].tolist(), ready_rows['Sale Date'].tolist())]
+    batch_id = f"EASY_SHIP_CONFIRMED_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+    st.session_state.easy_ship_sales_job = job_runner.submit("easy_ship_sales", ready_rows, batch_id)
+    return True
 
 def show_easy_ship_processing_results(success_details, error_details, batch_id, processed_count):
     """Display detailed Easy Ship processing results (matching FBA style but without undo)"""
@@ -2422,9 +1690,8 @@ def show_easy_ship_processing_results(success_details, error_details, batch_id,
         error_df = pd.DataFrame(error_details)
         st.dataframe(error_df, use_container_width=True, hide_index=True)
     
-    # Success celebration
+    # Shown again on every rerun while the result is kept, so no balloons here
     if processed_count > 0:
-        st.balloons()
         st.info("💡 **Stock levels updated successfully!** Check Live Stock View for current inventory.")
     
     # Next steps
@@ -2446,7 +1713,7 @@ def show_easy_ship_processing_results(success_details, error_details, batch_id,
 def display_recent_easy_ship_sales():
     """Helper function to display recent Easy Ship sales"""
     st.subheader("📈 Recent Easy Ship Sales")
-    easy_ship_transactions = [t for t in st.session_state.transactions if "Easy Ship Sale" in t.get("type", "")]
+    easy_ship_transactions = [t for t in inventory.transactions if "Easy Ship Sale" in t.get("type", "")]
     if easy_ship_transactions:
         recent_easy_ship = pd.DataFrame(easy_ship_transactions[-5:])
         recent_easy_ship = recent_easy_ship.sort_values('timestamp', ascending=False)
@@ -2476,20 +1743,20 @@ def show_easy_ship_sales():
             # Product selection outside form for dynamic updates
             parent_id = st.selectbox(
                 "Select Product",
-                options=list(st.session_state.parent_items.keys()),
-                format_func=lambda x: st.session_state.parent_items[x]["name"],
+                options=list(inventory.parent_items.keys()),
+                format_func=lambda x: inventory.parent_items[x]["name"],
                 key="easy_ship_parent_select"
             )
             
-            if parent_id and parent_id in st.session_state.packet_variations:
+            if parent_id and parent_id in inventory.packet_variations:
                 def format_product_option(asin_key):
-                    details = st.session_state.packet_variations[parent_id][asin_key]
+                    details = inventory.packet_variations[parent_id][asin_key]
                     weight = details.get('weight', 1.0)
                     description = details.get('description', '')
                     
                     # Clean up description
                     if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                        parent_name = st.session_state.parent_items[parent_id]["name"]
+                        parent_name = inventory.parent_items[parent_id]["name"]
                         description = f"{weight}kg {parent_name}"
                     
                     return f"{description} ({weight}kg)"
@@ -2497,15 +1764,15 @@ def show_easy_ship_sales():
                 # Weight variation selection
                 asin = st.selectbox(
                     "Select Weight Variation",
-                    options=list(st.session_state.packet_variations[parent_id].keys()),
+                    options=list(inventory.packet_variations[parent_id].keys()),
                     format_func=format_product_option,
                     key="easy_ship_asin_select"
                 )
                 
                 if asin:
                     # Get current stock and product details
-                    available_units = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-                    product_details = st.session_state.packet_variations[parent_id][asin]
+                    available_units = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                    product_details = inventory.packet_variations[parent_id][asin]
                     weight = product_details.get('weight', 1.0)
                     mrp = product_details.get('mrp', 0)
                     
@@ -2577,43 +1844,40 @@ def show_easy_ship_sales():
                         submitted = st.form_submit_button("🚛 Record Easy Ship Sale", type="primary", use_container_width=True)
                         
                         if submitted:
-                            if available_units >= quantity_sold:
-                                # Update stock
-                                st.session_state.stock_data[parent_id]["packed_stock"][asin] -= quantity_sold
-                                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                                
-                                # Prepare transaction notes
-                                transaction_notes = f"Easy Ship Sale"
-                                if order_id:
-                                    transaction_notes += f" | Order: {order_id}"
-                                if selling_price != mrp:
-                                    transaction_notes += f" | Price: ₹{selling_price}/unit"
-                                if notes:
-                                    transaction_notes += f" | {notes}"
-                                
-                                # Record transaction
-                                weight_sold = quantity_sold * weight
-                                transaction_id = record_transaction(
-                                    transaction_type="Easy Ship Sale", 
-                                    parent_id=parent_id, 
-                                    asin=asin, 
-                                    quantity=quantity_sold, 
-                                    weight=weight_sold, 
-                                    notes=transaction_notes, 
-                                    batch_id=None, 
-                                    transaction_date=sale_date
-                                )
-                                
-                                # Store transaction details for undo outside form
-                                st.session_state.last_transaction = {
-                                    "id": transaction_id,
-                                    "summary": f"Easy Ship sale: {quantity_sold} units of {format_product_option(asin)}",
-                                    "show_undo": True
-                                }
-                                st.balloons()
-                                # Don't call st.rerun() immediately - let the undo show first
-                            else:
-                                st.error(f"❌ Insufficient stock! Available: {available_units}, Requested: {quantity_sold}")
+                            with inventory.lock:
+                                if available_units >= quantity_sold:
+                                    # Prepare transaction notes
+                                    transaction_notes = f"Easy Ship Sale"
+                                    if order_id:
+                                        transaction_notes += f" | Order: {order_id}"
+                                    if selling_price != mrp:
+                                        transaction_notes += f" | Price: ₹{selling_price}/unit"
+                                    if notes:
+                                        transaction_notes += f" | {notes}"
+                                    
+                                    # Record transaction
+                                    try:
+                                        transaction_id = engine.sell(
+                                            parent_id, 
+                                            asin, 
+                                            quantity_sold, 
+                                            transaction_type="Easy Ship Sale", 
+                                            notes=transaction_notes, 
+                                            transaction_date=sale_date
+                                        )
+                                    except InventoryError as e:
+                                        st.error(str(e))
+                                    else:
+                                        # Store transaction details for undo outside form
+                                        st.session_state.last_transaction = {
+                                            "id": transaction_id,
+                                            "summary": f"Easy Ship sale: {quantity_sold} units of {format_product_option(asin)}",
+                                            "show_undo": True
+                                        }
+                                        st.balloons()
+                                        # Don't call st.rerun() immediately - let the undo show first
+                                else:
+                                    st.error(f"❌ Insufficient stock! Available: {available_units}, Requested: {quantity_sold}")
                 else:
                     st.info("Please select a weight variation to continue")
             else:
@@ -2628,12 +1892,12 @@ def show_easy_ship_sales():
             st.write(f"**Sale:** {transaction_info['summary']}")
             
             # Show current stock for verification (get the product info from recent transaction)
-            if st.session_state.transactions:
-                last_trans = st.session_state.transactions[-1]
+            if inventory.transactions:
+                last_trans = inventory.transactions[-1]
                 parent_id = last_trans.get('parent_id')
                 asin = last_trans.get('asin')
                 if parent_id and asin:
-                    current_packed = st.session_state.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
+                    current_packed = inventory.stock_data.get(parent_id, {}).get('packed_stock', {}).get(asin, 0)
                     st.write(f"**Current stock for {asin}:** {current_packed} units")
             
             col1, col2 = st.columns([1, 1])
@@ -2659,113 +1923,60 @@ def show_easy_ship_sales():
         
         with col1:
             st.subheader("📁 Bulk Upload Easy Ship Sales")
-            st.info("📋 Upload your Easy Ship sales Excel file. Review the data carefully before confirming.")
+            st.info("📋 Upload your Easy Ship sales Excel file or Amazon order report (.txt/.tsv/.csv). Review the data carefully before confirming.")
             
             # File upload
             uploaded_file = st.file_uploader(
-                "Choose your Easy Ship Sales Excel file", 
-                type=['xlsx', 'xls'],
-                help="Excel file should contain 'asin' and 'quantity-purchased' columns",
+                "Choose your Easy Ship Sales file", 
+                type=['xlsx', 'xls', 'csv', 'txt', 'tsv'],
+                help="File should contain 'asin' and 'quantity-purchased' columns",
                 key="easy_ship_file_uploader"
             )
         
+            # Confirmed uploads run on the background worker; their result stays here until the next one
+            show_job_status("easy_ship_sales_job", lambda result: show_easy_ship_processing_results(**result))
+        
         if uploaded_file is not None:
             try:
-                # Read the Excel file
-                df = pd.read_excel(uploaded_file)
-                
-                # Check required columns (case-insensitive)
-                df_columns_lower = [col.lower() for col in df.columns]
-                required_cols = ['asin', 'quantity-purchased']
-                missing_cols = []
+                read_status = st.empty()
+                digest = upload_digest(uploaded_file)
                 
-                # Map columns (case-insensitive)
-                column_mapping = {}
-                for req_col in required_cols:
-                    found = False
-                    for actual_col in df.columns:
-                        if actual_col.lower() == req_col or actual_col.lower().replace('-', '_') == req_col.replace('-', '_'):
-                            column_mapping[req_col] = actual_col
-                            found = True
-                            break
-                    if not found:
-                        missing_cols.append(req_col)
+                # Order lines only depend on the file; the review is rebuilt once stock changes
+                columns, missing_cols, orders = upload_cache.get_or_build(
+                    ("easy_ship_orders", digest),
+                    lambda: read_easy_ship_upload(uploaded_file, lambda rows_read: read_status.caption(f"📥 Read {rows_read:,} rows"))
+                )
+                read_status.empty()
                 
                 if missing_cols:
                     st.error(f"❌ Missing required columns: {missing_cols}")
-                    st.write("**Available columns:** ", list(df.columns))
+                    st.write("**Available columns:** ", columns)
                     st.info("💡 **Expected columns:** 'asin' and 'quantity-purchased' (case-insensitive)")
                 else:
-                    # Rename columns for processing
-                    df_processed = df.rename(columns={
-                        column_mapping['asin']: 'asin',
-                        column_mapping['quantity-purchased']: 'quantity_purchased'
-                    })
-                    
-                    # Filter and prepare data for review
-                    sales_data = df_processed[df_processed['quantity_purchased'] > 0].copy()
-                    
-                    if len(sales_data) == 0:
+                    # One row per order line, then one row per ASIN and sale date
+                    if len(orders) == 0:
                         st.warning("⚠️ No sales data found (no rows with quantity-purchased > 0)")
                         return
                     
-                    # Enrich data with product information for better review
-                    enriched_data = []
-                    
-                    for _, row in sales_data.iterrows():
-                        asin = str(row['asin']).strip()
-                        quantity_purchased = int(row['quantity_purchased'])
-                        
-                        # Get product info
-                        parent_id = None
-                        product_name = "Unknown Product"
-                        weight = "Unknown"
-                        current_stock = "Unknown"
-                        
-                        # Find parent_id for this ASIN
-                        for pid, variations in st.session_state.packet_variations.items():
-                            if asin in variations:
-                                parent_id = pid
-                                variation_info = variations[asin]
-                                weight = f"{variation_info.get('weight', 0)}kg"
-                                
-                                # Get product name
-                                description = variation_info.get('description', '')
-                                if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                                    parent_name = st.session_state.parent_items.get(pid, {}).get('name', 'Unknown')
-                                    product_name = f"{weight} {parent_name}"
-                                else:
-                                    product_name = description
-                                
-                                # Get current stock
-                                current_stock = st.session_state.stock_data.get(pid, {}).get("packed_stock", {}).get(asin, 0)
-                                break
-                        
-                        # Additional columns from Excel
-                        order_id = str(row.get('order-id', '')).strip() if 'order-id' in row else ''
-                        sku = str(row.get('sku', '')).strip() if 'sku' in row else ''
-                        
-                        enriched_data.append({
-                            'ASIN': asin,
-                            'Product Name': product_name,
-                            'Weight': weight,
-                            'Current Stock': current_stock,
-                            'Order ID': order_id,
-                            'SKU': sku,
-                            'Quantity Purchased': quantity_purchased,
-                            'Status': 'Ready' if parent_id else 'Not Found',
-                            'parent_id': parent_id  # Hidden field for processing
-                        })
+                    # Orders already recorded by an earlier upload are left out
+                    orders, skipped_count = drop_applied_orders(orders, inventory.applied_orders, "Easy Ship Sale")
+                    if skipped_count:
+                        st.info(f"⏭️ Skipped {skipped_count} order lines already recorded by an earlier upload")
+                    if len(orders) == 0:
+                        st.success("✅ Every order in this file has already been recorded")
+                        return
                     
-                    # Create review dataframe
-                    review_df = pd.DataFrame(enriched_data)
+                    review_df = upload_cache.get_or_build(
+                        ("easy_ship_review", digest, inventory.version),
+                        lambda: aggregate_easy_ship(orders, catalog_frame(inventory))
+                    )
                     
                     # Show summary
                     st.subheader("📊 Upload Summary")
                     col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
-                        st.metric("Total Rows", len(sales_data))
+                        st.metric("Order Lines", len(orders))
                     with col2:
                         st.metric("Total Units", review_df['Quantity Purchased'].sum())
                     with col3:
@@ -2779,22 +1990,16 @@ def show_easy_ship_sales():
                     st.subheader("📋 Review Data Before Processing")
                     st.warning("⚠️ **Please review this data carefully before confirming. Once processed, you'll need to use manual corrections for any errors.**")
                     
-                    # Display table without the hidden parent_id column
-                    display_df = review_df.drop(columns=['parent_id'])
+                    # Display table without the hidden processing columns
+                    display_df = review_df.drop(columns=HIDDEN_REVIEW_COLUMNS)
                     
-                    # Apply styling to highlight issues
-                    def highlight_issues(row):
-                        if row['Status'] == 'Not Found':
-                            return ['background-color: #ffebee'] * len(row)
-                        elif row['Current Stock'] != 'Unknown' and isinstance(row['Current Stock'], (int, float)) and row['Current Stock'] < row['Quantity Purchased']:
-                            return ['background-color: #fff3e0'] * len(row)
-                        else:
-                            return [''] * len(row)
-                    
-                    # Show styled dataframe
-                    styled_df = display_df.style.apply(highlight_issues, axis=1)
+                    # Show styled dataframe, highlighting issues
+                    styled_df = display_df.style.apply(lambda _: review_styles(review_df)[display_df.columns], axis=None)
                     st.dataframe(styled_df, use_container_width=True, hide_index=True)
                     
+                    with st.expander(f"View {len(orders)} order lines"):
+                        st.dataframe(orders, use_container_width=True, hide_index=True)
+                    
                     # Legend for colors
                     st.write("**Legend:**")
                     col1, col2 = st.columns(2)
@@ -2812,17 +2017,11 @@ def show_easy_ship_sales():
                                 st.write(f"• {asin}")
                     
                     # Check for insufficient stock
-                    stock_issues = []
-                    for _, row in review_df.iterrows():
-                        if (row['Status'] == 'Ready' and 
-                            isinstance(row['Current Stock'], (int, float)) and 
-                            row['Current Stock'] < row['Quantity Purchased']):
-                            stock_issues.append({
-                                'ASIN': row['ASIN'],
-                                'Product': row['Product Name'],
-                                'Available': row['Current Stock'],
-                                'Requested': row['Quantity Purchased']
-                            })
+                    stock_issues = review_df[review_df['Insufficient Stock']].rename(columns={
+                        'Product Name': 'Product',
+                        'Current Stock': 'Available',
+                        'Quantity Purchased': 'Requested'
+                    }).to_dict('records')
                     
                     if stock_issues:
                         st.warning(f"⚠️ **{len(stock_issues)} products have insufficient stock**. These will result in errors.")
@@ -2866,23 +2065,24 @@ def show_easy_ship_sales():
                                     if st.button("❌ Cancel", type="secondary", use_container_width=True):
                                         st.info("Processing cancelled. You can upload a different file or make corrections.")
                             else:
-                                # Processing is in progress - process data directly without extra message
-                                # Process the data
+                                # Hand the confirmed rows to the background worker
                                 ready_rows = review_df[review_df['Status'] == 'Ready']
-                                process_confirmed_easy_ship_sales(ready_rows)
+                                submitted = submit_confirmed_easy_ship_sales(ready_rows, orders)
                                 
-                                # Clear processing flag and confirmation checkbox after completion
+                                # Clear processing flag and confirmation checkbox, then show the job above
                                 st.session_state[processing_key] = False
                                 if "confirm_easy_ship_processing" in st.session_state:
                                     del st.session_state["confirm_easy_ship_processing"]
+                                if submitted:
+                                    st.rerun()
                         else:
                             st.info("👆 Please review the data and check the confirmation box to proceed.")
                     else:
                         st.error("❌ No products are ready to process. Please check your data and product catalog.")
                         
             except Exception as e:
-                st.error(f"❌ Error reading Excel file: {str(e)}")
-                st.write("Please ensure your file is a valid Excel format (.xlsx or .xls)")
+                st.error(f"❌ Error reading file: {str(e)}")
+                st.write("Please ensure your file is a valid Excel file (.xlsx or .xls) or tab/comma separated report (.txt, .tsv or .csv)")
 
 def show_products_management_protected():
     """Password-protected wrapper for Products Management"""
@@ -2968,7 +2168,7 @@ def show_products_management():
     """Manage products and ASIN variations"""
     st.header("Products Management")
     
-    tab1, tab2, tab3 = st.tabs(["ASIN Products", "Bulk Upload", "Current Products & Management"])
+    tab1, tab2, tab3, tab4 = st.tabs(["ASIN Products", "Bulk Upload", "Current Products & Management", "Background Jobs"])
     
     with tab1:
         st.subheader("Add ASIN-Based Product")
@@ -2995,63 +2195,55 @@ def show_products_management():
             submitted = st.form_submit_button("✅ Add ASIN Product", use_container_width=True)
             
             if submitted:
-                # Validation
-                if not asin or not parent_item_name or not weight_variation:
-                    st.error("🚨 Please fill all required fields (ASIN, Parent Item Name, Weight)")
-                elif len(asin) != 10 or not asin.isalnum():
-                    st.error("🚨 ASIN must be exactly 10 alphanumeric characters")
-                else:
-                    # Create parent ID from parent item name
-                    parent_id = parent_item_name.upper().replace(" ", "_").replace("-", "_")
-                    
-                    # Add parent item if not exists
-                    if parent_id not in st.session_state.parent_items:
-                        st.session_state.parent_items[parent_id] = {
-                            "name": parent_item_name,
-                            "unit": "kg",
-                            "category": category,
-                            "reorder_level": reorder_level
-                        }
-                        # Initialize stock data for parent
-                        st.session_state.stock_data[parent_id] = {
-                            "loose_stock": 0,
-                            "packed_stock": {},
-                            "opening_stock": 0,
-                            "last_updated": datetime.datetime.now().isoformat()
-                        }
+                with inventory.lock:
+                    # Validation
+                    if not asin or not parent_item_name or not weight_variation:
+                        st.error("🚨 Please fill all required fields (ASIN, Parent Item Name, Weight)")
+                    elif len(asin) != 10 or not asin.isalnum():
+                        st.error("🚨 ASIN must be exactly 10 alphanumeric characters")
                     else:
-                        # Update reorder level if parent already exists
-                        st.session_state.parent_items[parent_id]["reorder_level"] = reorder_level
-                    
-                    # Check if ASIN already exists
-                    asin_exists = False
-                    for pid, variations in st.session_state.packet_variations.items():
-                        if asin in variations:
-                            asin_exists = True
-                            break
-                    
-                    if asin_exists:
-                        st.error(f"🚨 ASIN {asin} already exists!")
-                    else:
-                        # Add ASIN variation
-                        if parent_id not in st.session_state.packet_variations:
-                            st.session_state.packet_variations[parent_id] = {}
-                        
-                        st.session_state.packet_variations[parent_id][asin] = {
-                            "weight": weight_variation,
-                            "asin": asin,
-                            "description": description or f"{weight_variation}kg {parent_item_name}",
-                            "mrp": mrp,
-                            "category": category,
-                            "notes": notes
-                        }
-                        
-                        # Initialize packed stock for this ASIN
-                        st.session_state.stock_data[parent_id]["packed_stock"][asin] = 0
+                        # Create parent ID from parent item name
+                        parent_id = parent_item_name.upper().replace(" ", "_").replace("-", "_")
+                        
+                        # Add parent item if not exists
+                        if parent_id not in inventory.parent_items:
+                            inventory.parent_items[parent_id] = {
+                                "name": parent_item_name,
+                                "unit": "kg",
+                                "category": category,
+                                "reorder_level": reorder_level
+                            }
+                            # Initialize stock data for parent
+                            inventory.stock_data[parent_id] = {
+                                "loose_stock": 0,
+                                "packed_stock": {},
+                                "opening_stock": 0,
+                                "last_updated": datetime.datetime.now().isoformat()
+                            }
+                        else:
+                            # Update reorder level if parent already exists
+                            inventory.parent_items[parent_id]["reorder_level"] = reorder_level
                         
-                        save_data()
-                        st.success(f"✅ Successfully added ASIN: {asin} for {parent_item_name} ({weight_variation}kg)")
-                        st.rerun()
+                        # Check if ASIN already exists
+                        if inventory.find_parent(asin):
+                            st.error(f"🚨 ASIN {asin} already exists!")
+                        else:
+                            # Add ASIN variation
+                            inventory.add_variation(parent_id, asin, {
+                                "weight": weight_variation,
+                                "asin": asin,
+                                "description": description or f"{weight_variation}kg {parent_item_name}",
+                                "mrp": mrp,
+                                "category": category,
+                                "notes": notes
+                            })
+                            
+                            # Initialize packed stock for this ASIN
+                            inventory.stock_data[parent_id]["packed_stock"][asin] = 0
+                            
+                            save_data()
+                            st.success(f"✅ Successfully added ASIN: {asin} for {parent_item_name} ({weight_variation}kg)")
+                            st.rerun()
     
     with tab2:
         st.subheader("📁 Bulk Upload Products")
@@ -3093,10 +2285,7 @@ def show_products_management():
             if uploaded_file is not None:
                 try:
                     # Read the file
-                    if uploaded_file.name.endswith('.csv'):
-                        df = pd.read_csv(uploaded_file)
-                    else:
-                        df = pd.read_excel(uploaded_file)
+                    df = cached_upload(uploaded_file)
                     
                     st.write("📊 **Preview of uploaded data:**")
                     st.dataframe(df.head(10), use_container_width=True)
@@ -3110,6 +2299,7 @@ def show_products_management():
                     else:
                         if st.button("🚀 Process Upload", type="primary", use_container_width=True):
                             process_products_upload(df)
+                        show_job_status("products_upload_job", show_products_upload_results)
                             
                 except Exception as e:
                     st.error(f"🚨 Error reading file: {e}")
@@ -3119,15 +2309,15 @@ def show_products_management():
         st.subheader("📋 Current Products Overview & Management")
         
         # Display current ASINs with delete functionality
-        if st.session_state.packet_variations:
+        if inventory.packet_variations:
             all_products = []
-            for parent_id, variations in st.session_state.packet_variations.items():
-                parent_name = st.session_state.parent_items.get(parent_id, {}).get("name", parent_id)
-                category = st.session_state.parent_items.get(parent_id, {}).get("category", "Unknown")
+            for parent_id, variations in inventory.snapshot("packet_variations").items():
+                parent_name = inventory.parent_items.get(parent_id, {}).get("name", parent_id)
+                category = inventory.parent_items.get(parent_id, {}).get("category", "Unknown")
                 
                 for asin, details in variations.items():
                     # Get current stock
-                    current_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                    current_stock = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
                     
                     all_products.append({
                         "ASIN": asin,
@@ -3189,9 +2379,9 @@ def show_products_management():
                     
                     # Step 1: Select Parent Product
                     parent_options = []
-                    for parent_id, parent_info in st.session_state.parent_items.items():
-                        if parent_id in st.session_state.packet_variations:
-                            variation_count = len(st.session_state.packet_variations[parent_id])
+                    for parent_id, parent_info in inventory.snapshot("parent_items").items():
+                        if parent_id in inventory.packet_variations:
+                            variation_count = len(inventory.packet_variations[parent_id])
                             parent_options.append({
                                 "parent_id": parent_id,
                                 "name": parent_info["name"],
@@ -3210,19 +2400,19 @@ def show_products_management():
                             parent_id = selected_parent["parent_id"]
                             
                             # Step 2: Select Weight Variation
-                            if parent_id in st.session_state.packet_variations:
+                            if parent_id in inventory.packet_variations:
                                 variation_options = []
-                                for asin, variation_info in st.session_state.packet_variations[parent_id].items():
+                                for asin, variation_info in inventory.variations(parent_id).items():
                                     weight = variation_info.get("weight", 0)
                                     description = variation_info.get("description", "")
                                     
                                     # Clean up description
                                     if not description or str(description).lower() in ['nan', 'null', 'none', '']:
-                                        clean_description = f"{weight}kg {st.session_state.parent_items[parent_id]['name']}"
+                                        clean_description = f"{weight}kg {inventory.parent_items[parent_id]['name']}"
                                     else:
                                         clean_description = description
                                     
-                                    current_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                                    current_stock = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
                                     
                                     variation_options.append({
                                         "asin": asin,
@@ -3251,7 +2441,7 @@ def show_products_management():
                                         st.write(f"• **Current Stock:** {selected_variation['stock']} units")
                                         
                                         # Count related transactions
-                                        related_transactions = len([t for t in st.session_state.transactions if t.get("asin") == selected_variation['asin']])
+                                        related_transactions = len([t for t in inventory.transactions if t.get("asin") == selected_variation['asin']])
                                         st.write(f"• **Related Transactions:** {related_transactions}")
                                         
                                         # Deletion form
@@ -3259,30 +2449,27 @@ def show_products_management():
                                             confirm_delete = st.checkbox("⚠️ I understand this action cannot be undone")
                                             
                                             if st.form_submit_button("🗑️ Delete Weight Variation", type="secondary", use_container_width=True):
-                                                if confirm_delete:
-                                                    asin = selected_variation["asin"]
-                                                    parent_id = selected_variation["parent_id"]
-                                                    description = selected_variation["description"]
-                                                    
-                                                    # Remove ASIN variation
-                                                    if parent_id in st.session_state.packet_variations and asin in st.session_state.packet_variations[parent_id]:
-                                                        del st.session_state.packet_variations[parent_id][asin]
-                                                    
-                                                    # Remove packed stock for this ASIN
-                                                    if parent_id in st.session_state.stock_data and asin in st.session_state.stock_data[parent_id].get("packed_stock", {}):
-                                                        del st.session_state.stock_data[parent_id]["packed_stock"][asin]
-                                                    
-                                                    # Remove related transactions
-                                                    st.session_state.transactions = [
-                                                        t for t in st.session_state.transactions 
-                                                        if t.get("asin") != asin
-                                                    ]
-                                                    
-                                                    save_data()
-                                                    st.success(f"✅ Successfully deleted: {description}")
-                                                    st.rerun()
-                                                else:
-                                                    st.error("❌ Please confirm deletion by checking the checkbox")
+                                                with inventory.lock:
+                                                    if confirm_delete:
+                                                        asin = selected_variation["asin"]
+                                                        parent_id = selected_variation["parent_id"]
+                                                        description = selected_variation["description"]
+                                                        
+                                                        # Remove ASIN variation
+                                                        inventory.remove_variation(parent_id, asin)
+                                                        
+                                                        # Remove packed stock for this ASIN
+                                                        if parent_id in inventory.stock_data and asin in inventory.stock_data[parent_id].get("packed_stock", {}):
+                                                            del inventory.stock_data[parent_id]["packed_stock"][asin]
+                                                        
+                                                        # Remove related transactions
+                                                        inventory.remove_transactions(lambda t: t.get("asin") == asin)
+                                                        
+                                                        save_data()
+                                                        st.success(f"✅ Successfully deleted: {description}")
+                                                        st.rerun()
+                                                    else:
+                                                        st.error("❌ Please confirm deletion by checking the checkbox")
                                 else:
                                     st.info("No weight variations found for this product.")
                             else:
@@ -3326,11 +2513,11 @@ def show_products_management():
                             st.write(f"• Total Stock: **{selected_parent['total_stock']} units**")
                             
                             # Count loose stock
-                            loose_stock = st.session_state.stock_data.get(selected_parent['parent_id'], {}).get("loose_stock", 0)
+                            loose_stock = inventory.stock_data.get(selected_parent['parent_id'], {}).get("loose_stock", 0)
                             st.write(f"• Loose Stock: **{loose_stock} kg**")
                             
                             # Count related transactions
-                            related_transactions = len([t for t in st.session_state.transactions if t.get("parent_id") == selected_parent['parent_id']])
+                            related_transactions = len([t for t in inventory.transactions if t.get("parent_id") == selected_parent['parent_id']])
                             st.write(f"• Related Transactions: **{related_transactions}**")
                             
                             # Deletion form
@@ -3338,33 +2525,30 @@ def show_products_management():
                                 confirm_delete_parent = st.checkbox("⚠️ I understand this will delete ALL products under this parent")
                                 
                                 if st.form_submit_button("🗑️ Delete Parent & All ASINs", type="secondary", use_container_width=True):
-                                    if confirm_delete_parent:
-                                        parent_id = selected_parent["parent_id"]
-                                        parent_name = selected_parent["name"]
-                                        
-                                        # Remove parent item
-                                        if parent_id in st.session_state.parent_items:
-                                            del st.session_state.parent_items[parent_id]
-                                        
-                                        # Remove stock data
-                                        if parent_id in st.session_state.stock_data:
-                                            del st.session_state.stock_data[parent_id]
-                                        
-                                        # Remove packet variations
-                                        if parent_id in st.session_state.packet_variations:
-                                            del st.session_state.packet_variations[parent_id]
-                                        
-                                        # Remove related transactions
-                                        st.session_state.transactions = [
-                                            t for t in st.session_state.transactions 
-                                            if t.get("parent_id") != parent_id
-                                        ]
-                                        
-                                        save_data()
-                                        st.success(f"✅ Successfully deleted parent product: {parent_name}")
-                                        st.rerun()
-                                    else:
-                                        st.error("❌ Please confirm deletion by checking the checkbox")
+                                    with inventory.lock:
+                                        if confirm_delete_parent:
+                                            parent_id = selected_parent["parent_id"]
+                                            parent_name = selected_parent["name"]
+                                            
+                                            # Remove parent item
+                                            if parent_id in inventory.parent_items:
+                                                del inventory.parent_items[parent_id]
+                                            
+                                            # Remove stock data
+                                            if parent_id in inventory.stock_data:
+                                                del inventory.stock_data[parent_id]
+                                            
+                                            # Remove packet variations
+                                            inventory.remove_variations(parent_id)
+                                            
+                                            # Remove related transactions
+                                            inventory.remove_transactions(lambda t: t.get("parent_id") == parent_id)
+                                            
+                                            save_data()
+                                            st.success(f"✅ Successfully deleted parent product: {parent_name}")
+                                            st.rerun()
+                                        else:
+                                            st.error("❌ Please confirm deletion by checking the checkbox")
                 
                 # Export current products
                 st.subheader("📥 Export Data")
@@ -3406,8 +2590,9 @@ def show_products_management():
                 
                 with col2:
                     # Count current stock for confirmation
-                    total_loose = sum(stock.get("loose_stock", 0) for stock in st.session_state.stock_data.values())
-                    total_packed = sum(sum(stock.get("packed_stock", {}).values()) for stock in st.session_state.stock_data.values())
+                    current_stock = inventory.snapshot("stock_data")
+                    total_loose = sum(stock.get("loose_stock", 0) for stock in current_stock.values())
+                    total_packed = sum(sum(stock.get("packed_stock", {}).values()) for stock in current_stock.values())
                     
                     st.metric("Current Loose Stock", f"{total_loose:.1f} kg")
                     st.metric("Current Packed Stock", f"{total_packed} units")
@@ -3431,114 +2616,116 @@ def show_products_management():
                     submitted = st.form_submit_button("🗑️ RESET ALL STOCK TO ZERO", type="primary")
                     
                     if submitted:
-                        if confirmation_text == "RESET ALL STOCK" and reset_reason.strip():
-                            # Perform the complete reset
-                            reset_count = 0
-                            transactions_deleted = len(st.session_state.transactions)
-                            return_transactions_deleted = len(st.session_state.return_transactions)
-                            
-                            # Reset all stock data while keeping structure
-                            for parent_id, stock_data in st.session_state.stock_data.items():
-                                # Reset loose stock
-                                if stock_data.get("loose_stock", 0) != 0:
-                                    reset_count += 1
-                                stock_data["loose_stock"] = 0
-                                stock_data["opening_stock"] = 0
-                                stock_data["last_updated"] = datetime.datetime.now().isoformat()
+                        with inventory.lock:
+                            if confirmation_text == "RESET ALL STOCK" and reset_reason.strip():
+                                # Perform the complete reset
+                                reset_count = 0
+                                transactions_deleted = len(inventory.transactions)
+                                return_transactions_deleted = len(inventory.return_transactions)
                                 
-                                # Reset all packed stock
-                                for asin in stock_data.get("packed_stock", {}):
-                                    if stock_data["packed_stock"][asin] != 0:
+                                # Reset all stock data while keeping structure
+                                for parent_id, stock_data in inventory.stock_data.items():
+                                    # Reset loose stock
+                                    if stock_data.get("loose_stock", 0) != 0:
                                         reset_count += 1
-                                    stock_data["packed_stock"][asin] = 0
-                            
-                            # COMPLETE DATA WIPE
-                            # Clear all transactions
-                            st.session_state.transactions = []
-                            
-                            # Clear all return transactions
-                            st.session_state.return_transactions = []
-                            
-                            # Reset all return data to zero
-                            for parent_id in st.session_state.parent_items:
-                                if parent_id not in st.session_state.return_data:
-                                    st.session_state.return_data[parent_id] = {
-                                        "loose_return": {"good": 0, "bad": 0},
-                                        "packed_return": {}
-                                    }
-                                else:
-                                    st.session_state.return_data[parent_id]["loose_return"] = {"good": 0, "bad": 0}
-                                    st.session_state.return_data[parent_id]["packed_return"] = {}
+                                    stock_data["loose_stock"] = 0
+                                    stock_data["opening_stock"] = 0
+                                    stock_data["last_updated"] = datetime.datetime.now().isoformat()
+                                    
+                                    # Reset all packed stock
+                                    for asin in stock_data.get("packed_stock", {}):
+                                        if stock_data["packed_stock"][asin] != 0:
+                                            reset_count += 1
+                                        stock_data["packed_stock"][asin] = 0
                                 
-                                # Reset packed return data for all ASINs
-                                if parent_id in st.session_state.packet_variations:
-                                    for asin in st.session_state.packet_variations[parent_id]:
-                                        st.session_state.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
-                            
-                            # Clear daily opening stock completely
-                            st.session_state.daily_opening_stock = {}
-                            
-                            # Record ONE final reset transaction for audit (after clearing all others)
-                            reset_transaction = {
-                                "id": 1,  # Start fresh with ID 1
-                                "timestamp": datetime.datetime.now().isoformat(),
-                                "date": datetime.date.today().isoformat(),
-                                "type": "COMPLETE_SYSTEM_RESET",
-                                "parent_id": "SYSTEM",
-                                "parent_name": "System Operation",
-                                "asin": None,
-                                "quantity": 0,
-                                "weight": 0,
-                                "notes": f"Complete system reset | Reason: {reset_reason} | Stock items reset: {reset_count} | Transactions deleted: {transactions_deleted} | Return transactions deleted: {return_transactions_deleted} | Loose stock reset: {total_loose:.1f} kg | Packed stock reset: {total_packed} units"
-                            }
-                            st.session_state.transactions = [reset_transaction]  # Only keep this one transaction
-                            
-                            # Save the changes
-                            save_data()
-                            
-                            # Show success message
-                            st.success("✅ **COMPLETE SYSTEM RESET SUCCESSFUL!**")
-                            st.balloons()
-                            
-                            # Show detailed reset summary
-                            st.info("🔄 **Reset Summary:**")
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                st.write("**📊 Stock Data Reset:**")
-                                st.write(f"• Loose stock cleared: {total_loose:.1f} kg")
-                                st.write(f"• Packed stock cleared: {total_packed} units")
-                                st.write(f"• Stock items reset: {reset_count}")
+                                # COMPLETE DATA WIPE
+                                # Clear all transactions
+                                inventory.replace_transactions([])
                                 
-                            with col2:
-                                st.write("**🗑️ Data Cleared:**")
-                                st.write(f"• Transactions deleted: {transactions_deleted}")
-                                st.write(f"• Return transactions deleted: {return_transactions_deleted}")
-                                st.write(f"• All return data cleared")
-                            
-                            st.success("**✨ System is now completely fresh! All data wiped except product definitions.**")
-                            st.info("**Next Steps:** Start fresh with new stock inward entries. No history will show in Live Stock View.")
-                            
-                            # Auto-refresh after 2 seconds to show the clean state
-                            import time
-                            time.sleep(2)
-                            st.rerun()
+                                # Clear all return transactions
+                                inventory.return_transactions = []
+                                
+                                # Reset all return data to zero
+                                for parent_id in inventory.parent_items:
+                                    if parent_id not in inventory.return_data:
+                                        inventory.return_data[parent_id] = {
+                                            "loose_return": {"good": 0, "bad": 0},
+                                            "packed_return": {}
+                                        }
+                                    else:
+                                        inventory.return_data[parent_id]["loose_return"] = {"good": 0, "bad": 0}
+                                        inventory.return_data[parent_id]["packed_return"] = {}
+                                    
+                                    # Reset packed return data for all ASINs
+                                    if parent_id in inventory.packet_variations:
+                                        for asin in inventory.packet_variations[parent_id]:
+                                            inventory.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
+                                
+                                # Clear daily opening stock completely
+                                inventory.daily_opening_stock = {}
+                                
+                                # Record ONE final reset transaction for audit (after clearing all others)
+                                reset_transaction = {
+                                    # IDs keep counting up so stale undo buttons can never hit a new transaction
+                                    "id": inventory.allocate_transaction_id(),
+                                    "timestamp": datetime.datetime.now().isoformat(),
+                                    "date": datetime.date.today().isoformat(),
+                                    "type": "COMPLETE_SYSTEM_RESET",
+                                    "parent_id": "SYSTEM",
+                                    "parent_name": "System Operation",
+                                    "asin": None,
+                                    "quantity": 0,
+                                    "weight": 0,
+                                    "notes": f"Complete system reset | Reason: {reset_reason} | Stock items reset: {reset_count} | Transactions deleted: {transactions_deleted} | Return transactions deleted: {return_transactions_deleted} | Loose stock reset: {total_loose:.1f} kg | Packed stock reset: {total_packed} units"
+                                }
+                                inventory.replace_transactions([reset_transaction])  # Only keep this one transaction
+                                
+                                # Save the changes
+                                save_data()
+                                
+                                # Show success message
+                                st.success("✅ **COMPLETE SYSTEM RESET SUCCESSFUL!**")
+                                st.balloons()
+                                
+                                # Show detailed reset summary
+                                st.info("🔄 **Reset Summary:**")
+                                col1, col2 = st.columns(2)
+                                
+                                with col1:
+                                    st.write("**📊 Stock Data Reset:**")
+                                    st.write(f"• Loose stock cleared: {total_loose:.1f} kg")
+                                    st.write(f"• Packed stock cleared: {total_packed} units")
+                                    st.write(f"• Stock items reset: {reset_count}")
+                                
+                                with col2:
+                                    st.write("**🗑️ Data Cleared:**")
+                                    st.write(f"• Transactions deleted: {transactions_deleted}")
+                                    st.write(f"• Return transactions deleted: {return_transactions_deleted}")
+                                    st.write(f"• All return data cleared")
+                                
+                                st.success("**✨ System is now completely fresh! All data wiped except product definitions.**")
+                                st.info("**Next Steps:** Start fresh with new stock inward entries. No history will show in Live Stock View.")
+                                
+                                # Auto-refresh after 2 seconds to show the clean state
+                                import time
+                                time.sleep(2)
+                                st.rerun()
                             
-                        elif confirmation_text != "RESET ALL STOCK":
-                            st.error("❌ Incorrect confirmation text. Please type exactly: **RESET ALL STOCK**")
-                        elif not reset_reason.strip():
-                            st.error("❌ Please provide a reason for the stock reset.")
+                            elif confirmation_text != "RESET ALL STOCK":
+                                st.error("❌ Incorrect confirmation text. Please type exactly: **RESET ALL STOCK**")
+                            elif not reset_reason.strip():
+                                st.error("❌ Please provide a reason for the stock reset.")
                 
                 # Reorder Level Management Section
                 st.markdown("---")
                 st.subheader("📊 Reorder Level Management")
                 st.info("💡 Set minimum stock levels for automatic alerts when stock runs low.")
                 
-                if st.session_state.parent_items:
+                if inventory.parent_items:
                     # Show current reorder levels
                     reorder_data = []
-                    for parent_id, parent_info in st.session_state.parent_items.items():
-                        current_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
+                    for parent_id, parent_info in inventory.snapshot("parent_items").items():
+                        current_loose = inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
                         reorder_level = parent_info.get("reorder_level", 5.0)
                         status = "🔴 REORDER" if current_loose <= reorder_level else "✅ OK"
                         
@@ -3567,14 +2754,14 @@ def show_products_management():
                         # Select parent product
                         selected_parent_for_reorder = st.selectbox(
                             "Select Product:",
-                            options=list(st.session_state.parent_items.keys()),
-                            format_func=lambda x: f"{st.session_state.parent_items[x]['name']} ({st.session_state.parent_items[x].get('category', 'Unknown')})",
+                            options=list(inventory.parent_items.keys()),
+                            format_func=lambda x: f"{inventory.parent_items[x]['name']} ({inventory.parent_items[x].get('category', 'Unknown')})",
                             key="reorder_parent_select"
                         )
                         
                         if selected_parent_for_reorder:
-                            current_reorder = st.session_state.parent_items[selected_parent_for_reorder].get("reorder_level", 5.0)
-                            current_stock_for_display = st.session_state.stock_data.get(selected_parent_for_reorder, {}).get("loose_stock", 0)
+                            current_reorder = inventory.parent_items[selected_parent_for_reorder].get("reorder_level", 5.0)
+                            current_stock_for_display = inventory.stock_data.get(selected_parent_for_reorder, {}).get("loose_stock", 0)
                             
                             col_info1, col_info2 = st.columns(2)
                             with col_info1:
@@ -3593,22 +2780,23 @@ def show_products_management():
                             )
                             
                             if st.button("💾 Update Reorder Level", type="primary", use_container_width=True):
-                                # Update the reorder level
-                                st.session_state.parent_items[selected_parent_for_reorder]["reorder_level"] = new_reorder_level
-                                save_data()
-                                
-                                st.success(f"✅ Updated reorder level for {st.session_state.parent_items[selected_parent_for_reorder]['name']} to {new_reorder_level:.1f} kg")
-                                st.rerun()
+                                with inventory.lock:
+                                    # Update the reorder level
+                                    inventory.parent_items[selected_parent_for_reorder]["reorder_level"] = new_reorder_level
+                                    save_data()
+                                    
+                                    st.success(f"✅ Updated reorder level for {inventory.parent_items[selected_parent_for_reorder]['name']} to {new_reorder_level:.1f} kg")
+                                    st.rerun()
                     
                     with col2:
                         st.subheader("📈 Quick Stats")
                         
                         # Calculate reorder stats
-                        total_products = len(st.session_state.parent_items)
+                        total_products = len(inventory.parent_items)
                         products_below_reorder = 0
                         
-                        for parent_id, parent_info in st.session_state.parent_items.items():
-                            current_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
+                        for parent_id, parent_info in inventory.snapshot("parent_items").items():
+                            current_loose = inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
                             reorder_level = parent_info.get("reorder_level", 5.0)
                             if current_loose <= reorder_level:
                                 products_below_reorder += 1
@@ -3637,8 +2825,8 @@ def show_products_management():
                     # Step 1: Select Parent Product (like packing operations)
                     parent_id = st.selectbox(
                         "Select Product Category",
-                        options=list(st.session_state.parent_items.keys()),
-                        format_func=lambda x: st.session_state.parent_items[x]["name"],
+                        options=list(inventory.parent_items.keys()),
+                        format_func=lambda x: inventory.parent_items[x]["name"],
                         key="manual_update_parent_select"
                     )
                     
@@ -3647,9 +2835,9 @@ def show_products_management():
                         stock_options = []
                         
                         # Add loose stock option
-                        current_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
-                        parent_name = st.session_state.parent_items[parent_id]["name"]
-                        parent_unit = st.session_state.parent_items[parent_id].get("unit", "kg")
+                        current_loose = inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
+                        parent_name = inventory.parent_items[parent_id]["name"]
+                        parent_unit = inventory.parent_items[parent_id].get("unit", "kg")
                         
                         stock_options.append({
                             "type": "loose",
@@ -3660,9 +2848,9 @@ def show_products_management():
                         })
                         
                         # Add weight variations
-                        if parent_id in st.session_state.packet_variations:
-                            for asin, details in st.session_state.packet_variations[parent_id].items():
-                                current_packed = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                        if parent_id in inventory.packet_variations:
+                            for asin, details in inventory.variations(parent_id).items():
+                                current_packed = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
                                 weight = details.get('weight', 1.0)
                                 description = details.get('description', f"{weight}kg {parent_name}")
                                 
@@ -3772,58 +2960,38 @@ def show_products_management():
                             
                             # Update button
                             if st.button("💾 Update Stock", type="primary", use_container_width=True):
-                                if update_reason.strip():
-                                    # Ensure stock data structure exists
-                                    if parent_id not in st.session_state.stock_data:
-                                        st.session_state.stock_data[parent_id] = {"loose_stock": 0, "packed_stock": {}}
-                                    
-                                    if selected_option['type'] == 'loose':
-                                        # Update loose stock
-                                        old_stock = selected_option['current']
-                                        st.session_state.stock_data[parent_id]["loose_stock"] = final_stock
-                                        st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                                        
-                                        # Record transaction
-                                        stock_change = final_stock - old_stock
-                                        record_transaction(
-                                            transaction_type="LOOSE_STOCK_ADJUSTMENT",
-                                            parent_id=parent_id,
-                                            weight=stock_change,
-                                            notes=f"Manual loose stock update: {update_reason}. Stock changed from {old_stock} to {final_stock} {selected_option['unit']}",
-                                            transaction_date=datetime.datetime.now()
-                                        )
-                                        
-                                        save_data()
-                                        st.success(f"✅ Loose stock updated successfully! {parent_name} loose stock set to {final_stock} {selected_option['unit']}")
-                                        st.rerun()
+                                with inventory.lock:
+                                    if update_reason.strip():
+                                        if selected_option['type'] == 'loose':
+                                            # Update loose stock
+                                            try:
+                                                engine.set_loose_stock(
+                                                    parent_id,
+                                                    final_stock,
+                                                    lambda old, new: f"Manual loose stock update: {update_reason}. Stock changed from {old} to {new} {selected_option['unit']}"
+                                                )
+                                            except InventoryError as e:
+                                                st.error(str(e))
+                                            else:
+                                                st.success(f"✅ Loose stock updated successfully! {parent_name} loose stock set to {final_stock} {selected_option['unit']}")
+                                                st.rerun()
                                         
+                                        else:
+                                            # Update packed stock
+                                            try:
+                                                engine.set_packed_stock(
+                                                    parent_id,
+                                                    selected_option['asin'],
+                                                    int(final_stock),
+                                                    lambda old, new: f"Manual packed stock update: {update_reason}. Stock changed from {old} to {new} {selected_option['unit']}"
+                                                )
+                                            except InventoryError as e:
+                                                st.error(str(e))
+                                            else:
+                                                st.success(f"✅ Packed stock updated successfully! {selected_option['display']} set to {int(final_stock)} {selected_option['unit']}")
+                                                st.rerun()
                                     else:
-                                        # Update packed stock
-                                        old_stock = selected_option['current']
-                                        asin = selected_option['asin']
-                                        
-                                        if "packed_stock" not in st.session_state.stock_data[parent_id]:
-                                            st.session_state.stock_data[parent_id]["packed_stock"] = {}
-                                        
-                                        st.session_state.stock_data[parent_id]["packed_stock"][asin] = int(final_stock)
-                                        st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                                        
-                                        # Record transaction
-                                        stock_change = int(final_stock) - old_stock
-                                        record_transaction(
-                                            transaction_type="STOCK_ADJUSTMENT",
-                                            parent_id=parent_id,
-                                            asin=asin,
-                                            quantity=stock_change,
-                                            notes=f"Manual packed stock update: {update_reason}. Stock changed from {old_stock} to {int(final_stock)} {selected_option['unit']}",
-                                            transaction_date=datetime.datetime.now()
-                                        )
-                                        
-                                        save_data()
-                                        st.success(f"✅ Packed stock updated successfully! {selected_option['display']} set to {int(final_stock)} {selected_option['unit']}")
-                                        st.rerun()
-                                else:
-                                    st.error("Please provide a reason for the stock update.")
+                                        st.error("Please provide a reason for the stock update.")
                     else:
                         st.info("Please select a product category to update stock.")
                 
@@ -3836,8 +3004,8 @@ def show_products_management():
                         stock_template_data = []
                         
                         # Add parent items for loose stock updates
-                        for parent_id, parent_info in st.session_state.parent_items.items():
-                            current_loose_stock = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
+                        for parent_id, parent_info in inventory.snapshot("parent_items").items():
+                            current_loose_stock = inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
                             
                             stock_template_data.append({
                                 "Type": "PARENT_LOOSE",
@@ -3852,10 +3020,10 @@ def show_products_management():
                             })
                         
                         # Add ASIN-based products for packed stock updates
-                        for parent_id, variations in st.session_state.packet_variations.items():
-                            parent_name = st.session_state.parent_items.get(parent_id, {}).get("name", parent_id)
+                        for parent_id, variations in inventory.snapshot("packet_variations").items():
+                            parent_name = inventory.parent_items.get(parent_id, {}).get("name", parent_id)
                             for asin, details in variations.items():
-                                current_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+                                current_stock = inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
                                 weight = details.get('weight', 1.0)
                                 
                                 # Create enhanced product name with weight
@@ -3908,10 +3076,7 @@ def show_products_management():
                     if stock_upload_file is not None:
                         try:
                             # Read the file
-                            if stock_upload_file.name.endswith('.csv'):
-                                stock_df = pd.read_csv(stock_upload_file)
-                            else:
-                                stock_df = pd.read_excel(stock_upload_file)
+                            stock_df = cached_upload(stock_upload_file)
                             
                             st.write("📊 **Preview of stock update file:**")
                             st.dataframe(stock_df.head(10), use_container_width=True)
@@ -3938,6 +3103,7 @@ def show_products_management():
                                     
                                     if st.button("🚀 Process Stock Updates", type="primary", use_container_width=True):
                                         process_enhanced_stock_updates(changes_df)
+                                    show_job_status("stock_updates_job", show_stock_update_results)
                                 else:
                                     st.info("ℹ️ No stock changes detected in the uploaded file")
                         
@@ -3950,111 +3116,18 @@ def show_products_management():
         else:
             st.info("🚀 Start by adding your first ASIN-based product!")
 
+    with tab4:
+        show_background_jobs()
+
 def process_products_upload(df):
-    """Process bulk product upload"""
-    imported_count = 0
-    updated_count = 0
-    errors = []
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for index, row in df.iterrows():
-        try:
-            # Update progress
-            progress = (index + 1) / len(df)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing row {index + 1} of {len(df)}")
-            
-            # Extract required fields
-            asin = str(row.get('ASIN', '')).strip().upper()
-            parent_item_name = str(row.get('Parent_Item_Name', '')).strip()
-            weight_kg = float(row.get('Weight_kg', 0))
-            
-            # Extract optional fields
-            category = str(row.get('Category', 'Other')).strip()
-            description = str(row.get('Description', '')).strip()
-            mrp = float(row.get('MRP', 0))
-            reorder_level = float(row.get('Reorder_Level_kg', 5.0))  # Default to 5kg if not provided
-            notes = str(row.get('Notes', '')).strip()
-            
-            # Validation
-            if not asin or not parent_item_name or weight_kg <= 0:
-                errors.append(f"Row {index+1}: Missing required fields (ASIN: {asin}, Parent: {parent_item_name}, Weight: {weight_kg})")
-                continue
-            
-            if len(asin) != 10 or not asin.replace('_', '').isalnum():
-                errors.append(f"Row {index+1}: Invalid ASIN format - {asin}")
-                continue
-            
-            # Create parent ID
-            parent_id = parent_item_name.upper().replace(" ", "_").replace("-", "_")
-            
-            # Add parent item if not exists
-            if parent_id not in st.session_state.parent_items:
-                st.session_state.parent_items[parent_id] = {
-                    "name": parent_item_name,
-                    "unit": "kg",
-                    "category": category,
-                    "reorder_level": reorder_level
-                }
-                # Initialize stock data
-                st.session_state.stock_data[parent_id] = {
-                    "loose_stock": 0,
-                    "packed_stock": {},
-                    "opening_stock": 0,
-                    "last_updated": datetime.datetime.now().isoformat()
-                }
-            else:
-                # Update reorder level for existing parent
-                st.session_state.parent_items[parent_id]["reorder_level"] = reorder_level
-            
-            # Check if ASIN already exists
-            asin_exists = False
-            existing_parent = None
-            for pid, variations in st.session_state.packet_variations.items():
-                if asin in variations:
-                    asin_exists = True
-                    existing_parent = pid
-                    break
-            
-            if asin_exists:
-                # Update existing ASIN
-                st.session_state.packet_variations[existing_parent][asin].update({
-                    "weight": weight_kg,
-                    "description": description or f"{weight_kg}kg {parent_item_name}",
-                    "mrp": mrp,
-                    "category": category,
-                    "notes": notes
-                })
-                updated_count += 1
-            else:
-                # Add new ASIN
-                if parent_id not in st.session_state.packet_variations:
-                    st.session_state.packet_variations[parent_id] = {}
-                
-                st.session_state.packet_variations[parent_id][asin] = {
-                    "weight": weight_kg,
-                    "asin": asin,
-                    "description": description or f"{weight_kg}kg {parent_item_name}",
-                    "mrp": mrp,
-                    "category": category,
-                    "notes": notes
-                }
-                
-                # Initialize packed stock
-                st.session_state.stock_data[parent_id]["packed_stock"][asin] = 0
-                imported_count += 1
-            
-        except Exception as e:
-            errors.append(f"Row {index+1}: Error processing - {str(e)}")
+    """Queue a bulk product upload on the background worker"""
+    st.session_state.products_upload_job = job_runner.submit("products_upload", df)
     
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
-    
-    # Save data
-    save_data()
+def show_products_upload_results(result):
+    """Show the outcome of a finished bulk product upload"""
+    imported_count = result["imported_count"]
+    updated_count = result["updated_count"]
+    errors = result["errors"]
     
     # Show results
     st.success(f"🎉 **Upload Complete!**\n- ✅ New products imported: {imported_count}\n- 🔄 Products updated: {updated_count}")
@@ -4070,220 +3143,15 @@ def process_products_upload(df):
     # Show import summary
     if imported_count > 0 or updated_count > 0:
         st.info(f"💾 Data has been saved automatically. You can now use these products in stock operations.")
-        st.rerun()
-
-def process_stock_updates(changes_df):
-    """Process bulk stock updates from uploaded file"""
-    updated_count = 0
-    errors = []
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for index, row in changes_df.iterrows():
-        try:
-            # Update progress
-            progress = (index + 1) / len(changes_df)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing stock update {index + 1} of {len(changes_df)}")
-            
-            # Extract fields
-            asin = str(row.get('ASIN', '')).strip()
-            new_stock = int(row.get('New_Stock', 0))
-            update_reason = str(row.get('Update_Reason', 'Bulk stock update')).strip()
-            current_stock = int(row.get('Current_Stock', 0)) if 'Current_Stock' in row else None
-            
-            # Validation
-            if not asin:
-                errors.append(f"Row {index+1}: Missing ASIN")
-                continue
-                
-            if new_stock < 0:
-                errors.append(f"Row {index+1}: Invalid stock value - {new_stock}")
-                continue
-            
-            # Find the product
-            found_product = False
-            for parent_id, variations in st.session_state.packet_variations.items():
-                if asin in variations:
-                    found_product = True
-                    
-                    # Get current stock from system
-                    actual_current_stock = st.session_state.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
-                    
-                    # Update stock
-                    if parent_id not in st.session_state.stock_data:
-                        st.session_state.stock_data[parent_id] = {"loose_stock": 0, "packed_stock": {}}
-                    if "packed_stock" not in st.session_state.stock_data[parent_id]:
-                        st.session_state.stock_data[parent_id]["packed_stock"] = {}
-                    
-                    st.session_state.stock_data[parent_id]["packed_stock"][asin] = new_stock
-                    st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                    
-                    # Record transaction
-                    difference = new_stock - actual_current_stock
-                    transaction_type = "Stock Adjustment (Bulk)"
-                    notes = f"Bulk stock update | Reason: {update_reason} | Changed from {actual_current_stock} to {new_stock} units"
-                    
-                    record_transaction(
-                        transaction_type=transaction_type,
-                        parent_id=parent_id,
-                        asin=asin,
-                        quantity=difference,
-                        weight=0,
-                        notes=notes
-                    )
-                    
-                    updated_count += 1
-                    break
-            
-            if not found_product:
-                errors.append(f"Row {index+1}: ASIN {asin} not found in product catalog")
-                
-        except Exception as e:
-            errors.append(f"Row {index+1}: Error processing - {str(e)}")
-    
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
-    
-    # Save data
-    save_data()
-    
-    # Show results
-    st.success(f"🎉 **Stock Update Complete!**\n- ✅ Stock updated for {updated_count} products")
-    
-    if errors:
-        st.error(f"⚠️ **{len(errors)} errors encountered:**")
-        with st.expander("View Errors"):
-            for error in errors[:10]:  # Show first 10 errors
-                st.error(error)
-            if len(errors) > 10:
-                st.warning(f"... and {len(errors) - 10} more errors")
-    
-    # Show update summary
-    if updated_count > 0:
-        st.info(f"💾 Stock data has been saved automatically. Check Live Stock View to see updated inventory.")
-        st.rerun()
 
 def process_enhanced_stock_updates(changes_df):
-    """Process enhanced bulk stock updates with parent loose and ASIN packed stock support"""
-    updated_count = 0
-    errors = []
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for index, row in changes_df.iterrows():
-        try:
-            # Update progress
-            progress = (index + 1) / len(changes_df)
-            progress_bar.progress(progress)
-            status_text.text(f"Processing stock update {index + 1} of {len(changes_df)}")
-            
-            # Extract fields
-            update_type = str(row.get('Type', 'ASIN_PACKED')).strip()
-            parent_id = str(row.get('Parent_ID', '')).strip()
-            asin = str(row.get('ASIN', '')).strip()
-            new_stock = float(row.get('New_Stock', 0))
-            update_reason = str(row.get('Update_Reason', 'Bulk stock update')).strip()
-            current_stock = float(row.get('Current_Stock', 0)) if 'Current_Stock' in row else None
-            
-            # Validation
-            if not parent_id:
-                errors.append(f"Row {index+1}: Missing Parent_ID")
-                continue
-                
-            if new_stock < 0:
-                errors.append(f"Row {index+1}: Invalid stock value - {new_stock}")
-                continue
-            
-            # Process based on type
-            if update_type == "PARENT_LOOSE":
-                # Handle loose stock update
-                if parent_id not in st.session_state.parent_items:
-                    errors.append(f"Row {index+1}: Parent product {parent_id} not found")
-                    continue
-                
-                # Get current loose stock
-                actual_current_loose = st.session_state.stock_data.get(parent_id, {}).get("loose_stock", 0)
-                
-                # Update loose stock
-                if parent_id not in st.session_state.stock_data:
-                    st.session_state.stock_data[parent_id] = {"loose_stock": 0, "packed_stock": {}}
-                
-                st.session_state.stock_data[parent_id]["loose_stock"] = new_stock
-                st.session_state.stock_data[parent_id]["last_updated"] = datetime.datetime.now().isoformat()
-                
-                # Record transaction
-                difference = new_stock - actual_current_loose
-                transaction_type = "Loose Stock Adjustment (Bulk)"
-                notes = f"Bulk loose stock update | Reason: {update_reason} | Changed from {actual_current_loose} to {new_stock} kg"
-                
-                record_transaction(
-                    transaction_type=transaction_type,
-                    parent_id=parent_id,
-                    weight=difference,
-                    notes=notes
-                )
-                
-                updated_count += 1
-                
-            elif update_type == "ASIN_PACKED":
-                # Handle ASIN-based packed stock update
-                if not asin:
-                    errors.append(f"Row {index+1}: Missing ASIN for packed stock update")
-                    continue
-                
-                # Find the product
-                found_product = False
-                for pid, variations in st.session_state.packet_variations.items():
-                    if asin in variations:
-                        found_product = True
-                        
-                        # Get current stock from system
-                        actual_current_stock = st.session_state.stock_data.get(pid, {}).get("packed_stock", {}).get(asin, 0)
-                        
-                        # Update stock
-                        if pid not in st.session_state.stock_data:
-                            st.session_state.stock_data[pid] = {"loose_stock": 0, "packed_stock": {}}
-                        if "packed_stock" not in st.session_state.stock_data[pid]:
-                            st.session_state.stock_data[pid]["packed_stock"] = {}
-                        
-                        st.session_state.stock_data[pid]["packed_stock"][asin] = int(new_stock)
-                        st.session_state.stock_data[pid]["last_updated"] = datetime.datetime.now().isoformat()
-                        
-                        # Record transaction
-                        difference = int(new_stock) - actual_current_stock
-                        transaction_type = "Packed Stock Adjustment (Bulk)"
-                        notes = f"Bulk packed stock update | Reason: {update_reason} | Changed from {actual_current_stock} to {int(new_stock)} units"
-                        
-                        record_transaction(
-                            transaction_type=transaction_type,
-                            parent_id=pid,
-                            asin=asin,
-                            quantity=difference,
-                            notes=notes
-                        )
-                        
-                        updated_count += 1
-                        break
-                
-                if not found_product:
-                    errors.append(f"Row {index+1}: ASIN {asin} not found in product catalog")
-            
-            else:
-                errors.append(f"Row {index+1}: Unknown update type - {update_type}")
-                
-        except Exception as e:
-            errors.append(f"Row {index+1}: Error processing - {str(e)}")
-    
-    # Clear progress indicators
-    progress_bar.empty()
-    status_text.empty()
+    """Queue enhanced bulk stock updates (parent loose and ASIN packed stock) on the background worker"""
+    st.session_state.stock_updates_job = job_runner.submit("stock_updates", changes_df)
     
-    # Save data
-    save_data()
+def show_stock_update_results(result):
+    """Show the outcome of finished bulk stock updates"""
+    updated_count = result["updated_count"]
+    errors = result["errors"]
     
     # Show results
     st.success(f"🎉 **Enhanced Stock Update Complete!**\n- ✅ Stock updated for {updated_count} items")
@@ -4299,13 +3167,12 @@ def process_enhanced_stock_updates(changes_df):
     # Show update summary
     if updated_count > 0:
         st.info(f"💾 Stock data has been saved automatically. Check Live Stock View to see updated inventory.")
-        st.rerun()
 
 def show_settings():
     """Settings and data management"""
     st.header("Settings")
     
-    tab1, tab2, tab3 = st.tabs(["Data Management", "Export Data", "Undo Settings"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Data Management", "Export Data", "Undo Settings", "Background Jobs"])
     
     with tab1:
         st.subheader("Data Backup & Restore")
@@ -4316,10 +3183,10 @@ def show_settings():
             st.subheader("Export Data")
             if st.button("Create Backup"):
                 backup_data = {
-                    "stock_data": st.session_state.stock_data,
-                    "transactions": st.session_state.transactions,
-                    "parent_items": st.session_state.parent_items,
-                    "packet_variations": st.session_state.packet_variations,
+                    "stock_data": inventory.stock_data,
+                    "transactions": inventory.transactions,
+                    "parent_items": inventory.parent_items,
+                    "packet_variations": inventory.packet_variations,
                     "backup_date": datetime.datetime.now().isoformat()
                 }
                 
@@ -4339,13 +3206,15 @@ def show_settings():
                     backup_data = json.load(uploaded_file)
                     
                     if st.button("Restore from Backup"):
-                        st.session_state.stock_data = backup_data.get("stock_data", {})
-                        st.session_state.transactions = backup_data.get("transactions", [])
-                        st.session_state.parent_items = backup_data.get("parent_items", {})
-                        st.session_state.packet_variations = backup_data.get("packet_variations", {})
-                        save_data()
-                        st.success("Data restored successfully!")
-                        st.rerun()
+                        with inventory.lock:
+                            inventory.stock_data = backup_data.get("stock_data", {})
+                            inventory.replace_transactions(backup_data.get("transactions", []))
+                            inventory.parent_items = backup_data.get("parent_items", {})
+                            inventory.packet_variations = backup_data.get("packet_variations", {})
+                            inventory.rebuild_asin_index()
+                            save_data()
+                            st.success("Data restored successfully!")
+                            st.rerun()
                         
                 except Exception as e:
                     st.error(f"Error reading backup file: {e}")
@@ -4355,11 +3224,11 @@ def show_settings():
         
         if st.button("Export Current Stock"):
             stock_report = []
-            for parent_id, stock in st.session_state.stock_data.items():
+            for parent_id, stock in inventory.snapshot("stock_data").items():
                 stock_report.append({
                     "Product_ID": parent_id,
-                    "Product_Name": st.session_state.parent_items[parent_id]["name"],
-                    "Category": st.session_state.parent_items[parent_id].get("category", ""),
+                    "Product_Name": inventory.parent_items[parent_id]["name"],
+                    "Category": inventory.parent_items[parent_id].get("category", ""),
                     "Loose_Stock_kg": stock.get("loose_stock", 0),
                     "Last_Updated": stock.get("last_updated", "")
                 })
@@ -4368,12 +3237,12 @@ def show_settings():
                     if units > 0:
                         stock_report.append({
                             "Product_ID": parent_id,
-                            "Product_Name": st.session_state.parent_items[parent_id]["name"],
+                            "Product_Name": inventory.parent_items[parent_id]["name"],
                             "ASIN": asin,
-                            "Description": st.session_state.packet_variations[parent_id][asin]["description"],
+                            "Description": inventory.packet_variations[parent_id][asin]["description"],
                             "Units_in_Stock": units,
-                            "Weight_per_Unit": st.session_state.packet_variations[parent_id][asin]["weight"],
-                            "Total_Weight_kg": units * st.session_state.packet_variations[parent_id][asin]["weight"]
+                            "Weight_per_Unit": inventory.packet_variations[parent_id][asin]["weight"],
+                            "Total_Weight_kg": units * inventory.packet_variations[parent_id][asin]["weight"]
                         })
             
             df_stock_report = pd.DataFrame(stock_report)
@@ -4461,15 +3330,15 @@ def show_settings():
         
         # Test current transactions
         if st.button("🧪 Test Current Transactions"):
-            if st.session_state.transactions:
-                recent_count = len(st.session_state.transactions[-max_recent:])
+            if inventory.transactions:
+                recent_count = len(inventory.transactions[-max_recent:])
                 st.write(f"**Recent transactions available for undo:** {recent_count}")
                 
                 # Show how many are within time window
                 within_window = 0
                 current_time = datetime.datetime.now()
                 
-                for t in st.session_state.transactions[-max_recent:]:
+                for t in inventory.transactions[-max_recent:]:
                     try:
                         recorded_time = datetime.datetime.fromisoformat(t["timestamp"])
                         time_diff = current_time - recorded_time
@@ -4487,6 +3356,30 @@ def show_settings():
             else:
                 st.info("No transactions found to test")
 
+    with tab4:
+        show_background_jobs()
+        
+def show_background_jobs():
+    """Recent background jobs, with the full result of one of them"""
+    st.subheader("⏳ Background Jobs")
+    st.info("Bulk uploads run in the background. Their results and batch IDs are kept here for review.")
+            
+    jobs = job_runner.recent()
+    if jobs:
+        jobs_df = pd.DataFrame(jobs)
+        jobs_df["progress"] = (jobs_df["progress"].fillna(0) * 100).round().astype(int).astype(str) + "%"
+        st.dataframe(jobs_df, use_container_width=True, hide_index=True)
+        
+        # Full result of one job
+        job_id = st.selectbox("View job result", [job["id"] for job in jobs])
+        job = job_runner.get(job_id)
+        if job["status"] == "done":
+            st.json(job["result"], expanded=False)
+        elif job["error"]:
+            st.error(job["error"])
+    else:
+        st.info("No background jobs have been run yet")
+
 def show_returns():
     """Returns management"""
     st.header("Returns Management")
@@ -4500,8 +3393,8 @@ def show_returns():
         # Step 1: Select Parent Product (like packing operations)
         parent_id = st.selectbox(
             "Select Product Category",
-            options=list(st.session_state.parent_items.keys()),
-            format_func=lambda x: st.session_state.parent_items[x]["name"],
+            options=list(inventory.parent_items.keys()),
+            format_func=lambda x: inventory.parent_items[x]["name"],
             key="return_parent_select"
         )
         
@@ -4510,8 +3403,8 @@ def show_returns():
             return_options = []
             
             # Add loose return option
-            parent_name = st.session_state.parent_items[parent_id]["name"]
-            parent_unit = st.session_state.parent_items[parent_id].get("unit", "kg")
+            parent_name = inventory.parent_items[parent_id]["name"]
+            parent_unit = inventory.parent_items[parent_id].get("unit", "kg")
             
             return_options.append({
                 "type": "loose",
@@ -4521,8 +3414,8 @@ def show_returns():
             })
             
             # Add weight variations
-            if parent_id in st.session_state.packet_variations:
-                for asin, details in st.session_state.packet_variations[parent_id].items():
+            if parent_id in inventory.packet_variations:
+                for asin, details in inventory.variations(parent_id).items():
                     weight = details.get('weight', 1.0)
                     description = details.get('description', f"{weight}kg {parent_name}")
                     
@@ -4593,68 +3486,29 @@ def show_returns():
                 
                 # Process return button
                 if st.button("📥 Process Return", type="primary", use_container_width=True):
-                    if return_quantity > 0 and return_reason.strip():
-                        # Ensure return data structure exists
-                        if parent_id not in st.session_state.return_data:
-                            st.session_state.return_data[parent_id] = {
-                                "loose_return": {"good": 0, "bad": 0},
-                                "packed_return": {}
-                            }
-                        
-                        if selected_option['type'] == 'loose':
-                            # Process loose return
-                            condition_key = return_condition.lower()
-                            st.session_state.return_data[parent_id]["loose_return"][condition_key] += return_quantity
-                            
-                            # Record return transaction
-                            return_transaction = {
-                                "id": f"RET-{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                                "timestamp": datetime.datetime.now().isoformat(),
-                                "type": "RETURN_LOOSE",
-                                "parent_id": parent_id,
-                                "quantity": return_quantity,
-                                "unit": selected_option['unit'],
-                                "source": return_source,
-                                "condition": return_condition,
-                                "reason": return_reason,
-                                "product_name": parent_name
-                            }
-                            
+                    with inventory.lock:
+                        if return_quantity > 0 and return_reason.strip():
+                            try:
+                                engine.record_return(
+                                    parent_id,
+                                    return_quantity,
+                                    return_condition,
+                                    return_source,
+                                    return_reason,
+                                    selected_option['unit'],
+                                    parent_name if selected_option['type'] == 'loose' else selected_option['display'],
+                                    asin=selected_option['asin'] if selected_option['type'] != 'loose' else None
+                                )
+                            except InventoryError as e:
+                                st.error(str(e))
+                            else:
+                                st.success(f"✅ Return processed successfully! {return_quantity} {selected_option['unit']} of {selected_option['display']} returned as {return_condition.lower()} from {return_source}")
+                                st.rerun()
                         else:
-                            # Process packed return
-                            asin = selected_option['asin']
-                            if asin not in st.session_state.return_data[parent_id]["packed_return"]:
-                                st.session_state.return_data[parent_id]["packed_return"][asin] = {"good": 0, "bad": 0}
-                            
-                            condition_key = return_condition.lower()
-                            st.session_state.return_data[parent_id]["packed_return"][asin][condition_key] += return_quantity
-                            
-                            # Record return transaction
-                            return_transaction = {
-                                "id": f"RET-{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                                "timestamp": datetime.datetime.now().isoformat(),
-                                "type": "RETURN_PACKED",
-                                "parent_id": parent_id,
-                                "asin": asin,
-                                "quantity": return_quantity,
-                                "unit": selected_option['unit'],
-                                "source": return_source,
-                                "condition": return_condition,
-                                "reason": return_reason,
-                                "product_name": selected_option['display']
-                            }
-                        
-                        # Add to return transactions
-                        st.session_state.return_transactions.append(return_transaction)
-                        
-                        save_data()
-                        st.success(f"✅ Return processed successfully! {return_quantity} {selected_option['unit']} of {selected_option['display']} returned as {return_condition.lower()} from {return_source}")
-                        st.rerun()
-                    else:
-                        if return_quantity <= 0:
-                            st.error("Please enter a valid return quantity.")
-                        if not return_reason.strip():
-                            st.error("Please provide a reason for the return.")
+                            if return_quantity <= 0:
+                                st.error("Please enter a valid return quantity.")
+                            if not return_reason.strip():
+                                st.error("Please provide a reason for the return.")
         else:
             st.info("Please select a product category to process returns.")
     
@@ -4663,9 +3517,9 @@ def show_returns():
         
         # Show available good returns
         good_returns = []
-        for parent_id, return_data in st.session_state.return_data.items():
-            parent_name = st.session_state.parent_items.get(parent_id, {}).get("name", parent_id)
-            parent_unit = st.session_state.parent_items.get(parent_id, {}).get("unit", "kg")
+        for parent_id, return_data in inventory.snapshot("return_data").items():
+            parent_name = inventory.parent_items.get(parent_id, {}).get("name", parent_id)
+            parent_unit = inventory.parent_items.get(parent_id, {}).get("unit", "kg")
             
             # Loose good returns
             loose_good = return_data.get("loose_return", {}).get("good", 0)
@@ -4682,7 +3536,7 @@ def show_returns():
             for asin, return_stock in return_data.get("packed_return", {}).items():
                 packed_good = return_stock.get("good", 0)
                 if packed_good > 0:
-                    asin_details = st.session_state.packet_variations.get(parent_id, {}).get(asin, {})
+                    asin_details = inventory.packet_variations.get(parent_id, {}).get(asin, {})
                     weight = asin_details.get('weight', 1.0)
                     description = asin_details.get('description', f"{weight}kg {parent_name}")
                     
@@ -4711,44 +3565,19 @@ def show_returns():
                 with col3:
                     transfer_key = f"transfer_{item['parent_id']}_{item.get('asin', 'loose')}"
                     if st.button("🔄 Transfer", key=transfer_key):
-                        # Transfer good return to main stock
-                        if item['type'] == 'loose':
-                            # Transfer loose return to main loose stock
-                            st.session_state.stock_data[item['parent_id']]["loose_stock"] += item['quantity']
-                            st.session_state.return_data[item['parent_id']]["loose_return"]["good"] = 0
-                            
-                            # Record transfer transaction
-                            record_transaction(
-                                transaction_type="RETURN_TRANSFER_LOOSE",
-                                parent_id=item['parent_id'],
-                                weight=item['quantity'],
-                                notes=f"Transferred good return to main stock: {item['quantity']} {item['unit']} of {item['display']}",
-                                transaction_date=datetime.datetime.now()
-                            )
-                            
-                        else:
-                            # Transfer packed return to main packed stock
-                            if "packed_stock" not in st.session_state.stock_data[item['parent_id']]:
-                                st.session_state.stock_data[item['parent_id']]["packed_stock"] = {}
-                            if item['asin'] not in st.session_state.stock_data[item['parent_id']]["packed_stock"]:
-                                st.session_state.stock_data[item['parent_id']]["packed_stock"][item['asin']] = 0
-                            
-                            st.session_state.stock_data[item['parent_id']]["packed_stock"][item['asin']] += item['quantity']
-                            st.session_state.return_data[item['parent_id']]["packed_return"][item['asin']]["good"] = 0
-                            
-                            # Record transfer transaction
-                            record_transaction(
-                                transaction_type="RETURN_TRANSFER_PACKED",
-                                parent_id=item['parent_id'],
-                                asin=item['asin'],
-                                quantity=item['quantity'],
-                                notes=f"Transferred good return to main stock: {item['quantity']} {item['unit']} of {item['display']}",
-                                transaction_date=datetime.datetime.now()
-                            )
-                        
-                        save_data()
-                        st.success(f"✅ Transferred {item['quantity']} {item['unit']} of {item['display']} to main stock!")
-                        st.rerun()
+                        with inventory.lock:
+                            # Transfer good return to main stock
+                            try:
+                                engine.transfer_good_return(
+                                    item['parent_id'],
+                                    item['asin'] if item['type'] != 'loose' else None,
+                                    notes=f"Transferred good return to main stock: {item['quantity']} {item['unit']} of {item['display']}"
+                                )
+                            except InventoryError as e:
+                                st.error(str(e))
+                            else:
+                                st.success(f"✅ Transferred {item['quantity']} {item['unit']} of {item['display']} to main stock!")
+                                st.rerun()
         else:
             st.info("No good returns available for transfer.")
     
@@ -4760,9 +3589,9 @@ def show_returns():
         total_bad_returns = 0
         return_summary = []
         
-        for parent_id, return_data in st.session_state.return_data.items():
-            parent_name = st.session_state.parent_items.get(parent_id, {}).get("name", parent_id)
-            parent_unit = st.session_state.parent_items.get(parent_id, {}).get("unit", "kg")
+        for parent_id, return_data in inventory.snapshot("return_data").items():
+            parent_name = inventory.parent_items.get(parent_id, {}).get("name", parent_id)
+            parent_unit = inventory.parent_items.get(parent_id, {}).get("unit", "kg")
             
             # Process loose returns
             loose_good = return_data.get("loose_return", {}).get("good", 0)
@@ -4782,7 +3611,7 @@ def show_returns():
                 packed_bad = return_stock.get("bad", 0)
                 
                 if packed_good > 0 or packed_bad > 0:
-                    asin_details = st.session_state.packet_variations.get(parent_id, {}).get(asin, {})
+                    asin_details = inventory.packet_variations.get(parent_id, {}).get(asin, {})
                     weight = asin_details.get('weight', 1.0)
                     description = asin_details.get('description', f"{weight}kg {parent_name}")
                     
@@ -4818,8 +3647,8 @@ def show_returns():
         
         # Show recent return transactions
         st.subheader("📝 Recent Return Transactions")
-        if st.session_state.return_transactions:
-            recent_returns = st.session_state.return_transactions[-10:]  # Last 10 transactions
+        if inventory.return_transactions:
+            recent_returns = inventory.return_transactions[-10:]  # Last 10 transactions
             
             transaction_data = []
             for trans in reversed(recent_returns):
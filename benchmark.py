@@ -0,0 +1,240 @@
+"""
+Benchmarks for the Stock Tracker application
+
+Builds synthetic inventories (N parents with M packet ASINs each, K
+transactions spread over D days and R returns) in a temporary folder and times
+the operations that grow with the data: saving and loading, recording
+transactions, the per-parent activity summaries, undoing a batch, bulk FBA
+uploads from 10 to 100k rows and the report functions in utils.py.
+
+Results are written as JSON so runs can be compared for regressions:
+
+    python benchmark.py [--quick] [--output benchmark_results.json]
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import pandas as pd
+from config import DEFAULT_SETTINGS
+from inventory import SharedInventory, empty_return_data
+from inventory_engine import InventoryEngine
+from storage import JournalStore
+from bulk import apply_confirmed_fba_sales
+from ingestion import catalog_frame, prepare_fba_review
+from utils import calculate_activity_summaries, calculate_daily_summary, calculate_stock_value, generate_stock_report, get_low_stock_items, get_top_selling_products
+
+# Inventory sizes: parents, ASINs per parent, transactions, days, returns
+SCALES = {
+    "small": {"parents": 20, "asins": 3, "transactions": 5000, "days": 30, "returns": 200},
+    "medium": {"parents": 100, "asins": 5, "transactions": 50000, "days": 180, "returns": 2000},
+    "large": {"parents": 500, "asins": 5, "transactions": 250000, "days": 365, "returns": 10000}
+}
+QUICK_SCALES = ["small"]
+
+# Rows in the synthetic FBA uploads
+UPLOAD_SIZES = [10, 100, 1000, 10000, 100000]
+QUICK_UPLOAD_SIZES = [10, 100, 1000]
+
+# Synthetic transaction types and how often each occurs
+TRANSACTION_MIX = [("Stock Inward", 2), ("Packing", 4), ("FBA Sale", 6), ("Easy Ship Sale (Bulk)", 4), ("Stock Adjustment", 1)]
+
+# Sales are grouped into upload batches of this many transactions
+BATCH_SIZE = 50
+
+def asin_for(parent_number, variation_number):
+    """Ten-character synthetic ASIN"""
+    return f"B{parent_number:05d}{variation_number:04d}"
+
+def generate_data(inventory, parents, asins, transactions, days, returns, seed=0):
+    """Fill an inventory with a synthetic catalog, ledger and returns"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    
+    inventory.parent_items = {}
+    inventory.packet_variations = {}
+    inventory.stock_data = {}
+    for p in range(parents):
+        parent_id = f"PARENT_{p:05d}"
+        inventory.parent_items[parent_id] = {"name": f"Product {p}", "unit": "kg", "category": f"Category {p % 10}", "reorder_level": 5.0}
+        inventory.packet_variations[parent_id] = {}
+        inventory.stock_data[parent_id] = {"loose_stock": rng.uniform(0, 500), "packed_stock": {}}
+        for v in range(asins):
+            asin = asin_for(p, v)
+            weight = [0.25, 0.5, 1, 2, 5][v % 5]
+            inventory.packet_variations[parent_id][asin] = {"weight": weight, "asin": asin, "description": f"{weight}kg Product {p}", "mrp": weight * 100}
+            # Deep enough stock that the synthetic uploads never run out
+            inventory.stock_data[parent_id]["packed_stock"][asin] = 10 ** 7
+    parent_ids = list(inventory.parent_items)
+    
+    types = [t for t, weight in TRANSACTION_MIX for _ in range(weight)]
+    ledger = []
+    batch_id = None
+    for transaction_id in range(1, transactions + 1):
+        transaction_type = rng.choice(types)
+        parent_id = rng.choice(parent_ids)
+        asin = rng.choice(list(inventory.packet_variations[parent_id])) if transaction_type != "Stock Inward" else None
+        transaction_date = today - datetime.timedelta(days=rng.randrange(days))
+        quantity = rng.randint(1, 20) if asin else 0
+        if "Sale" in transaction_type and (batch_id is None or transaction_id % BATCH_SIZE == 0):
+            batch_id = f"BENCH_BATCH_{transaction_id}"
+        ledger.append({
+            "id": transaction_id,
+            "timestamp": datetime.datetime.combine(transaction_date, datetime.time(12)).isoformat(),
+            "date": transaction_date.isoformat(),
+            "type": transaction_type,
+            "parent_id": parent_id,
+            "parent_name": inventory.parent_items[parent_id]["name"],
+            "asin": asin,
+            "quantity": quantity,
+            "weight": rng.uniform(1, 50) if not asin else quantity * inventory.packet_variations[parent_id][asin]["weight"],
+            "notes": "Synthetic",
+            **({"batch_id": batch_id} if "Sale" in transaction_type else {})
+        })
+    # Ledger order is date order, as it is when transactions are recorded day by day
+    ledger.sort(key=lambda t: t["date"])
+    inventory.replace_transactions(ledger)
+    
+    inventory.return_data = {parent_id: empty_return_data(parent_id, inventory.packet_variations) for parent_id in parent_ids}
+    inventory.return_transactions = []
+    for r in range(returns):
+        parent_id = rng.choice(parent_ids)
+        asin = rng.choice(list(inventory.packet_variations[parent_id]))
+        condition = rng.choice(["good", "bad"])
+        inventory.return_data[parent_id]["packed_return"][asin][condition] += 1
+        inventory.return_transactions.append({
+            "id": f"RET-{r:07d}",
+            "timestamp": datetime.datetime.now().isoformat(),
+            "type": "RETURN_PACKED",
+            "parent_id": parent_id,
+            "asin": asin,
+            "quantity": 1,
+            "unit": "packets",
+            "source": "Amazon",
+            "condition": condition,
+            "reason": "Synthetic"
+        })
+
+def fba_upload(inventory, rows, seed=0):
+    """Synthetic FBA shipment report with one row per shipped ASIN, a few of them unknown"""
+    rng = random.Random(seed)
+    asins = list(inventory.asin_index)
+    return pd.DataFrame({
+        "ASIN": [rng.choice(asins) if rng.random() > 0.02 else f"BUNKNOWN{i % 100:02d}" for i in range(rows)],
+        "Shipped": [rng.randint(0, 5) for _ in range(rows)],
+        "Merchant SKU": [f"SKU-{i}" for i in range(rows)],
+        "Title": ["Synthetic product"] * rows
+    })
+
+def timed(function, repeat=3):
+    """Run function repeat times and return the timings in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "mean": sum(times) / len(times), "runs": repeat}
+
+def make_inventory(folder, name):
+    """An empty inventory backed by a journal store in folder"""
+    store = JournalStore(f"{folder}/{name}.json", f"{folder}/{name}.journal")
+    return SharedInventory(store)
+
+def benchmark_scale(folder, name, sizes, repeat):
+    """Time the inventory operations on one synthetic inventory"""
+    inventory = make_inventory(folder, name)
+    inventory.load(lambda inv: generate_data(inv, **sizes))
+    today = datetime.date.today()
+    results = {}
+    
+    results["save_data"] = timed(inventory.save, repeat)
+    results["load_data"] = timed(lambda: make_inventory(folder, name).load(lambda inv: None), repeat)
+    
+    def record_transactions():
+        parent_id = next(iter(inventory.parent_items))
+        asin = next(iter(inventory.packet_variations[parent_id]))
+        for _ in range(100):
+            inventory.stock_data[parent_id]["packed_stock"][asin] -= 1
+            inventory.record_transaction("FBA Sale", parent_id, asin, 1, 1)
+    results["record_transaction_x100"] = timed(record_transactions, repeat)
+    
+    results["activity_summaries_all_parents"] = timed(lambda: calculate_activity_summaries(inventory.transactions_on(today)), repeat)
+    results["activity_view_today"] = timed(lambda: inventory.activity_on(today), repeat)
+    
+    # Undo batches through the engine, as the undo button does. The synthetic batches are dated in the
+    # past, outside the undo window, so fresh ones are recorded first and undone newest first.
+    engine = InventoryEngine(inventory)
+    rng = random.Random(1)
+    asins = list(inventory.asin_index)
+    batch_ids = []
+    for b in range(repeat):
+        batch_id = f"BENCH_UNDO_{b}"
+        with engine.batch():
+            for asin in rng.sample(asins, min(BATCH_SIZE, len(asins))):
+                engine.sell(inventory.find_parent(asin), asin, 1, batch_id=batch_id)
+        batch_ids.append(batch_id)
+    results["undo_batch"] = timed(lambda: engine.undo_batch(batch_ids.pop()), repeat)
+    
+    results["report_daily_summary"] = timed(lambda: calculate_daily_summary(inventory.transactions, today, inventory.date_index), repeat)
+    results["report_top_selling_products"] = timed(lambda: get_top_selling_products(inventory.transactions, inventory.parent_items, inventory.packet_variations, 30, inventory.date_index), repeat)
+    results["report_stock_report"] = timed(lambda: generate_stock_report(inventory.stock_data, inventory.parent_items, inventory.packet_variations, True), repeat)
+    results["report_low_stock_items"] = timed(lambda: get_low_stock_items(inventory.stock_data, inventory.parent_items, inventory.packet_variations), repeat)
+    results["report_stock_value"] = timed(lambda: calculate_stock_value(inventory.stock_data, inventory.parent_items, inventory.packet_variations), repeat)
+    return inventory, results
+
+def benchmark_uploads(inventory, upload_sizes, repeat):
+    """Time bulk FBA uploads of increasing size against an inventory"""
+    results = {}
+    for rows in upload_sizes:
+        review = prepare_fba_review(fba_upload(inventory, rows), catalog_frame(inventory))
+        ready_rows = review[review["Status"] == "Ready"]
+        # The biggest uploads run once; they dominate the total time
+        runs = repeat if rows <= 10000 else 1
+        results[f"fba_upload_{rows}_rows"] = timed(lambda: apply_confirmed_fba_sales(inventory, ready_rows), runs)
+        results[f"fba_upload_{rows}_rows"]["rows"] = rows
+    return results
+
+def run_benchmarks(scales, upload_sizes, repeat=3):
+    """Run every benchmark and return the report"""
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "storage_backend": "json",
+        "fsync_writes": DEFAULT_SETTINGS.get("fsync_writes", True),
+        "scales": {}
+    }
+    with tempfile.TemporaryDirectory() as folder:
+        for name in scales:
+            start = time.perf_counter()
+            inventory, results = benchmark_scale(folder, name, SCALES[name], repeat)
+            if name == scales[-1]:
+                results.update(benchmark_uploads(inventory, upload_sizes, repeat))
+            report["scales"][name] = {"sizes": SCALES[name], "results": results, "total_seconds": time.perf_counter() - start}
+            print(f"{name}: {len(results)} benchmarks in {report['scales'][name]['total_seconds']:.1f}s")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Stock Tracker on synthetic data")
+    parser.add_argument("--quick", action="store_true", help="Small inventory and uploads up to 1,000 rows only")
+    parser.add_argument("--scale", choices=list(SCALES), action="append", help="Inventory size to run (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON report")
+    args = parser.parse_args(argv)
+    
+    scales = args.scale or (QUICK_SCALES if args.quick else list(SCALES))
+    upload_sizes = QUICK_UPLOAD_SIZES if args.quick else UPLOAD_SIZES
+    report = run_benchmarks(scales, upload_sizes, args.repeat)
+    
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
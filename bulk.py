@@ -0,0 +1,382 @@
+"""
+Bulk processing for the Stock Tracker application
+
+The work behind the bulk upload pages, without any Streamlit calls, so it can
+run on the background job worker (or from a script) against the shared
+inventory. Each function reports progress through an optional callback
+progress(done, total, message) and returns a plain dict result that can be
+stored as JSON and shown later.
+"""
+
+import datetime
+from config import DEFAULT_SETTINGS
+from inventory_engine import InventoryEngine
+from metrics import count, timed
+
+def report(progress, done, total, message):
+    """Call the progress callback if there is one (callers pass a ProgressThrottle, so this is cheap per row)"""
+    if progress:
+        progress(done, total, message)
+
+def row_chunks(df):
+    """(position of first row, rows) for consecutive slices of bulk_commit_rows rows"""
+    size = DEFAULT_SETTINGS.get("bulk_commit_rows") or len(df) or 1
+    for start in range(0, len(df), size):
+        yield start, df.iloc[start:start + size]
+
+@timed("bulk_fba_sales")
+def apply_confirmed_fba_sales(inventory, ready_rows, batch_id=None, progress=None):
+    """Record the confirmed rows of a reviewed FBA upload as one batch (rolled back entirely on error)"""
+    engine = InventoryEngine(inventory)
+    if batch_id is None:
+        batch_id = f"FBA_CONFIRMED_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+    
+    success_details = []
+    error_details = []
+    total_rows = len(ready_rows)
+    
+    # Plain column lists are much cheaper to walk than iterrows()
+    rows = zip(
+        ready_rows['ASIN'].tolist(),
+        ready_rows['parent_id'].tolist(),
+        ready_rows['Shipped Qty'].tolist(),
+        ready_rows['Product Name'].tolist(),
+        ready_rows['Merchant SKU'].tolist(),
+        ready_rows['Order ID'].tolist()
+    )
+    
+    with engine.batch():
+        for index, (asin, parent_id, quantity, product_name, merchant_sku, order_id) in enumerate(rows):
+            try:
+                report(progress, index + 1, total_rows, f"Processing: {product_name}")
+                
+                # Check stock availability (final check)
+                available_stock = engine.packed_stock(parent_id, asin)
+                
+                # Another upload may have recorded the same order since the review
+                if order_id and inventory.order_applied("FBA Sale", order_id, asin):
+                    error_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Issue": "Already Recorded",
+                        "Available": available_stock,
+                        "Requested": quantity
+                    })
+                    continue
+                
+                if available_stock >= quantity:
+                    # Record transaction
+                    notes = f"FBA Sale - Bulk Upload"
+                    if order_id:
+                        notes += f" | Order: {order_id}"
+                    if merchant_sku:
+                        notes += f" | SKU: {merchant_sku}"
+                    
+                    engine.sell(
+                        parent_id, 
+                        asin, 
+                        quantity, 
+                        transaction_type="FBA Sale", 
+                        notes=notes,
+                        batch_id=batch_id,
+                        orders=[{"order_id": order_id, "sku": merchant_sku, "quantity": quantity}] if order_id else None
+                    )
+                    
+                    success_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Quantity": quantity,
+                        "Stock Before": available_stock,
+                        "Stock After": available_stock - quantity
+                    })
+                
+                else:
+                    error_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Issue": "Insufficient Stock",
+                        "Available": available_stock,
+                        "Requested": quantity
+                    })
+            
+            except Exception as e:
+                # A failed row may be half applied, so the whole upload is abandoned
+                raise RuntimeError(f"Upload rolled back - no stock was changed. Row {index + 1} (ASIN {asin}): {e}") from e
+    count("rows_processed", total_rows)
+    
+    return {"success_details": success_details, "error_details": error_details, "batch_id": batch_id, "processed_count": len(success_details)}
+
+@timed("bulk_easy_ship_sales")
+def apply_confirmed_easy_ship_sales(inventory, ready_rows, batch_id=None, progress=None):
+    """Record the confirmed rows of a reviewed Easy Ship upload as one batch, one transaction per ASIN and sale date (rolled back entirely on error)"""
+    engine = InventoryEngine(inventory)
+    if batch_id is None:
+        batch_id = f"EASY_SHIP_CONFIRMED_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+    
+    success_details = []
+    error_details = []
+    total_rows = len(ready_rows)
+    
+    # Each row carries the order lines it aggregates in its Order Lines column
+    rows = zip(
+        ready_rows['ASIN'].tolist(),
+        ready_rows['parent_id'].tolist(),
+        ready_rows['Quantity Purchased'].tolist(),
+        ready_rows['Sale Date'].tolist(),
+        ready_rows['Product Name'].tolist(),
+        ready_rows['SKU'].tolist(),
+        ready_rows['Order Lines'].tolist()
+    )
+    
+    with engine.batch():
+        for index, (asin, parent_id, quantity, sale_date, product_name, sku, order_details) in enumerate(rows):
+            try:
+                report(progress, index + 1, total_rows, f"Processing: {product_name}")
+                
+                # Check stock availability (final check)
+                available_stock = engine.packed_stock(parent_id, asin)
+                
+                # Another upload may have recorded some of these orders since the review
+                if any(line["order_id"] and inventory.order_applied("Easy Ship Sale", line["order_id"], asin) for line in order_details):
+                    error_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Sale Date": sale_date,
+                        "Orders": len(order_details),
+                        "Issue": "Already Recorded",
+                        "Available": available_stock,
+                        "Requested": quantity
+                    })
+                    continue
+                
+                if available_stock >= quantity:
+                    # Record transaction
+                    notes = f"Easy Ship Sale - Bulk Upload"
+                    if len(order_details) == 1 and order_details[0]["order_id"]:
+                        notes += f" | Order: {order_details[0]['order_id']}"
+                    elif len(order_details) > 1:
+                        notes += f" | {len(order_details)} orders"
+                    if sku:
+                        notes += f" | SKU: {sku}"
+                    # Recorded as today, like a manual sale; the report's date is kept in the notes
+                    notes += f" | Sale Date: {sale_date}"
+                    
+                    engine.sell(
+                        parent_id, 
+                        asin, 
+                        quantity, 
+                        transaction_type="Easy Ship Sale", 
+                        notes=notes,
+                        batch_id=batch_id,
+                        orders=order_details
+                    )
+                    
+                    success_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Sale Date": sale_date,
+                        "Orders": len(order_details),
+                        "Quantity": quantity,
+                        "Stock Before": available_stock,
+                        "Stock After": available_stock - quantity,
+                        "SKU": sku if sku else "N/A"
+                    })
+                
+                else:
+                    error_details.append({
+                        "ASIN": asin,
+                        "Product": product_name,
+                        "Sale Date": sale_date,
+                        "Orders": len(order_details),
+                        "Issue": "Insufficient Stock",
+                        "Available": available_stock,
+                        "Requested": quantity
+                    })
+            
+            except Exception as e:
+                # A failed row may be half applied, so the whole upload is abandoned
+                raise RuntimeError(f"Upload rolled back - no stock was changed. Row {index + 1} (ASIN {asin}): {e}") from e
+    count("rows_processed", total_rows)
+    
+    return {"success_details": success_details, "error_details": error_details, "batch_id": batch_id, "processed_count": len(success_details)}
+
+@timed("bulk_products_upload")
+def apply_products_upload(inventory, df, progress=None):
+    """Add or update the catalog products in an uploaded product file and save"""
+    imported_count = 0
+    updated_count = 0
+    errors = []
+    
+    # The lock is taken per chunk so other sessions aren't held up for the whole upload
+    for start, chunk in row_chunks(df):
+        with inventory.lock:
+            for position, (index, row) in enumerate(chunk.iterrows(), start):
+                try:
+                    report(progress, position + 1, len(df), f"Processing row {position + 1} of {len(df)}")
+                    
+                    # Extract required fields
+                    asin = str(row.get('ASIN', '')).strip().upper()
+                    parent_item_name = str(row.get('Parent_Item_Name', '')).strip()
+                    weight_kg = float(row.get('Weight_kg', 0))
+                    
+                    # Extract optional fields
+                    category = str(row.get('Category', 'Other')).strip()
+                    description = str(row.get('Description', '')).strip()
+                    mrp = float(row.get('MRP', 0))
+                    reorder_level = float(row.get('Reorder_Level_kg', 5.0))  # Default to 5kg if not provided
+                    notes = str(row.get('Notes', '')).strip()
+                    
+                    # Validation
+                    if not asin or not parent_item_name or weight_kg <= 0:
+                        errors.append(f"Row {index+1}: Missing required fields (ASIN: {asin}, Parent: {parent_item_name}, Weight: {weight_kg})")
+                        continue
+                    
+                    if len(asin) != 10 or not asin.replace('_', '').isalnum():
+                        errors.append(f"Row {index+1}: Invalid ASIN format - {asin}")
+                        continue
+                    
+                    # Create parent ID
+                    parent_id = parent_item_name.upper().replace(" ", "_").replace("-", "_")
+                    
+                    # Add parent item if not exists
+                    if parent_id not in inventory.parent_items:
+                        inventory.parent_items[parent_id] = {
+                            "name": parent_item_name,
+                            "unit": "kg",
+                            "category": category,
+                            "reorder_level": reorder_level
+                        }
+                        # Initialize stock data
+                        inventory.stock_data[parent_id] = {
+                            "loose_stock": 0,
+                            "packed_stock": {},
+                            "opening_stock": 0,
+                            "last_updated": datetime.datetime.now().isoformat()
+                        }
+                    else:
+                        # Update reorder level for existing parent
+                        inventory.parent_items[parent_id]["reorder_level"] = reorder_level
+                    
+                    # Check if ASIN already exists
+                    existing_parent = inventory.find_parent(asin)
+                    
+                    if existing_parent:
+                        # Update existing ASIN
+                        inventory.packet_variations[existing_parent][asin].update({
+                            "weight": weight_kg,
+                            "description": description or f"{weight_kg}kg {parent_item_name}",
+                            "mrp": mrp,
+                            "category": category,
+                            "notes": notes
+                        })
+                        updated_count += 1
+                    else:
+                        # Add new ASIN
+                        inventory.add_variation(parent_id, asin, {
+                            "weight": weight_kg,
+                            "asin": asin,
+                            "description": description or f"{weight_kg}kg {parent_item_name}",
+                            "mrp": mrp,
+                            "category": category,
+                            "notes": notes
+                        })
+                        
+                        # Initialize packed stock
+                        inventory.stock_data[parent_id]["packed_stock"][asin] = 0
+                        imported_count += 1
+                
+                except Exception as e:
+                    errors.append(f"Row {index+1}: Error processing - {str(e)}")
+    
+    # Catalog changes aren't journaled, so the whole upload is written with one snapshot
+    inventory.save()
+    count("rows_processed", len(df))
+    
+    return {"imported_count": imported_count, "updated_count": updated_count, "errors": errors}
+
+@timed("bulk_stock_updates")
+def apply_stock_updates(inventory, changes_df, progress=None):
+    """Set parent loose stock and ASIN packed stock from an uploaded stock template, committing a chunk of rows at a time"""
+    engine = InventoryEngine(inventory)
+    updated_count = 0
+    errors = []
+    
+    # One journal entry per chunk instead of one per row, and the lock is released between chunks
+    for start, chunk in row_chunks(changes_df):
+        with engine.batch():
+            for position, (index, row) in enumerate(chunk.iterrows(), start):
+                try:
+                    report(progress, position + 1, len(changes_df), f"Processing stock update {position + 1} of {len(changes_df)}")
+                    
+                    # Extract fields
+                    update_type = str(row.get('Type', 'ASIN_PACKED')).strip()
+                    parent_id = str(row.get('Parent_ID', '')).strip()
+                    asin = str(row.get('ASIN', '')).strip()
+                    new_stock = float(row.get('New_Stock', 0))
+                    update_reason = str(row.get('Update_Reason', 'Bulk stock update')).strip()
+                    
+                    # Validation
+                    if not parent_id:
+                        errors.append(f"Row {index+1}: Missing Parent_ID")
+                        continue
+                    
+                    if new_stock < 0:
+                        errors.append(f"Row {index+1}: Invalid stock value - {new_stock}")
+                        continue
+                    
+                    # Process based on type
+                    if update_type == "PARENT_LOOSE":
+                        # Handle loose stock update
+                        if parent_id not in inventory.parent_items:
+                            errors.append(f"Row {index+1}: Parent product {parent_id} not found")
+                            continue
+                        
+                        # Set the loose stock and record the difference
+                        engine.set_loose_stock(
+                            parent_id,
+                            new_stock,
+                            lambda old, new: f"Bulk loose stock update | Reason: {update_reason} | Changed from {old} to {new} kg",
+                            "Loose Stock Adjustment (Bulk)"
+                        )
+                        
+                        updated_count += 1
+                    
+                    elif update_type == "ASIN_PACKED":
+                        # Handle ASIN-based packed stock update
+                        if not asin:
+                            errors.append(f"Row {index+1}: Missing ASIN for packed stock update")
+                            continue
+                        
+                        pid = inventory.find_parent(asin)
+                        if not pid:
+                            errors.append(f"Row {index+1}: ASIN {asin} not found in product catalog")
+                            continue
+                        
+                        # Set the packed stock and record the difference
+                        engine.set_packed_stock(
+                            pid,
+                            asin,
+                            int(new_stock),
+                            lambda old, new: f"Bulk packed stock update | Reason: {update_reason} | Changed from {old} to {new} units",
+                            "Packed Stock Adjustment (Bulk)"
+                        )
+                        
+                        updated_count += 1
+                    
+                    else:
+                        errors.append(f"Row {index+1}: Unknown update type - {update_type}")
+                
+                except Exception as e:
+                    errors.append(f"Row {index+1}: Error processing - {str(e)}")
+    
+    count("rows_processed", len(changes_df))
+    
+    return {"updated_count": updated_count, "errors": errors}
+
+# Job kind -> bulk function, as run by the background job worker
+BULK_JOBS = {
+    "fba_sales": apply_confirmed_fba_sales,
+    "easy_ship_sales": apply_confirmed_easy_ship_sales,
+    "products_upload": apply_products_upload,
+    "stock_updates": apply_stock_updates
+}
@@ -16,7 +16,22 @@ DEFAULT_SETTINGS = {
     "date_format": "%Y-%m-%d",
     "time_format": "%H:%M:%S",
     "undo_window_hours": 24,  # Hours within which transactions can be undone
-    "max_recent_transactions": 50  # Maximum number of recent transactions to allow undo
+    "max_recent_transactions": 50,  # Maximum number of recent transactions to allow undo
+    "journal_mode": True,  # Append transactions to a journal instead of rewriting the data file
+    "journal_compact_entries": 1000,  # Compact the journal into the data file after this many entries
+    "journal_compact_bytes": 5 * 1024 * 1024,  # ...or once the journal grows past this size
+    "storage_backend": "json",  # json (data file + journal) or sqlite
+    "fsync_writes": True,  # Flush every commit to disk before reporting it saved
+    "group_commit_window_ms": 3,  # Writes arriving within this window share one fsync
+    "upload_chunk_rows": 5000,  # Uploaded reports are read and validated this many rows at a time
+    "upload_cache_mb": 64,  # Memory kept for parsed uploads, so reruns don't parse the same file again
+    "progress_updates_per_second": 5,  # Bulk loops redraw their progress at most this often
+    "bulk_commit_rows": 500,  # Product and stock uploads take the lock and commit this many rows at a time
+    "metrics_buffer_size": 1000,  # Timings kept in memory for the performance panel
+    "profile_top_n": 25,  # Functions and allocation sites listed inline after a profiled render
+    "metrics_http_port": None,  # Serve Prometheus metrics at http://127.0.0.1:<port>/metrics (None = off)
+    "metrics_textfile": None,  # ...and/or rewrite this file for node_exporter's textfile collector (None = off)
+    "metrics_textfile_interval": 15  # Seconds between textfile rewrites
 }
 
 # Sample product categories
@@ -105,6 +120,8 @@ DASHBOARD_COLORS = {
 # File paths
 FILE_PATHS = {
     "data_file": "stock_data.json",
+    "journal_file": "stock_data.journal",
+    "sqlite_file": "stock_data.db",
     "backup_folder": "backups",
     "uploads_folder": "uploads",
     "exports_folder": "exports"
@@ -0,0 +1,37 @@
+"""
+Shared test fixtures: inventories on a journal store in a temporary folder
+"""
+
+import pytest
+
+from inventory import SharedInventory
+from storage import JournalStore
+
+def seed(inventory):
+    """Rice in 1kg and 5kg packets, with some loose and packed stock"""
+    inventory.parent_items = {"RICE": {"name": "Rice", "unit": "kg"}}
+    inventory.packet_variations = {"RICE": {
+        "B000000001": {"weight": 1, "description": "Rice 1kg"},
+        "B000000005": {"weight": 5, "description": ""}
+    }}
+    inventory.stock_data = {"RICE": {"loose_stock": 10, "packed_stock": {"B000000001": 5, "B000000005": 1}}}
+
+@pytest.fixture
+def open_inventory(tmp_path):
+    """Load an inventory from the store in the test's folder, as a restart would (seeding it if the store is empty)"""
+    def open_inventory(initializer=seed, **store_options):
+        store = JournalStore(str(tmp_path / "stock_data.json"), str(tmp_path / "stock_data.journal"), **store_options)
+        inventory = SharedInventory(store)
+        inventory.load(initializer)
+        return inventory
+    return open_inventory
+
+@pytest.fixture
+def inventory(open_inventory):
+    """Inventory on an empty store, with no catalog"""
+    return open_inventory(lambda inventory: None)
+
+@pytest.fixture
+def seeded_inventory(open_inventory):
+    """Inventory seeded with the rice catalog from seed()"""
+    return open_inventory()
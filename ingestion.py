@@ -0,0 +1,456 @@
+"""
+Upload ingestion for the Stock Tracker application
+
+Bulk sales uploads are validated column by column: the uploaded rows are
+joined against a catalog frame built once from the inventory, and the review
+flags (product found, enough stock) are computed as vector operations instead
+of looking each row up on its own.
+
+Easy Ship order reports are aggregated to one row per ASIN and sale date, so
+stock is changed once per product rather than once per order line; the order
+lines themselves are kept on the resulting transactions for audit. Order lines
+already recorded (same channel, order ID and ASIN) are dropped before review,
+so overlapping reports can be uploaded again without selling twice.
+
+Uploads are read in bounded chunks (openpyxl read-only mode for .xlsx, the
+chunked CSV reader for .csv and tab-delimited .txt/.tsv reports), so memory
+stays flat and validation can start before the whole file has been parsed.
+Flat files go through pyarrow's streaming CSV reader when it is installed.
+Report headers are matched against EXCEL_COLUMN_MAPPINGS.
+
+Every widget interaction reruns the page, so parsed and reviewed uploads are
+kept in an UploadCache keyed by a hash of the file's contents (plus the
+inventory version for results that depend on stock levels).
+"""
+
+import csv
+import datetime
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from config import DEFAULT_SETTINGS, EXCEL_COLUMN_MAPPINGS
+
+# Review table columns that are only used for processing, not shown to the user
+HIDDEN_REVIEW_COLUMNS = ["parent_id", "Insufficient Stock"]
+
+# Cell texts read_excel treats as missing values
+NA_STRINGS = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+
+def xlsx_frame(rows, columns):
+    """DataFrame from raw worksheet rows, with missing-value texts read as NaN like read_excel"""
+    frame = pd.DataFrame(rows, columns=columns)
+    return frame.where(~(frame.isin(NA_STRINGS) | frame.isna()), np.nan).infer_objects()
+
+def iter_xlsx_chunks(uploaded_file, chunk_rows):
+    """Stream the first sheet of an .xlsx workbook as DataFrames"""
+    import openpyxl
+    
+    workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        
+        # Like read_excel, drop unnamed trailing columns and trailing blank rows but keep blank rows in between
+        header = list(header)
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        columns = [str(name) if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        
+        batch = []
+        blank_rows = 0
+        for row in rows:
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(value is None for value in row):
+                blank_rows += 1
+                continue
+            batch.extend([(None,) * width] * blank_rows)
+            blank_rows = 0
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield xlsx_frame(batch, columns)
+                batch = []
+        yield xlsx_frame(batch, columns)
+    finally:
+        workbook.close()
+
+def numeric_columns(frame):
+    """Convert text columns holding only numbers, as the pandas CSV reader does"""
+    for column in frame.columns:
+        try:
+            frame[column] = pd.to_numeric(frame[column])
+        except (ValueError, TypeError):
+            pass
+    return frame
+
+def iter_flat_file_chunks(uploaded_file, sep, chunk_rows):
+    """Stream a delimited text report, using pyarrow's multithreaded reader when it is installed"""
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        yield from pd.read_csv(uploaded_file, sep=sep, chunksize=chunk_rows)
+        return
+    
+    # Every column is read as text so a later block can't contradict the types pyarrow
+    # guessed from the first one; numbers are then picked up per chunk
+    header_line = uploaded_file.readline().decode("utf-8-sig")
+    uploaded_file.seek(0)
+    header = next(csv.reader([header_line], delimiter=sep), [])
+    reader = pa_csv.open_csv(
+        uploaded_file,
+        parse_options=pa_csv.ParseOptions(delimiter=sep),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in header},
+            strings_can_be_null=True,
+            null_values=NA_STRINGS
+        )
+    )
+    for batch in reader:
+        frame = batch.to_pandas()
+        for start in range(0, len(frame), chunk_rows):
+            yield numeric_columns(frame.iloc[start:start + chunk_rows].reset_index(drop=True))
+
+def iter_upload_chunks(uploaded_file, chunk_rows=None):
+    """Read an uploaded report as DataFrames of at most chunk_rows rows (always at least one)"""
+    chunk_rows = chunk_rows or DEFAULT_SETTINGS.get("upload_chunk_rows", 5000)
+    name = getattr(uploaded_file, "name", "").lower()
+    
+    if name.endswith(".csv"):
+        chunks = iter_flat_file_chunks(uploaded_file, ",", chunk_rows)
+    elif name.endswith((".txt", ".tsv")):
+        # Amazon flat-file reports are tab-delimited
+        chunks = iter_flat_file_chunks(uploaded_file, "\t", chunk_rows)
+    elif name.endswith((".xlsx", ".xlsm")):
+        chunks = iter_xlsx_chunks(uploaded_file, chunk_rows)
+    else:
+        # Old .xls workbooks have no streaming reader
+        chunks = [pd.read_excel(uploaded_file)]
+    
+    empty = True
+    for chunk in chunks:
+        empty = False
+        yield chunk
+    if empty:
+        yield pd.DataFrame()
+
+def read_upload(uploaded_file):
+    """Read a whole uploaded file into one DataFrame"""
+    return pd.concat(list(iter_upload_chunks(uploaded_file)), ignore_index=True)
+
+def read_fba_upload(uploaded_file, progress=None):
+    """Read an FBA report chunk by chunk into its sales rows (returns columns, missing columns, sales)"""
+    columns = None
+    missing_cols = []
+    sales_chunks = []
+    rows_read = 0
+    
+    for chunk in iter_upload_chunks(uploaded_file):
+        if columns is None:
+            # Check required columns before reading any further
+            columns = list(chunk.columns)
+            column_mapping, missing_cols = resolve_columns(columns, "fba_sales")
+            if missing_cols:
+                return columns, missing_cols, None
+        
+        sales_chunks.append(normalize_fba(chunk, column_mapping))
+        rows_read += len(chunk)
+        if progress:
+            progress(rows_read)
+    return columns, missing_cols, pd.concat(sales_chunks, ignore_index=True)
+
+def review_fba_upload(uploaded_file, catalog, progress=None):
+    """Read an FBA report into its review table (returns columns, missing columns, review)"""
+    columns, missing_cols, sales = read_fba_upload(uploaded_file, progress)
+    if missing_cols:
+        return columns, missing_cols, None
+    return columns, missing_cols, fba_review(sales, catalog)
+
+def read_easy_ship_upload(uploaded_file, progress=None):
+    """Read an Easy Ship report chunk by chunk into order lines (returns columns, missing columns, orders)"""
+    columns = None
+    missing_cols = []
+    order_chunks = []
+    rows_read = 0
+    
+    for chunk in iter_upload_chunks(uploaded_file):
+        if columns is None:
+            # Check required columns (case-insensitive) before reading any further
+            columns = list(chunk.columns)
+            column_mapping, missing_cols = resolve_columns(columns, "easy_ship_sales")
+            if missing_cols:
+                return columns, missing_cols, None
+        
+        order_chunks.append(normalize_easy_ship(chunk, column_mapping))
+        rows_read += len(chunk)
+        if progress:
+            progress(rows_read)
+    return columns, missing_cols, pd.concat(order_chunks, ignore_index=True)
+
+def upload_digest(uploaded_file):
+    """SHA-256 of an uploaded file's contents"""
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+def result_size(value):
+    """Approximate memory held by a cached result, counting DataFrames in full"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sum(result_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_size(item) for item in value)
+    return 64
+
+class UploadCache:
+    """Parsed upload results shared by every session, least recently used dropped past a memory cap"""
+    
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = DEFAULT_SETTINGS.get("upload_cache_mb", 64) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Key -> (result, size), oldest use first
+        self.entries = OrderedDict()
+        self.size = 0
+    
+    def get(self, key):
+        """Get a cached result (None if not cached)"""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+    
+    def put(self, key, result):
+        """Cache a result, evicting the least recently used ones to stay under the cap"""
+        size = result_size(result)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                # Too big to keep; it would only push everything else out
+                return
+            self.entries[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+    
+    def get_or_build(self, key, build):
+        """Get a cached result, or build and cache it (results must be treated as read-only)"""
+        result = self.get(key)
+        if result is None:
+            result = build()
+            self.put(key, result)
+        return result
+    
+    def clear(self):
+        """Drop every cached result"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+def product_name(description, weight, parent_name):
+    """Display name of a packet variation, falling back to weight and parent name"""
+    if not description or str(description).lower() in ['nan', 'null', 'none', '']:
+        return f"{weight}kg {parent_name}"
+    return description
+
+def catalog_frame(inventory):
+    """One row per catalog ASIN with its parent, product name, weight and current packed stock"""
+    rows = []
+    with inventory.lock:
+        for asin, parent_id in inventory.asin_index.items():
+            details = inventory.packet_variations.get(parent_id, {}).get(asin, {})
+            weight = details.get("weight", 0)
+            parent_name = inventory.parent_items.get(parent_id, {}).get("name", "Unknown")
+            rows.append({
+                "ASIN": asin,
+                "parent_id": parent_id,
+                "Product Name": product_name(details.get("description", ""), weight, parent_name),
+                "weight": weight,
+                "Weight": f"{weight}kg",
+                # Kept as Python numbers so the review table shows them exactly as stored
+                "stock": inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+            })
+    
+    frame = pd.DataFrame(rows, columns=["ASIN", "parent_id", "Product Name", "weight", "Weight", "stock"])
+    frame["stock"] = frame["stock"].astype(object)
+    return frame.set_index("ASIN")
+
+def text_column(df, column):
+    """Stripped text values of an optional column (empty strings if the column is missing)"""
+    if column is None or column not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    return df[column].fillna("").astype(str).str.strip().to_numpy()
+
+def review_frame(keys, quantities, catalog, needed=None):
+    """Catalog columns and issue flags shared by the review tables (needed defaults to quantities)"""
+    matched = catalog.reindex(keys)
+    found = matched["parent_id"].notna().to_numpy()
+    stock = pd.to_numeric(matched["stock"], errors="coerce").to_numpy()
+    if needed is None:
+        needed = quantities
+    return {
+        "Product Name": np.where(found, matched["Product Name"].to_numpy(), "Unknown Product"),
+        "Weight": np.where(found, matched["Weight"].to_numpy(), "Unknown"),
+        "Current Stock": np.where(found, matched["stock"].to_numpy(), "Unknown"),
+        "Status": np.where(found, "Ready", "Not Found"),
+        "parent_id": np.where(found, matched["parent_id"].to_numpy(), None),
+        "Insufficient Stock": found & (stock < needed)
+    }
+
+def normalize_fba(df, column_mapping=None):
+    """Rows of an FBA shipment report with a shipped quantity > 0, in the columns the review uses"""
+    column_mapping = column_mapping or {"asin": "ASIN", "quantity": "Shipped"}
+    quantities = pd.to_numeric(df[column_mapping["quantity"]], errors="coerce").fillna(0)
+    sales = df[quantities > 0]
+    return pd.DataFrame({
+        "ASIN": sales[column_mapping["asin"]].astype(str).str.strip().to_numpy(),
+        "Order ID": text_column(sales, column_mapping.get("order_id")),
+        "Merchant SKU": text_column(sales, "Merchant SKU"),
+        "FNSKU": text_column(sales, "FNSKU"),
+        "Shipped Qty": quantities[quantities > 0].astype(int).to_numpy()
+    })
+
+def fba_review(sales, catalog):
+    """Review table for normalized FBA sales rows"""
+    asins = sales["ASIN"].to_numpy()
+    shipped = sales["Shipped Qty"].to_numpy()
+    
+    # A single join against the catalog instead of a lookup per row
+    review = review_frame(asins, shipped, catalog)
+    
+    return pd.DataFrame({
+        "ASIN": asins,
+        "Product Name": review["Product Name"],
+        "Weight": review["Weight"],
+        "Current Stock": review["Current Stock"],
+        "Order ID": sales["Order ID"].to_numpy(),
+        "Merchant SKU": sales["Merchant SKU"].to_numpy(),
+        "FNSKU": sales["FNSKU"].to_numpy(),
+        "Shipped Qty": shipped,
+        "Status": review["Status"],
+        "parent_id": review["parent_id"],
+        "Insufficient Stock": review["Insufficient Stock"]
+    })
+
+def prepare_fba_review(df, catalog, column_mapping=None):
+    """Review table for the rows of an FBA shipment report with a shipped quantity > 0"""
+    return fba_review(normalize_fba(df, column_mapping), catalog)
+
+def review_styles(review_df):
+    """Background colours for the review table: red for unknown products, orange for insufficient stock"""
+    styles = pd.DataFrame("", index=review_df.index, columns=review_df.columns)
+    styles[(review_df["Status"] == "Not Found").to_numpy()] = "background-color: #ffebee"
+    styles[review_df["Insufficient Stock"].to_numpy()] = "background-color: #fff3e0"
+    return styles
+
+def header_key(name):
+    """A header as compared when resolving columns: case, spaces and -/_ don't matter"""
+    return str(name).strip().lower().replace('-', '_').replace(' ', '_')
+
+def resolve_columns(columns, report_type, required=("asin", "quantity")):
+    """Match an upload's headers to the EXCEL_COLUMN_MAPPINGS fields of a report type (returns mapping, missing)"""
+    headers = {}
+    for column in columns:
+        headers.setdefault(header_key(column), column)
+    
+    column_mapping = {}
+    missing_cols = []
+    for field, candidates in EXCEL_COLUMN_MAPPINGS[report_type].items():
+        # Candidates are listed in order of preference
+        for candidate in candidates:
+            if header_key(candidate) in headers:
+                column_mapping[field] = headers[header_key(candidate)]
+                break
+        else:
+            if field in required:
+                missing_cols.append(candidates[0])
+    return column_mapping, missing_cols
+
+def sale_dates(df, column):
+    """ISO sale dates from an optional date column in local time (today where missing or unreadable)"""
+    today = datetime.date.today().isoformat()
+    if column is None or column not in df.columns:
+        return np.full(len(df), today, dtype=object)
+    
+    values = df[column]
+    if pd.api.types.is_datetime64_any_dtype(values) and values.dt.tz is None:
+        # Excel dates carry no zone and are already local
+        parsed = values
+    else:
+        # Amazon reports give UTC timestamps, which can fall on the previous local day
+        parsed = pd.to_datetime(values, errors="coerce", utc=True).dt.tz_convert(datetime.datetime.now().astimezone().tzinfo)
+    return parsed.dt.strftime("%Y-%m-%d").fillna(today).to_numpy()
+
+def normalize_easy_ship(df, column_mapping):
+    """One row per order line with quantity-purchased > 0: Order ID, ASIN, SKU, Quantity and Sale Date"""
+    quantities = pd.to_numeric(df[column_mapping['quantity']], errors="coerce").fillna(0).astype(int)
+    sales = df[quantities > 0]
+    return pd.DataFrame({
+        "Order ID": text_column(sales, column_mapping.get('order_id')),
+        "ASIN": sales[column_mapping['asin']].astype(str).str.strip().to_numpy(),
+        "SKU": text_column(sales, "sku"),
+        "Quantity": quantities[quantities > 0].to_numpy(),
+        "Sale Date": sale_dates(sales, column_mapping.get('date'))
+    })
+
+def aggregate_easy_ship(orders, catalog):
+    """Review table with one row per ASIN and sale date, summing the order lines"""
+    grouped = orders.groupby(["ASIN", "Sale Date"], sort=False).agg(
+        Quantity=("Quantity", "sum"),
+        Orders=("Quantity", "size"),
+        SKU=("SKU", "first")
+    ).reset_index().sort_values("Sale Date", kind="stable").reset_index(drop=True)
+    
+    # Later dates of an ASIN draw on the stock left by the earlier ones
+    quantities = grouped["Quantity"].to_numpy()
+    needed = grouped.groupby("ASIN", sort=False)["Quantity"].cumsum().to_numpy()
+    review = review_frame(grouped["ASIN"].to_numpy(), quantities, catalog, needed)
+    
+    return pd.DataFrame({
+        "ASIN": grouped["ASIN"].to_numpy(),
+        "Product Name": review["Product Name"],
+        "Weight": review["Weight"],
+        "Current Stock": review["Current Stock"],
+        "Sale Date": grouped["Sale Date"].to_numpy(),
+        "Orders": grouped["Orders"].to_numpy(),
+        "SKU": grouped["SKU"].to_numpy(),
+        "Quantity Purchased": quantities,
+        "Status": review["Status"],
+        "parent_id": review["parent_id"],
+        "Insufficient Stock": review["Insufficient Stock"]
+    })
+
+def drop_applied_orders(rows, applied_orders, channel):
+    """Drop rows whose (channel, Order ID, ASIN) is already in applied_orders (returns remaining rows, dropped count)"""
+    order_ids = rows["Order ID"].tolist()
+    applied = np.fromiter(
+        ((channel, order_id, asin) in applied_orders for order_id, asin in zip(order_ids, rows["ASIN"].tolist())),
+        dtype=bool,
+        count=len(order_ids)
+    )
+    if not applied.any():
+        return rows, 0
+    return rows[~applied].reset_index(drop=True), int(applied.sum())
+
+def order_lines(orders):
+    """Order lines per (ASIN, sale date), kept on the aggregated transaction for audit"""
+    lines = {}
+    for order_id, asin, sku, quantity, sale_date in zip(
+        orders["Order ID"].tolist(),
+        orders["ASIN"].tolist(),
+        orders["SKU"].tolist(),
+        orders["Quantity"].tolist(),
+        orders["Sale Date"].tolist()
+    ):
+        lines.setdefault((asin, sale_date), []).append({"order_id": order_id, "sku": sku, "quantity": quantity})
+    return lines
@@ -0,0 +1,560 @@
+"""
+Process-wide inventory for the Stock Tracker application
+
+Every Streamlit session works on the same SharedInventory instead of holding
+its own copy in st.session_state. Changes go through the inventory lock, so
+concurrent sessions never interleave a stock check with another session's
+update, and every session sees the same stock levels and transactions.
+
+Writes are handed to the store under the lock, but waiting for them to reach
+the disk happens after the outermost holder has released it, so sessions
+writing at the same time can share one fsync.
+"""
+
+import bisect
+import copy
+import datetime
+import threading
+from contextlib import contextmanager
+from config import DEFAULT_SETTINGS
+from metrics import count, timer
+from utils import add_activity, calculate_activity_summaries, empty_activity_summary
+
+# Everything that is persisted, in the order it is written to the store
+DATA_KEYS = [
+    "stock_data",
+    "transactions",
+    "parent_items",
+    "packet_variations",
+    "daily_opening_stock",
+    "return_data",
+    "return_transactions"
+]
+
+def empty_return_data(parent_id, packet_variations):
+    """Zeroed return counts for a parent and its packet variations"""
+    return_data = {
+        "loose_return": {"good": 0, "bad": 0},
+        "packed_return": {}
+    }
+    for asin in packet_variations.get(parent_id, {}):
+        return_data["packed_return"][asin] = {"good": 0, "bad": 0}
+    return return_data
+
+def order_keys(transaction):
+    """(channel, order ID, ASIN) keys of the order lines a sale was recorded from, the channel being its type"""
+    return [
+        (transaction.get("type"), line["order_id"], transaction.get("asin"))
+        for line in transaction.get("orders") or []
+        if line.get("order_id")
+    ]
+
+def remove_from_bucket(buckets, key, transaction):
+    """Remove one transaction (by identity) from an index bucket, dropping the bucket once empty"""
+    bucket = buckets.get(key)
+    if not bucket:
+        return False
+    # Newer transactions sit at the end of their bucket, so search backwards
+    for position in range(len(bucket) - 1, -1, -1):
+        if bucket[position] is transaction:
+            del bucket[position]
+            break
+    if not bucket:
+        del buckets[key]
+        return True
+    return False
+
+class CommitLock:
+    """Re-entrant lock that calls on_release each time its outermost holder lets go"""
+    
+    def __init__(self, on_release):
+        self.lock = threading.RLock()
+        self.depth = threading.local()
+        self.on_release = on_release
+    
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.lock.acquire(blocking, timeout):
+            return False
+        self.depth.value = getattr(self.depth, "value", 0) + 1
+        return True
+    
+    def release(self):
+        self.depth.value -= 1
+        self.lock.release()
+        if self.depth.value == 0:
+            self.on_release()
+    
+    def __enter__(self):
+        return self.acquire()
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SharedInventory:
+    """Stock levels, catalog and transactions shared by every session in the process"""
+    
+    def __init__(self, store):
+        self.store = store
+        # Re-entrant so helpers can take the lock again inside a batch. Letting go of
+        # the outermost hold waits for the writes this thread queued on the store.
+        self.lock = CommitLock(self.wait_for_store)
+        self.pending_writes = threading.local()
+        self.stock_data = {}
+        self.transactions = []
+        self.parent_items = {}
+        self.packet_variations = {}
+        self.daily_opening_stock = {}
+        self.return_data = {}
+        self.return_transactions = []
+        self.load_error = None
+        
+        # ASIN -> parent_id, kept in step with packet_variations by the catalog methods below
+        self.asin_index = {}
+        
+        # Transaction ID -> position in transactions, and the next ID to hand out
+        self.transaction_index = {}
+        self.next_transaction_id = 1
+        
+        # ISO date -> that day's transactions in ledger order, plus the dates kept sorted for range queries
+        self.date_index = {}
+        self.sorted_dates = []
+        
+        # Batch ID -> the batch's transactions, and ASIN -> the transactions touching it, both in ledger order
+        self.batch_index = {}
+        self.asin_transactions = {}
+        
+        # (channel, order ID, ASIN) -> the transaction that applied that order line. Built from the
+        # order lines kept on each transaction, so it is persisted with them and undo drops its keys.
+        self.applied_orders = {}
+        
+        # ISO date -> per-product activity totals for that day, updated as transactions come and go.
+        # Each day carries the transaction count and last ID it was built from, so a persisted view
+        # that missed journaled transactions is recomputed on load.
+        self.daily_activity = {}
+        
+        # Bumped on every save or recorded transaction, so results derived from stock levels can tell they are stale
+        self.version = 0
+        
+        # Transactions staged by an open batch() (None when no batch is open)
+        self.batch_transactions = None
+        self.batch_parents = None
+    
+    def load(self, initializer):
+        """Load from the store, or seed with initializer(inventory) and save if the store is empty"""
+        with self.lock, timer("load_data") as fields:
+            data = self.store.load()
+            if data is None:
+                initializer(self)
+            else:
+                self.stock_data = data.get("stock_data", {})
+                self.transactions = data.get("transactions", [])
+                self.parent_items = data.get("parent_items", {})
+                self.packet_variations = data.get("packet_variations", {})
+                self.daily_opening_stock = data.get("daily_opening_stock", {})
+                self.daily_activity = data.get("daily_activity", {})
+                self.return_data = data.get("return_data", {})
+                self.return_transactions = data.get("return_transactions", [])
+                self.next_transaction_id = data.get("next_transaction_id") or 1
+            self.upgrade()
+            self.rebuild_asin_index()
+            self.rebuild_transaction_index()
+            fields["transactions"] = len(self.transactions)
+            
+            if data is None:
+                # Write the first snapshot so journaled transactions have a base to replay on
+                self.save()
+    
+    def upgrade(self):
+        """Fill in fields added since older data files were written"""
+        # Ensure return data is initialized for existing data
+        if not self.return_data:
+            for parent_id in self.parent_items:
+                self.return_data[parent_id] = empty_return_data(parent_id, self.packet_variations)
+        
+        # Add reorder level to existing parent items (backward compatibility)
+        for parent_id, parent_info in self.parent_items.items():
+            if "reorder_level" not in parent_info:
+                parent_info["reorder_level"] = 5.0  # Default reorder level of 5kg
+    
+    def rebuild_asin_index(self):
+        """Rebuild the ASIN -> parent index after packet_variations is replaced wholesale"""
+        with self.lock:
+            asin_index = {}
+            for parent_id, variations in self.packet_variations.items():
+                for asin in variations:
+                    # Keep the first parent if an ASIN is listed twice, like the old lookup loops did
+                    asin_index.setdefault(asin, parent_id)
+            self.asin_index = asin_index
+    
+    def find_parent(self, asin):
+        """Get the parent ID for an ASIN (None if it is not in the catalog)"""
+        return self.asin_index.get(asin)
+    
+    def snapshot(self, name):
+        """Deep copy of one of the shared dicts (stock_data, parent_items, ...) taken under the lock, for pages to iterate while other sessions write"""
+        with self.lock:
+            return copy.deepcopy(getattr(self, name))
+    
+    def variations(self, parent_id):
+        """Copy of one parent's packet variations taken under the lock"""
+        with self.lock:
+            return copy.deepcopy(self.packet_variations.get(parent_id, {}))
+    
+    def add_variation(self, parent_id, asin, details):
+        """Add or replace a packet variation"""
+        with self.lock:
+            self.packet_variations.setdefault(parent_id, {})[asin] = details
+            self.asin_index.setdefault(asin, parent_id)
+    
+    def remove_variation(self, parent_id, asin):
+        """Remove a packet variation if it exists"""
+        with self.lock:
+            if asin in self.packet_variations.get(parent_id, {}):
+                del self.packet_variations[parent_id][asin]
+                if self.asin_index.get(asin) == parent_id:
+                    # Fall back to another parent still listing the ASIN, if any
+                    del self.asin_index[asin]
+                    for other_id, variations in self.packet_variations.items():
+                        if asin in variations:
+                            self.asin_index[asin] = other_id
+                            break
+    
+    def remove_variations(self, parent_id):
+        """Remove all packet variations of a parent"""
+        with self.lock:
+            for asin in list(self.packet_variations.get(parent_id, {})):
+                self.remove_variation(parent_id, asin)
+            self.packet_variations.pop(parent_id, None)
+    
+    def rebuild_transaction_index(self):
+        """Rebuild the transaction ID, date, batch, ASIN and order indexes after transactions change other than by appending"""
+        with self.lock:
+            transaction_index = {}
+            date_index = {}
+            batch_index = {}
+            asin_transactions = {}
+            applied_orders = {}
+            for position, transaction in enumerate(self.transactions):
+                # Older data can hold duplicate IDs; the first one wins, like the old lookup loops
+                transaction_index.setdefault(transaction.get("id"), position)
+                date_index.setdefault(transaction.get("date"), []).append(transaction)
+                if transaction.get("batch_id"):
+                    batch_index.setdefault(transaction["batch_id"], []).append(transaction)
+                if transaction.get("asin"):
+                    asin_transactions.setdefault(transaction["asin"], []).append(transaction)
+                for key in order_keys(transaction):
+                    applied_orders.setdefault(key, transaction)
+            self.transaction_index = transaction_index
+            self.date_index = date_index
+            self.batch_index = batch_index
+            self.asin_transactions = asin_transactions
+            self.applied_orders = applied_orders
+            self.sorted_dates = sorted(d for d in date_index if d)
+            
+            # IDs never go backwards, even when the newest transactions are undone
+            ids = [tid for tid in transaction_index if isinstance(tid, int)]
+            if ids:
+                self.next_transaction_id = max(self.next_transaction_id, max(ids) + 1)
+    
+            self.rebuild_activity_view()
+    
+    def allocate_transaction_id(self):
+        """Hand out the next transaction ID"""
+        with self.lock:
+            transaction_id = self.next_transaction_id
+            self.next_transaction_id += 1
+            return transaction_id
+    
+    def get_transaction(self, transaction_id):
+        """Get a transaction by ID (None if it doesn't exist)"""
+        position = self.transaction_index.get(transaction_id)
+        if position is None:
+            return None
+        return self.transactions[position]
+    
+    def transaction_position(self, transaction_id):
+        """Get a transaction's position in the ledger (None if it doesn't exist)"""
+        return self.transaction_index.get(transaction_id)
+    
+    def index_transaction(self, transaction):
+        """Add a newly appended transaction to the indexes"""
+        self.transaction_index.setdefault(transaction["id"], len(self.transactions) - 1)
+        transaction_date = transaction.get("date")
+        if transaction_date not in self.date_index:
+            self.date_index[transaction_date] = []
+            if transaction_date:
+                bisect.insort(self.sorted_dates, transaction_date)
+        self.date_index[transaction_date].append(transaction)
+        if transaction.get("batch_id"):
+            self.batch_index.setdefault(transaction["batch_id"], []).append(transaction)
+        if transaction.get("asin"):
+            self.asin_transactions.setdefault(transaction["asin"], []).append(transaction)
+        for key in order_keys(transaction):
+            self.applied_orders.setdefault(key, transaction)
+        
+        if transaction_date:
+            view = self.daily_activity.setdefault(transaction_date, {"products": {}})
+            products = view["products"]
+            if transaction["parent_id"] not in products:
+                products[transaction["parent_id"]] = empty_activity_summary(details=False)
+            add_activity(products[transaction["parent_id"]], transaction)
+            view["signature"] = self.activity_signature(transaction_date)
+    
+    def activity_signature(self, transaction_date):
+        """Transaction count and last ID of a day, used to tell whether its activity view is current"""
+        transactions = self.date_index.get(transaction_date, [])
+        return [len(transactions), transactions[-1].get("id") if transactions else None]
+    
+    def refresh_activity(self, transaction_date):
+        """Recompute one day of the activity view from its transactions"""
+        transactions = self.date_index.get(transaction_date)
+        if not transactions:
+            self.daily_activity.pop(transaction_date, None)
+            return
+        self.daily_activity[transaction_date] = {
+            "signature": self.activity_signature(transaction_date),
+            "products": calculate_activity_summaries(transactions, details=False)
+        }
+    
+    def rebuild_activity_view(self):
+        """Recompute the days of the activity view that no longer match the ledger"""
+        with self.lock:
+            for transaction_date in list(self.daily_activity):
+                if transaction_date not in self.date_index:
+                    del self.daily_activity[transaction_date]
+            for transaction_date in self.date_index:
+                if not transaction_date:
+                    continue
+                view = self.daily_activity.get(transaction_date) or {}
+                if view.get("signature") != self.activity_signature(transaction_date):
+                    self.refresh_activity(transaction_date)
+    
+    def activity_on(self, transaction_date):
+        """Copy of the activity totals of every product with transactions on an ISO date (parent_id -> summary), taken under the lock"""
+        with self.lock:
+            return copy.deepcopy(self.daily_activity.get(str(transaction_date), {}).get("products", {}))
+    
+    def transactions_on(self, transaction_date):
+        """Get the transactions dated on an ISO date, in ledger order"""
+        with self.lock:
+            return list(self.date_index.get(str(transaction_date), []))
+    
+    def transactions_since(self, start_date):
+        """Get the transactions dated on or after an ISO date, oldest date first"""
+        with self.lock:
+            start = bisect.bisect_left(self.sorted_dates, str(start_date))
+            return [t for d in self.sorted_dates[start:] for t in self.date_index[d]]
+    
+    def order_applied(self, channel, order_id, asin):
+        """Whether an order line has already been recorded as a sale on a channel"""
+        return (channel, order_id, asin) in self.applied_orders
+    
+    def get_batch(self, batch_id):
+        """Get a batch's transactions in ledger order (empty if the batch doesn't exist)"""
+        return list(self.batch_index.get(batch_id, []))
+    
+    def last_transaction_for_asin(self, asin):
+        """Get the most recently recorded transaction touching an ASIN (None if there is none)"""
+        transactions = self.asin_transactions.get(asin)
+        return transactions[-1] if transactions else None
+    
+    def remove_batch(self, batch_id):
+        """Remove a batch's transactions and return them, reindexing only what was recorded after the batch"""
+        with self.lock:
+            batch = list(self.batch_index.get(batch_id, []))
+            if not batch or not self.unlink_transactions(batch):
+                # Older data with duplicate IDs can't be located by ID, so take the slow path
+                return self.remove_transactions(lambda t: t.get("batch_id") == batch_id)
+            return batch
+            
+    def remove_transaction(self, transaction):
+        """Remove one transaction, reindexing only what was recorded after it"""
+        with self.lock:
+            if not self.unlink_transactions([transaction]):
+                self.remove_transactions(lambda t: t is transaction)
+            
+    def unlink_transactions(self, removed):
+        """Take transactions out of the ledger and its indexes by position (False if they can't be located by ID)"""
+        positions = [self.transaction_index.get(t.get("id")) for t in removed]
+        if any(p is None or self.transactions[p] is not t for p, t in zip(positions, removed)):
+            return False
+            
+        first = min(positions)
+        removed_ids = set(id(t) for t in removed)
+        tail = [t for t in self.transactions[first:] if id(t) not in removed_ids]
+        del self.transactions[first:]
+        self.transactions.extend(tail)
+        
+        # Newest first, so each one is found at the end of its buckets
+        for transaction in reversed(removed):
+            del self.transaction_index[transaction["id"]]
+            if remove_from_bucket(self.date_index, transaction.get("date"), transaction) and transaction.get("date"):
+                self.sorted_dates.remove(transaction["date"])
+            if transaction.get("batch_id"):
+                remove_from_bucket(self.batch_index, transaction["batch_id"], transaction)
+            remove_from_bucket(self.asin_transactions, transaction.get("asin"), transaction)
+            for key in order_keys(transaction):
+                if self.applied_orders.get(key) is transaction:
+                    del self.applied_orders[key]
+        for transaction_date in set(t.get("date") for t in removed):
+            if transaction_date:
+                self.refresh_activity(transaction_date)
+        
+        # Only transactions after the first removed one moved
+        moved = set()
+        for position in range(first, len(self.transactions)):
+            transaction_id = self.transactions[position].get("id")
+            current = self.transaction_index.get(transaction_id)
+            if transaction_id not in moved and (current is None or current >= first):
+                self.transaction_index[transaction_id] = position
+                moved.add(transaction_id)
+        return True
+    
+    def remove_transactions(self, predicate):
+        """Remove every transaction matching predicate and return them"""
+        with self.lock:
+            removed = [t for t in self.transactions if predicate(t)]
+            if removed:
+                # Only the days that lost transactions have their activity recomputed
+                self.transactions = [t for t in self.transactions if not predicate(t)]
+                self.rebuild_transaction_index()
+            return removed
+    
+    def replace_transactions(self, transactions):
+        """Replace the whole ledger"""
+        with self.lock:
+            self.transactions = transactions
+            self.daily_activity = {}
+            self.rebuild_transaction_index()
+    
+    def to_dict(self):
+        """All persisted data as one dict"""
+        data = {key: getattr(self, key) for key in DATA_KEYS}
+        data["next_transaction_id"] = self.next_transaction_id
+        data["daily_activity"] = self.daily_activity
+        data["last_updated"] = datetime.datetime.now().isoformat()
+        return data
+    
+    def save(self):
+        """Write a full snapshot to the store"""
+        # The timer is entered first so it also covers the write that happens once the lock is released
+        with timer("save_data") as fields, self.lock:
+            fields["transactions"] = len(self.transactions)
+            self.version += 1
+            self.pending_writes.snapshot = self.store.stage_snapshot(self.to_dict())
+    
+    def wait_for_store(self):
+        """Wait for the journal entries and snapshot this thread queued to reach the disk (runs with the lock released)"""
+        snapshot = getattr(self.pending_writes, "snapshot", None)
+        seq = getattr(self.pending_writes, "seq", None)
+        self.pending_writes.snapshot = None
+        self.pending_writes.seq = None
+        if snapshot is not None:
+            self.store.sync_snapshot(snapshot)
+        if seq is not None:
+            self.store.sync_journal(seq)
+            self.store.maybe_compact()
+    
+    def record_transaction(self, transaction_type, parent_id, asin=None, quantity=0, weight=0, notes="", batch_id=None, transaction_date=None, orders=None):
+        """Record a transaction and return transaction ID"""
+        with self.lock:
+            transaction_id = self.allocate_transaction_id()
+            
+            # Use provided date or default to today
+            if transaction_date is None:
+                transaction_date = datetime.date.today()
+            
+            transaction = {
+                "id": transaction_id,
+                "timestamp": datetime.datetime.now().isoformat(),
+                "date": transaction_date.isoformat(),
+                "type": transaction_type,
+                "parent_id": parent_id,
+                "parent_name": self.parent_items[parent_id]["name"],
+                "asin": asin,
+                "quantity": quantity,
+                "weight": weight,
+                "notes": notes
+            }
+            
+            # Add batch information if provided
+            if batch_id:
+                transaction["batch_id"] = batch_id
+            
+            # Keep the order lines an aggregated sale was built from
+            if orders:
+                transaction["orders"] = orders
+            
+            self.transactions.append(transaction)
+            self.index_transaction(transaction)
+            self.version += 1
+            
+            if self.batch_transactions is not None:
+                # Written when the batch commits
+                self.batch_transactions.append(transaction)
+                self.batch_parents.add(parent_id)
+            elif DEFAULT_SETTINGS.get("journal_mode", True):
+                # Append the transaction and the parent's new stock levels instead of rewriting the whole file
+                journal_entry = {"op": "transaction", "transaction": transaction, "stock": {}}
+                if parent_id in self.stock_data:
+                    journal_entry["stock"][parent_id] = self.stock_data[parent_id]
+                self.pending_writes.seq = self.store.enqueue(journal_entry)
+            else:
+                self.save()
+            if self.batch_transactions is None:
+                count("transactions_recorded")
+            return transaction_id
+    
+    def record_undo(self, removed, parent_ids):
+        """Write an undo: the removed transaction IDs and the restored stock of each parent in one journal entry"""
+        with self.lock:
+            self.version += 1
+            if DEFAULT_SETTINGS.get("journal_mode", True):
+                journal_entry = {
+                    "op": "undo",
+                    "transaction_ids": [t.get("id") for t in removed],
+                    "next_transaction_id": self.next_transaction_id,
+                    "stock": {}
+                }
+                for parent_id in parent_ids:
+                    if parent_id in self.stock_data:
+                        journal_entry["stock"][parent_id] = self.stock_data[parent_id]
+                self.pending_writes.seq = self.store.enqueue(journal_entry)
+            else:
+                self.save()
+    
+    @contextmanager
+    def batch(self):
+        """Stage stock changes and transactions and commit them with a single write, rolling everything back on error"""
+        with self.lock:
+            if self.batch_transactions is not None:
+                # Nested batches are part of the outer one
+                yield
+                return
+            
+            stock_backup = copy.deepcopy(self.stock_data)
+            transaction_count = len(self.transactions)
+            self.batch_transactions = []
+            self.batch_parents = set()
+            try:
+                yield
+                
+                if self.batch_transactions:
+                    if DEFAULT_SETTINGS.get("journal_mode", True):
+                        # One journal line for the whole batch, so a crash can never leave half of it applied
+                        journal_entry = {"op": "batch", "transactions": self.batch_transactions, "stock": {}}
+                        for parent_id in self.batch_parents:
+                            if parent_id in self.stock_data:
+                                journal_entry["stock"][parent_id] = self.stock_data[parent_id]
+                        self.pending_writes.seq = self.store.enqueue(journal_entry)
+                    else:
+                        self.save()
+                    count("transactions_recorded", len(self.batch_transactions))
+            except BaseException:
+                self.stock_data = stock_backup
+                del self.transactions[transaction_count:]
+                self.rebuild_transaction_index()
+                raise
+            finally:
+                self.batch_transactions = None
+                self.batch_parents = None
@@ -0,0 +1,345 @@
+"""
+Stock operations for the Stock Tracker application
+
+InventoryEngine is the one place stock levels are changed: stock inward,
+packing, sales, returns, manual adjustments and undo, each checked and
+recorded against a SharedInventory and whatever store it was loaded from
+(JSON journal or SQLite). It has no Streamlit dependency, so the pages in
+app.py, the background job worker, scripts and benchmarks all drive the same
+code. Operations that can't be applied raise InventoryError with a message
+meant for the user.
+"""
+
+import datetime
+from config import DEFAULT_SETTINGS
+from inventory import SharedInventory
+from metrics import count
+
+# Allowance for float rounding when comparing weights
+WEIGHT_TOLERANCE = 1e-9
+
+class InventoryError(Exception):
+    """A stock operation that can't be applied; the message is meant for the user"""
+
+def recorded_within(transactions, hours):
+    """Whether the most recent of some transactions was recorded within the last `hours` hours"""
+    latest_timestamp = max(t.get("timestamp") for t in transactions)
+    recorded_time = datetime.datetime.fromisoformat(latest_timestamp)
+    return (datetime.datetime.now() - recorded_time).total_seconds() <= hours * 60 * 60
+
+class InventoryEngine:
+    """Checked stock operations over a shared inventory, usable without Streamlit"""
+    
+    def __init__(self, inventory):
+        self.inventory = inventory
+    
+    @classmethod
+    def open(cls, store, initializer=None):
+        """Load an inventory from a store into a new engine (seeding an empty store with initializer)"""
+        inventory = SharedInventory(store)
+        inventory.load(initializer or (lambda inv: None))
+        return cls(inventory)
+    
+    def batch(self):
+        """Stage operations and commit them with a single write, rolling everything back on error"""
+        return self.inventory.batch()
+    
+    def save(self):
+        """Write a full snapshot to the store"""
+        self.inventory.save()
+    
+    def loose_stock(self, parent_id):
+        """Loose stock of a parent in kg"""
+        return self.inventory.stock_data.get(parent_id, {}).get("loose_stock", 0)
+    
+    def packed_stock(self, parent_id, asin):
+        """Packed units of a packet variation"""
+        return self.inventory.stock_data.get(parent_id, {}).get("packed_stock", {}).get(asin, 0)
+    
+    def stock_for(self, parent_id):
+        """A parent's stock record, created empty if it doesn't have one yet"""
+        stock = self.inventory.stock_data.setdefault(parent_id, {"loose_stock": 0, "packed_stock": {}})
+        stock.setdefault("loose_stock", 0)
+        stock.setdefault("packed_stock", {})
+        return stock
+    
+    def variation(self, parent_id, asin):
+        """A packet variation's details (InventoryError if it isn't in the catalog)"""
+        details = self.inventory.packet_variations.get(parent_id, {}).get(asin)
+        if details is None:
+            raise InventoryError(f"ASIN {asin} not found in your product catalog")
+        return details
+    
+    def stock_inward(self, parent_id, weight, notes="", transaction_date=None):
+        """Add loose stock and return the transaction ID"""
+        with self.inventory.lock:
+            if parent_id not in self.inventory.parent_items:
+                raise InventoryError(f"Parent product {parent_id} not found")
+            if weight <= 0:
+                raise InventoryError("Weight must be greater than 0")
+            
+            stock = self.stock_for(parent_id)
+            stock["loose_stock"] += weight
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            return self.inventory.record_transaction("Stock Inward", parent_id, weight=weight, notes=notes, transaction_date=transaction_date)
+    
+    def pack(self, parent_id, asin, packets, notes="", transaction_date=None):
+        """Pack loose stock into packets of a variation and return the transaction ID"""
+        with self.inventory.lock:
+            packet_weight = self.variation(parent_id, asin)["weight"]
+            if packets <= 0:
+                raise InventoryError("Number of packets must be greater than 0")
+            
+            stock = self.stock_for(parent_id)
+            weight_used = packets * packet_weight
+            if stock["loose_stock"] + WEIGHT_TOLERANCE < weight_used:
+                raise InventoryError(f"Not enough loose stock (Available: {stock['loose_stock']} kg, Needed: {weight_used} kg)")
+            
+            stock["loose_stock"] -= weight_used
+            stock["packed_stock"][asin] = stock["packed_stock"].get(asin, 0) + packets
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            return self.inventory.record_transaction("Packing", parent_id, asin, packets, weight_used, notes, transaction_date=transaction_date)
+    
+    def sell(self, parent_id, asin, quantity, transaction_type="FBA Sale", notes="", batch_id=None, transaction_date=None, orders=None):
+        """Take sold packets out of packed stock and return the transaction ID"""
+        with self.inventory.lock:
+            packet_weight = self.variation(parent_id, asin)["weight"]
+            if quantity <= 0:
+                raise InventoryError(f"Invalid quantity: {quantity}")
+            
+            stock = self.stock_for(parent_id)
+            available = stock["packed_stock"].get(asin, 0)
+            if available < quantity:
+                raise InventoryError(f"Insufficient stock (Available: {available}, Requested: {quantity})")
+            
+            stock["packed_stock"][asin] = available - quantity
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            return self.inventory.record_transaction(
+                transaction_type, parent_id, asin, quantity, quantity * packet_weight, notes, batch_id, transaction_date, orders
+            )
+    
+    def set_loose_stock(self, parent_id, new_stock, notes, transaction_type="LOOSE_STOCK_ADJUSTMENT"):
+        """Set a parent's loose stock, recording the difference (notes(old, new) describes the change)"""
+        with self.inventory.lock:
+            if parent_id not in self.inventory.parent_items:
+                raise InventoryError(f"Parent product {parent_id} not found")
+            if new_stock < 0:
+                raise InventoryError(f"Invalid stock value - {new_stock}")
+            
+            stock = self.stock_for(parent_id)
+            old_stock = stock["loose_stock"]
+            stock["loose_stock"] = new_stock
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            return self.inventory.record_transaction(transaction_type, parent_id, weight=new_stock - old_stock, notes=notes(old_stock, new_stock))
+    
+    def set_packed_stock(self, parent_id, asin, new_units, notes, transaction_type="STOCK_ADJUSTMENT"):
+        """Set a variation's packed units, recording the difference (notes(old, new) describes the change)"""
+        with self.inventory.lock:
+            self.variation(parent_id, asin)
+            if new_units < 0:
+                raise InventoryError(f"Invalid stock value - {new_units}")
+            
+            stock = self.stock_for(parent_id)
+            old_units = stock["packed_stock"].get(asin, 0)
+            stock["packed_stock"][asin] = new_units
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            return self.inventory.record_transaction(transaction_type, parent_id, asin, quantity=new_units - old_units, notes=notes(old_units, new_units))
+    
+    def record_return(self, parent_id, quantity, condition, source, reason, unit, product_name, asin=None):
+        """Book returned loose stock (asin=None) or packets as good or bad returns and return the return transaction"""
+        with self.inventory.lock:
+            if quantity <= 0:
+                raise InventoryError("Please enter a valid return quantity.")
+            if not reason.strip():
+                raise InventoryError("Please provide a reason for the return.")
+            
+            returns = self.inventory.return_data.setdefault(parent_id, {"loose_return": {"good": 0, "bad": 0}, "packed_return": {}})
+            condition_key = condition.lower()
+            now = datetime.datetime.now()
+            return_transaction = {
+                "id": f"RET-{now.strftime('%Y%m%d_%H%M%S')}",
+                "timestamp": now.isoformat(),
+                "type": "RETURN_PACKED" if asin else "RETURN_LOOSE",
+                "parent_id": parent_id
+            }
+            if asin:
+                returns["packed_return"].setdefault(asin, {"good": 0, "bad": 0})[condition_key] += quantity
+                return_transaction["asin"] = asin
+            else:
+                returns["loose_return"][condition_key] += quantity
+            return_transaction.update({
+                "quantity": quantity,
+                "unit": unit,
+                "source": source,
+                "condition": condition,
+                "reason": reason,
+                "product_name": product_name
+            })
+            
+            self.inventory.return_transactions.append(return_transaction)
+            self.inventory.save()
+            return return_transaction
+    
+    def transfer_good_return(self, parent_id, asin=None, notes=""):
+        """Move a parent's good loose returns (asin=None) or a variation's good packed returns into main stock"""
+        with self.inventory.lock:
+            returns = self.inventory.return_data.get(parent_id, {})
+            good = (returns.get("packed_return", {}).get(asin) if asin else returns.get("loose_return")) or {}
+            quantity = good.get("good", 0)
+            if quantity <= 0:
+                raise InventoryError("No good returns to transfer")
+            
+            stock = self.stock_for(parent_id)
+            good["good"] = 0
+            if asin:
+                stock["packed_stock"][asin] = stock["packed_stock"].get(asin, 0) + quantity
+                transaction_id = self.inventory.record_transaction("RETURN_TRANSFER_PACKED", parent_id, asin, quantity=quantity, notes=notes)
+            else:
+                stock["loose_stock"] += quantity
+                transaction_id = self.inventory.record_transaction("RETURN_TRANSFER_LOOSE", parent_id, weight=quantity, notes=notes)
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            # Return counts aren't journaled with the transaction, so write them out
+            self.inventory.save()
+            return transaction_id
+    
+    def can_undo_transaction(self, transaction_id):
+        """Check if a transaction can be undone (based on recording time, not transaction date)"""
+        if not self.inventory.transactions:
+            return False, "No transactions found"
+        
+        transaction = self.inventory.get_transaction(transaction_id)
+        if not transaction:
+            return False, "Transaction not found"
+        
+        undo_window_hours = DEFAULT_SETTINGS.get("undo_window_hours", 24)
+        max_recent_transactions = DEFAULT_SETTINGS.get("max_recent_transactions", 50)
+        
+        # Use timestamp (when recorded) not date (transaction date)
+        try:
+            if not recorded_within([transaction], undo_window_hours):
+                return False, f"Can only undo transactions recorded within last {undo_window_hours} hours"
+        except (TypeError, ValueError):
+            # Fallback to old logic if timestamp parsing fails
+            if transaction.get("date") != datetime.date.today().isoformat():
+                return False, "Can only undo transactions from today"
+        
+        # Check if it's one of the recent transactions (safety limit)
+        if self.inventory.transaction_position(transaction_id) < len(self.inventory.transactions) - max_recent_transactions:
+            return False, f"Can only undo recent transactions (last {max_recent_transactions})"
+        
+        return True, "OK"
+    
+    def undo_transaction(self, transaction_id):
+        """Reverse a transaction's stock effects, remove it and return it"""
+        with self.inventory.lock:
+            transaction = self.inventory.get_transaction(transaction_id)
+            if not transaction:
+                raise InventoryError("Transaction not found!")
+            
+            can_undo, reason = self.can_undo_transaction(transaction_id)
+            if not can_undo:
+                raise InventoryError(f"Cannot undo: {reason}")
+            
+            parent_id = transaction["parent_id"]
+            trans_type = transaction["type"]
+            quantity = transaction.get("quantity", 0)
+            weight = transaction.get("weight", 0)
+            asin = transaction.get("asin")
+            
+            if parent_id not in self.inventory.stock_data:
+                raise InventoryError("Parent product not found!")
+            stock = self.inventory.stock_data[parent_id]
+            
+            # Reverse based on transaction type
+            if trans_type == "Stock Inward":
+                if stock["loose_stock"] < weight:
+                    raise InventoryError(f"Cannot undo: Would result in negative stock (Current: {stock['loose_stock']} kg, Trying to remove: {weight} kg)")
+                stock["loose_stock"] -= weight
+            
+            elif trans_type == "Packing":
+                packed = stock.get("packed_stock", {})
+                if asin and asin in packed and packed[asin] < quantity:
+                    raise InventoryError(f"Cannot undo: Would result in negative packed stock (Current: {packed[asin]}, Trying to remove: {quantity})")
+                # Add back loose stock, remove packed units
+                stock["loose_stock"] += weight
+                if asin and asin in packed:
+                    packed[asin] -= quantity
+            
+            elif "Sale" in trans_type:
+                # Add back packed stock
+                packed = stock.get("packed_stock", {})
+                if asin and asin in packed:
+                    packed[asin] += quantity
+            
+            self.inventory.remove_transaction(transaction)
+            stock["last_updated"] = datetime.datetime.now().isoformat()
+            self.inventory.record_undo([transaction], [parent_id])
+            count("undo_transaction")
+            return transaction
+    
+    def can_undo_batch(self, batch_id):
+        """Check if an entire batch can be undone (based on recording time)"""
+        batch_transactions = self.inventory.get_batch(batch_id)
+        if not batch_transactions:
+            return False, "Batch not found"
+        
+        undo_window_hours = DEFAULT_SETTINGS.get("undo_window_hours", 24)
+        try:
+            if not recorded_within(batch_transactions, undo_window_hours):
+                return False, f"Can only undo batches recorded within last {undo_window_hours} hours"
+        except (TypeError, ValueError):
+            # Fallback to old logic if timestamp parsing fails
+            today = datetime.date.today().isoformat()
+            if any(t.get("date") != today for t in batch_transactions):
+                return False, "Can only undo batches from today"
+        
+        # The batch is only undoable if it is still the last thing recorded on each of its ASINs
+        for asin in set(t.get("asin") for t in batch_transactions if t.get("asin")):
+            last_transaction = self.inventory.last_transaction_for_asin(asin)
+            if last_transaction is not None and last_transaction.get("batch_id") != batch_id:
+                return False, f"Cannot undo: Activity found after batch on ASIN {asin}"
+        
+        return True, "OK"
+    
+    def undo_batch(self, batch_id):
+        """Reverse a whole batch's stock effects, remove its transactions and return them"""
+        with self.inventory.lock:
+            can_undo, reason = self.can_undo_batch(batch_id)
+            if not can_undo:
+                raise InventoryError(f"Cannot undo batch: {reason}")
+            
+            batch_transactions = self.inventory.get_batch(batch_id)
+            
+            # Net change per parent, so each stock record is touched once
+            stock_adjustments = {}
+            for transaction in batch_transactions:
+                adjustments = stock_adjustments.setdefault(transaction["parent_id"], {"loose": 0, "packed": {}})
+                asin = transaction.get("asin")
+                quantity = transaction.get("quantity", 0)
+                trans_type = transaction["type"]
+                
+                if "Sale" in trans_type:
+                    # For all types of sales (FBA Sale, Easy Ship Sale, etc.), add stock back
+                    if asin:
+                        adjustments["packed"][asin] = adjustments["packed"].get(asin, 0) + quantity
+                elif trans_type == "Stock Inward":
+                    adjustments["loose"] -= transaction.get("weight", 0)
+                elif trans_type == "Packing":
+                    # Add back loose stock and remove packed units
+                    adjustments["loose"] += transaction.get("weight", 0)
+                    if asin:
+                        adjustments["packed"][asin] = adjustments["packed"].get(asin, 0) - quantity
+            
+            for parent_id, adjustments in stock_adjustments.items():
+                if parent_id not in self.inventory.stock_data:
+                    continue
+                stock = self.stock_for(parent_id)
+                stock["loose_stock"] += adjustments["loose"]
+                for asin, quantity in adjustments["packed"].items():
+                    stock["packed_stock"][asin] = stock["packed_stock"].get(asin, 0) + quantity
+                stock["last_updated"] = datetime.datetime.now().isoformat()
+            
+            removed = self.inventory.remove_batch(batch_id)
+            self.inventory.record_undo(removed, stock_adjustments)
+            count("undo_batch")
+            return removed
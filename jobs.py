@@ -0,0 +1,181 @@
+"""
+Background jobs for the Stock Tracker application
+
+Bulk uploads are handed to a worker thread instead of running in the
+Streamlit script thread, so the page stays responsive and a browser refresh
+can't stop a job halfway. Every job has a row in a SQLite job table holding
+its status, progress message and, once finished, its result and batch ID, so
+pages can poll it and results can be reviewed later.
+
+A queued job keeps its upload in the table and is picked up again after a
+restart. A job that was running when the process stopped is marked
+interrupted. Sales are committed as one batch, so an interrupted sales job
+left no changes. Stock updates commit every bulk_commit_rows rows and product
+uploads may be saved part way by other sessions, so an interrupted one can
+have applied its first rows; both set values rather than add to them, so the
+upload can simply be run again.
+"""
+
+import datetime
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+import pandas as pd
+from utils import ProgressThrottle
+
+# One runner per job database, shared by every session in the process
+_runners = {}
+_runners_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL,
+    message TEXT,
+    batch_id TEXT,
+    payload TEXT,
+    result TEXT,
+    error TEXT,
+    created TEXT,
+    started TEXT,
+    finished TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created);
+"""
+
+# Statuses a job no longer changes from
+FINISHED_STATUSES = ["done", "failed", "interrupted"]
+
+JOB_COLUMNS = ["id", "kind", "status", "progress", "message", "batch_id", "result", "error", "created", "started", "finished"]
+
+def get_job_runner(db_file, inventory, handlers):
+    """Get the shared job runner for a job database, starting its worker on first use"""
+    key = os.path.abspath(db_file)
+    with _runners_lock:
+        if key not in _runners:
+            _runners[key] = JobRunner(db_file, inventory, handlers)
+        return _runners[key]
+
+def now():
+    """Current time as stored in the job table"""
+    return datetime.datetime.now().isoformat()
+
+class JobRunner:
+    """Runs bulk jobs one at a time on a worker thread, recording them in a SQLite job table"""
+    
+    def __init__(self, db_file, inventory, handlers):
+        self.inventory = inventory
+        # Job kind -> handler(inventory, df, progress=..., [batch_id=...]) returning a JSON-serialisable result
+        self.handlers = handlers
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        
+        # Live progress of the running job, kept in memory so progress updates don't each write the table
+        self.live = {}
+        self.queue = queue.Queue()
+        
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'interrupted', error = ?, finished = ? WHERE status = 'running'",
+                ("Stopped by an application restart before finishing", now())
+            )
+            pending = [row[0] for row in self.conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created")]
+        for job_id in pending:
+            self.queue.put(job_id)
+        
+        self.worker = threading.Thread(target=self.run, name="stock-tracker-jobs", daemon=True)
+        self.worker.start()
+    
+    def submit(self, kind, df, batch_id=None):
+        """Queue a job for an uploaded DataFrame and return its job ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, status, progress, message, batch_id, payload, created) VALUES (?, ?, 'queued', 0, 'Waiting to start', ?, ?, ?)",
+                (job_id, kind, batch_id, df.to_json(orient="split", date_format="iso"), now())
+            )
+        self.queue.put(job_id)
+        return job_id
+    
+    def get(self, job_id):
+        """Get a job's status record (None if there is no such job)"""
+        with self.lock:
+            row = self.conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            live = self.live.get(job_id)
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if live and job["status"] == "running":
+            job["progress"], job["message"] = live
+        return job
+    
+    def recent(self, limit=20):
+        """Most recent jobs first, without their results"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, status, progress, message, batch_id, error, created, finished FROM jobs ORDER BY created DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(zip(["id", "kind", "status", "progress", "message", "batch_id", "error", "created", "finished"], row)) for row in rows]
+    
+    def update(self, job_id, **fields):
+        """Write fields of a job's row"""
+        with self.lock, self.conn:
+            assignments = ", ".join(f"{column} = ?" for column in fields)
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    
+    def run(self):
+        """Worker loop: run queued jobs in submission order"""
+        while True:
+            job_id = self.queue.get()
+            try:
+                self.run_job(job_id)
+            finally:
+                self.queue.task_done()
+    
+    def run_job(self, job_id):
+        """Run one job and record its result or error"""
+        with self.lock:
+            row = self.conn.execute("SELECT kind, batch_id, payload, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[3] != "queued":
+            return
+        kind, batch_id, payload, _ = row
+        
+        def show_progress(fraction, message):
+            self.live[job_id] = (fraction, message)
+        progress = ProgressThrottle(show_progress)
+        
+        self.update(job_id, status="running", started=now(), message="Starting")
+        try:
+            df = pd.read_json(io.StringIO(payload), orient="split", dtype=False)
+            options = {"batch_id": batch_id} if batch_id else {}
+            result = self.handlers[kind](self.inventory, df, progress=progress, **options)
+        except Exception as e:
+            self.update(job_id, status="failed", error=str(e), message="Failed", finished=now(), payload=None)
+        else:
+            self.update(
+                job_id, status="done", progress=1.0, message="Finished", finished=now(), payload=None,
+                result=json.dumps(result, default=str)
+            )
+        finally:
+            self.live.pop(job_id, None)
+    
+    def wait(self):
+        """Block until every queued job has run"""
+        self.queue.join()
+    
+    def close(self):
+        """Close the job database connection"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,157 @@
+"""
+Instrumentation for the Stock Tracker application
+
+Timers around page renders, saving and loading the inventory and the bulk
+processors, plus counters for rows processed and bytes written. Every timing
+goes into a rolling in-memory ring buffer (shown in the admin panel) and, once
+the app has pointed the recorder at a file, a JSON-lines metrics log. Timings
+are also added to cumulative histograms and counters only ever grow, so the
+exporter in metrics_exporter.py can publish them.
+
+Library modules time their work through the shared `recorder`, so the same
+measurements are taken whether the code runs under Streamlit, on the job
+worker or from a script; nothing is written to disk unless log_to() is called.
+"""
+
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import threading
+import time
+from config import DEFAULT_SETTINGS
+
+# Upper bounds in seconds of the latency histogram buckets
+HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class MetricsRecorder:
+    """Ring buffer of timings and running counters, optionally mirrored to a JSON-lines log"""
+    
+    def __init__(self, capacity=1000, log_file=None):
+        self.lock = threading.Lock()
+        self.events = collections.deque(maxlen=capacity)
+        self.counters = {}
+        # Timer name -> {"buckets": [count per HISTOGRAM_BUCKETS bound], "sum": seconds, "count": calls}
+        self.histograms = {}
+        self.log_file = log_file
+        self.log_handle = None
+    
+    def log_to(self, log_file):
+        """Append every timing to log_file from now on (None stops logging)"""
+        with self.lock:
+            if self.log_handle is not None:
+                self.log_handle.close()
+                self.log_handle = None
+            self.log_file = log_file
+    
+    def record(self, name, seconds, **fields):
+        """Add one timing to the buffer and the log"""
+        event = {"time": datetime.datetime.now().isoformat(), "name": name, "seconds": round(seconds, 6), **fields}
+        with self.lock:
+            self.events.append(event)
+            histogram = self.histograms.setdefault(name, {"buckets": [0] * len(HISTOGRAM_BUCKETS), "sum": 0.0, "count": 0})
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            if self.log_file:
+                try:
+                    if self.log_handle is None:
+                        self.log_handle = open(self.log_file, 'a')
+                    self.log_handle.write(json.dumps(event, default=str) + "\n")
+                    self.log_handle.flush()
+                except OSError:
+                    # Metrics must never break the operation being measured
+                    self.log_file = None
+        return event
+    
+    @contextlib.contextmanager
+    def timer(self, name, **fields):
+        """Time a block; the block may add fields (e.g. rows) to the dict it is given"""
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, **fields)
+    
+    def timed(self, name):
+        """Decorator timing every call of a function"""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+    
+    def count(self, name, amount=1):
+        """Add to a running counter (rows processed, bytes written, ...)"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def recent(self, limit=None):
+        """Buffered timings, newest first"""
+        with self.lock:
+            events = list(self.events)
+        events.reverse()
+        return events[:limit] if limit else events
+    
+    def summary(self):
+        """Per-name call count, total, mean, p95 and max seconds over the buffer, slowest total first"""
+        durations = {}
+        for event in self.recent():
+            durations.setdefault(event["name"], []).append(event["seconds"])
+        rows = [{
+            "name": name,
+            "calls": len(values),
+            "total_seconds": sum(values),
+            "mean_seconds": sum(values) / len(values),
+            "p95_seconds": percentile(values, 0.95),
+            "max_seconds": max(values)
+        } for name, values in durations.items()]
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+    
+    def counter_values(self):
+        """Copy of the running counters"""
+        with self.lock:
+            return dict(self.counters)
+    
+    def histogram_values(self):
+        """Copy of the latency histograms, with cumulative bucket counts as Prometheus expects"""
+        with self.lock:
+            histograms = {name: dict(h, buckets=list(h["buckets"])) for name, h in self.histograms.items()}
+        for histogram in histograms.values():
+            for i in range(1, len(histogram["buckets"])):
+                histogram["buckets"][i] += histogram["buckets"][i - 1]
+        return histograms
+    
+    def clear(self):
+        """Drop the buffered timings (counters and histograms keep growing for the exporter, and the log is kept)"""
+        with self.lock:
+            self.events.clear()
+
+# Shared by every module in the process
+recorder = MetricsRecorder(DEFAULT_SETTINGS.get("metrics_buffer_size", 1000))
+
+def timer(name, **fields):
+    """Time a block with the shared recorder"""
+    return recorder.timer(name, **fields)
+
+def timed(name):
+    """Decorator timing a function with the shared recorder"""
+    return recorder.timed(name)
+
+def count(name, amount=1):
+    """Add to one of the shared recorder's counters"""
+    recorder.count(name, amount)
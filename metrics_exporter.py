@@ -0,0 +1,206 @@
+"""
+Prometheus metrics for the Stock Tracker application
+
+Publishes what metrics.py measures, plus a few gauges read from the inventory
+itself, in the Prometheus text exposition format: save/load latency
+histograms, per-page render time, bulk durations, rows processed and
+throughput, bytes written, data file sizes, transaction counts, undo counts
+and active sessions.
+
+Two ways to collect them, both off by default in config.py:
+- metrics_http_port: a small HTTP thread serving /metrics on localhost
+- metrics_textfile: a file rewritten every metrics_textfile_interval seconds
+  for node_exporter's textfile collector
+"""
+
+import http.server
+import os
+import threading
+import time
+from metrics import HISTOGRAM_BUCKETS, recorder
+
+# One HTTP server per port and one writer per textfile, shared by every session in the process
+_servers = {}
+_writers = {}
+_registry_lock = threading.Lock()
+
+# Sessions seen within this many seconds count as active
+ACTIVE_SESSION_SECONDS = 10 * 60
+
+# Timer names of the bulk processors (metrics.py) -> job label
+BULK_TIMERS = {
+    "bulk_fba_sales": "fba_sales",
+    "bulk_easy_ship_sales": "easy_ship_sales",
+    "bulk_products_upload": "products_upload",
+    "bulk_stock_updates": "stock_updates"
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def label_value(value):
+    """Escape a label value for the text format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def labels_text(labels):
+    """{name="value",...} or nothing"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{label_value(value)}"' for name, value in labels.items()) + "}"
+
+def number(value):
+    """Sample value as the text format writes it"""
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class SessionTracker:
+    """Last-seen time of each browser session, for the active session gauge"""
+    
+    def __init__(self, window=ACTIVE_SESSION_SECONDS):
+        self.lock = threading.Lock()
+        self.window = window
+        self.last_seen = {}
+    
+    def touch(self, session_id):
+        """Mark a session as seen now"""
+        with self.lock:
+            self.last_seen[session_id] = time.time()
+    
+    def active(self):
+        """Number of sessions seen within the window (older ones are forgotten)"""
+        cutoff = time.time() - self.window
+        with self.lock:
+            self.last_seen = {sid: seen for sid, seen in self.last_seen.items() if seen >= cutoff}
+            return len(self.last_seen)
+
+class MetricsExporter:
+    """Renders the current metrics of one inventory in the Prometheus text format"""
+    
+    def __init__(self, inventory, data_files, sessions=None, metrics=recorder):
+        self.inventory = inventory
+        # Files whose size is published (those that don't exist are skipped)
+        self.data_files = data_files
+        self.sessions = sessions
+        self.metrics = metrics
+    
+    def render(self):
+        """All metrics as one text exposition"""
+        lines = []
+        
+        def family(name, kind, help_text, samples):
+            """One metric family; samples are (suffix, labels, value)"""
+            if not samples:
+                return
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{labels_text(labels)} {number(value)}")
+        
+        def histogram_samples(histogram, labels=None):
+            """Bucket, sum and count samples of one recorded histogram"""
+            labels = labels or {}
+            samples = [("_bucket", dict(labels, le=str(bound)), count) for bound, count in zip(HISTOGRAM_BUCKETS, histogram["buckets"])]
+            samples.append(("_bucket", dict(labels, le="+Inf"), histogram["count"]))
+            samples.append(("_sum", labels, histogram["sum"]))
+            samples.append(("_count", labels, histogram["count"]))
+            return samples
+        
+        histograms = self.metrics.histogram_values()
+        counters = self.metrics.counter_values()
+        
+        for timer, metric, help_text in [
+            ("save_data", "stock_tracker_save_data_seconds", "Time to write a full snapshot of the inventory"),
+            ("load_data", "stock_tracker_load_data_seconds", "Time to load the inventory from its store")
+        ]:
+            if timer in histograms:
+                family(metric, "histogram", help_text, histogram_samples(histograms[timer]))
+        
+        page_samples = []
+        for timer, histogram in sorted(histograms.items()):
+            if timer.startswith("page: "):
+                page_samples.extend(histogram_samples(histogram, {"page": timer[len("page: "):]}))
+        family("stock_tracker_page_render_seconds", "histogram", "Time to render a page", page_samples)
+        
+        bulk_samples = []
+        bulk_seconds = 0.0
+        for timer, job in BULK_TIMERS.items():
+            if timer in histograms:
+                bulk_samples.extend(histogram_samples(histograms[timer], {"job": job}))
+                bulk_seconds += histograms[timer]["sum"]
+        family("stock_tracker_bulk_seconds", "histogram", "Time to process a bulk upload", bulk_samples)
+        
+        rows = counters.get("rows_processed", 0)
+        family("stock_tracker_bulk_rows_processed_total", "counter", "Upload rows processed by the bulk processors", [("", None, rows)])
+        family("stock_tracker_bulk_rows_per_second", "gauge", "Average bulk processing throughput since the process started",
+               [("", None, rows / bulk_seconds if bulk_seconds else 0.0)])
+        family("stock_tracker_bytes_written_total", "counter", "Bytes written to the JSON data file and journal", [("", None, counters.get("bytes_written", 0))])
+        
+        family("stock_tracker_transactions", "gauge", "Transactions in the ledger", [("", None, len(self.inventory.transactions))])
+        family("stock_tracker_transactions_recorded_total", "counter", "Transactions recorded since the process started",
+               [("", None, counters.get("transactions_recorded", 0))])
+        family("stock_tracker_undo_total", "counter", "Undo operations since the process started", [
+            ("", {"kind": "transaction"}, counters.get("undo_transaction", 0)),
+            ("", {"kind": "batch"}, counters.get("undo_batch", 0))
+        ])
+        
+        family("stock_tracker_data_file_bytes", "gauge", "Size of the data files on disk",
+               [("", {"file": os.path.basename(path)}, os.path.getsize(path)) for path in self.data_files if os.path.exists(path)])
+        if self.sessions is not None:
+            family("stock_tracker_active_sessions", "gauge", f"Browser sessions seen in the last {self.sessions.window // 60} minutes",
+                   [("", None, self.sessions.active())])
+        
+        return "\n".join(lines) + "\n"
+    
+    def write_textfile(self, path):
+        """Atomically replace path with the current metrics (for node_exporter's textfile collector)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+def start_http_exporter(exporter, port, host="127.0.0.1"):
+    """Serve exporter at http://host:port/metrics on a daemon thread, once per port"""
+    with _registry_lock:
+        if port in _servers:
+            return _servers[port]
+        
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the console
+                pass
+        
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="stock-tracker-metrics", daemon=True).start()
+        _servers[port] = server
+        return server
+
+def start_textfile_writer(exporter, path, interval=15):
+    """Rewrite path with the current metrics every interval seconds on a daemon thread, once per path"""
+    key = os.path.abspath(path)
+    with _registry_lock:
+        if key in _writers:
+            return _writers[key]
+        
+        def run():
+            while True:
+                try:
+                    exporter.write_textfile(path)
+                except OSError:
+                    # Try again next interval (e.g. the collector directory was being rotated)
+                    pass
+                time.sleep(interval)
+        
+        writer = threading.Thread(target=run, name="stock-tracker-metrics-textfile", daemon=True)
+        writer.start()
+        _writers[key] = writer
+        return writer
@@ -0,0 +1,88 @@
+"""
+On-demand profiling for the Stock Tracker application
+
+Runs a single call (one page render) under cProfile and tracemalloc and keeps
+what they found: a pstats dump and a tracemalloc snapshot to download and open
+with the standard tools, plus short top-N summaries to show inline.
+
+    python -m pstats live_stock_view.pstats
+    tracemalloc.Snapshot.load("live_stock_view.tracemalloc")
+"""
+
+import cProfile
+import io
+import marshal
+import pickle
+import pstats
+import time
+import tracemalloc
+
+# Allocations made by the profilers themselves are left out of the snapshot
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+]
+
+class ProfileCapture:
+    """cProfile statistics and a tracemalloc snapshot from one profiled call"""
+    
+    def __init__(self, name, profiler, snapshot, seconds, peak_bytes):
+        self.name = name
+        self.created = time.strftime("%Y-%m-%d_%H-%M-%S")
+        profiler.create_stats()
+        self.stats = profiler.stats
+        self.snapshot = snapshot.filter_traces(SNAPSHOT_FILTERS)
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+    
+    def file_name(self, extension):
+        """Download name for one of the dumps"""
+        return f"{self.name.lower().replace(' ', '_')}_{self.created}.{extension}"
+    
+    def stats_bytes(self):
+        """The stats in pstats dump format (what Stats.dump_stats writes)"""
+        return marshal.dumps(self.stats)
+    
+    def snapshot_bytes(self):
+        """The snapshot in the format Snapshot.dump writes and Snapshot.load reads"""
+        return pickle.dumps(self.snapshot, pickle.HIGHEST_PROTOCOL)
+    
+    def top_functions(self, limit=25, sort="cumulative"):
+        """pstats report of the top functions as text"""
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream)
+        stats.stats = self.stats
+        stats.get_top_level_stats()
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+    
+    def top_allocations(self, limit=25):
+        """Source lines holding the most memory at the end of the call"""
+        return [{
+            "line": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "blocks": stat.count
+        } for stat in self.snapshot.statistics("lineno")[:limit]]
+
+def profile_call(name, function, *args, **kwargs):
+    """Run function under cProfile and tracemalloc and return (its result, ProfileCapture)"""
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        result = profiler.runcall(function, *args, **kwargs)
+        seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        # Leave tracing on if someone else started it
+        if not was_tracing:
+            tracemalloc.stop()
+    return result, ProfileCapture(name, profiler, snapshot, seconds, peak_bytes)
@@ -8,6 +8,8 @@ import json
 def reset_data():
     """Clear all stored data"""
     data_file = "stock_data.json"
+    journal_file = "stock_data.journal"
+    sqlite_file = "stock_data.db"
     
     if os.path.exists(data_file):
         print("Removing existing data file...")
@@ -16,6 +18,16 @@ def reset_data():
     else:
         print("No data file found - starting fresh!")
     
+    for path in [journal_file, journal_file + ".compacting"]:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Transaction journal removed ({path}).")
+    
+    for path in [sqlite_file, sqlite_file + "-wal", sqlite_file + "-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"SQLite database removed ({path}).")
+    
     print("\nRestart your application to load clean sample data.")
     print("The sample data will now include all ASINs for all parent products.")
 
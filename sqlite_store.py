@@ -0,0 +1,360 @@
+"""
+SQLite storage backend for the Stock Tracker application
+
+Drop-in alternative to the JSON snapshot + journal store. Each record is kept
+as a JSON document alongside a few descriptive columns, so a load gives back
+exactly the dicts the app works with while the database stays readable with
+any SQLite tool. The columns queries filter on (date, batch, ASIN, parent,
+type) are indexed, so ad-hoc queries and external tools reading the database
+don't have to scan every transaction. The app itself serves lookups from the
+in-memory indexes of SharedInventory. A snapshot only writes the rows that
+changed since the last one.
+
+Run this file directly to migrate the existing JSON data:
+
+    python sqlite_store.py [stock_data.json] [stock_data.journal] [stock_data.db]
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from config import DEFAULT_SETTINGS
+from storage import JournalStore
+
+# One store per database file, shared by every session in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS parent_items (
+    parent_id TEXT PRIMARY KEY,
+    name TEXT,
+    category TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variations (
+    parent_id TEXT NOT NULL,
+    asin TEXT NOT NULL,
+    weight REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (parent_id, asin)
+);
+CREATE TABLE IF NOT EXISTS stock (
+    parent_id TEXT PRIMARY KEY,
+    loose_stock REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER,
+    date TEXT,
+    type TEXT,
+    parent_id TEXT,
+    asin TEXT,
+    batch_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS return_stock (
+    parent_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS return_transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    timestamp TEXT,
+    type TEXT,
+    parent_id TEXT,
+    asin TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_id ON transactions (id);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+CREATE INDEX IF NOT EXISTS idx_transactions_batch_id ON transactions (batch_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_asin ON transactions (asin);
+CREATE INDEX IF NOT EXISTS idx_transactions_parent_id ON transactions (parent_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions (type);
+CREATE INDEX IF NOT EXISTS idx_variations_asin ON variations (asin);
+CREATE INDEX IF NOT EXISTS idx_return_transactions_parent_id ON return_transactions (parent_id);
+"""
+
+# Tables holding one row per key: table -> (key columns, other columns, data column last)
+KEYED_TABLES = {
+    "parent_items": (["parent_id"], ["name", "category", "data"]),
+    "variations": (["parent_id", "asin"], ["weight", "data"]),
+    "stock": (["parent_id"], ["loose_stock", "data"]),
+    "return_stock": (["parent_id"], ["data"])
+}
+
+# Append-only tables kept in ledger order by seq: table -> columns, data column last
+LOG_TABLES = {
+    "transactions": ["id", "date", "type", "parent_id", "asin", "batch_id", "data"],
+    "return_transactions": ["id", "timestamp", "type", "parent_id", "asin", "data"]
+}
+
+def get_sqlite_store(db_file):
+    """Get the shared SQLite store for a database file"""
+    key = os.path.abspath(db_file)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SQLiteStore(db_file, fsync=DEFAULT_SETTINGS.get("fsync_writes", True))
+        return _stores[key]
+
+def to_json(value):
+    """Serialize a record for the data column"""
+    return json.dumps(value, separators=(",", ":"))
+
+def transaction_row(transaction):
+    """Indexed columns plus the full document for a transaction"""
+    return (
+        transaction.get("id"),
+        transaction.get("date"),
+        transaction.get("type"),
+        transaction.get("parent_id"),
+        transaction.get("asin"),
+        transaction.get("batch_id"),
+        to_json(transaction)
+    )
+
+def return_transaction_row(transaction):
+    """Indexed columns plus the full document for a return transaction"""
+    return (
+        transaction.get("id"),
+        transaction.get("timestamp"),
+        transaction.get("type"),
+        transaction.get("parent_id"),
+        transaction.get("asin"),
+        to_json(transaction)
+    )
+
+def keyed_rows(data):
+    """Rows of every keyed table for a data dict: table -> {key: row}, in the order a load gives them back"""
+    return {
+        "parent_items": {pid: (pid, info.get("name"), info.get("category"), to_json(info)) for pid, info in data.get("parent_items", {}).items()},
+        "variations": {(pid, asin): (pid, asin, details.get("weight"), to_json(details))
+                       for pid, variations in data.get("packet_variations", {}).items()
+                       for asin, details in variations.items()},
+        "stock": {pid: (pid, stock.get("loose_stock"), to_json(stock)) for pid, stock in data.get("stock_data", {}).items()},
+        "return_stock": {pid: (pid, to_json(returns)) for pid, returns in data.get("return_data", {}).items()}
+    }
+
+class SQLiteStore:
+    """Stock data kept in a SQLite database in WAL mode"""
+    
+    def __init__(self, db_file, fsync=True):
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        # Streamlit runs each rerun on its own thread, so one connection is shared behind the lock
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the write-ahead log on every commit; NORMAL can lose the last commits on power loss
+        self.conn.execute("PRAGMA synchronous=FULL" if fsync else "PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        
+        # Table -> {key or seq: data column} of what is stored, so a snapshot only writes the rows that changed
+        # (None until first needed, and after a failed write)
+        self.written = None
+    
+    def get_meta(self, key, default=None):
+        """Read a JSON value from the meta table"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def set_meta(self, key, value):
+        """Write a JSON value to the meta table"""
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, to_json(value)))
+    
+    def load(self):
+        """Load all data in the same layout as the JSON store (None if the database is empty)"""
+        with self.lock:
+            if not self.get_meta("initialized", False):
+                return None
+            
+            data = {
+                "stock_data": {},
+                "transactions": [],
+                "parent_items": {},
+                "packet_variations": {},
+                "daily_opening_stock": self.get_meta("daily_opening_stock", {}),
+                "daily_activity": self.get_meta("daily_activity", {}),
+                "return_data": {},
+                "return_transactions": [],
+                "last_updated": self.get_meta("last_updated"),
+                "next_transaction_id": self.get_meta("next_transaction_id")
+            }
+            
+            for parent_id, doc in self.conn.execute("SELECT parent_id, data FROM parent_items ORDER BY rowid"):
+                data["parent_items"][parent_id] = json.loads(doc)
+            for parent_id, asin, doc in self.conn.execute("SELECT parent_id, asin, data FROM variations ORDER BY rowid"):
+                data["packet_variations"].setdefault(parent_id, {})[asin] = json.loads(doc)
+            for parent_id, doc in self.conn.execute("SELECT parent_id, data FROM stock ORDER BY rowid"):
+                data["stock_data"][parent_id] = json.loads(doc)
+            for parent_id, doc in self.conn.execute("SELECT parent_id, data FROM return_stock ORDER BY rowid"):
+                data["return_data"][parent_id] = json.loads(doc)
+            
+            data["transactions"] = [json.loads(doc) for (doc,) in self.conn.execute("SELECT data FROM transactions ORDER BY seq")]
+            data["return_transactions"] = [json.loads(doc) for (doc,) in self.conn.execute("SELECT data FROM return_transactions ORDER BY seq")]
+            return data
+    
+    def append(self, entry):
+        """Record a transaction (or a batch of them, or an undo) and the stock levels touched in a single database transaction"""
+        if entry.get("op") == "transaction":
+            transactions = [entry["transaction"]]
+        else:
+            transactions = entry.get("transactions", [])
+        
+        with self.lock, self.conn:
+            try:
+                written = self.written_rows()
+                seq = None
+                for transaction_id in entry.get("transaction_ids", []):
+                    # The lookup by ID finds the first transaction with it
+                    row = self.conn.execute("SELECT MIN(seq) FROM transactions WHERE id = ?", (transaction_id,)).fetchone()
+                    if row[0] is not None:
+                        self.conn.execute("DELETE FROM transactions WHERE seq = ?", (row[0],))
+                        del written["transactions"][row[0]]
+                if entry.get("next_transaction_id"):
+                    self.set_meta("next_transaction_id", max(self.get_meta("next_transaction_id") or 1, entry["next_transaction_id"]))
+                
+                for transaction in transactions:
+                    seq = self.insert_log_row("transactions", transaction_row(transaction))
+                self.upsert("stock", [(parent_id, stock.get("loose_stock"), to_json(stock)) for parent_id, stock in entry.get("stock", {}).items()])
+                return seq
+            except BaseException:
+                # The database transaction rolls back, so what is stored is no longer known
+                self.written = None
+                raise
+    
+    def enqueue(self, entry):
+        """Same as append(); the database transaction is already committed when it returns"""
+        return self.append(entry)
+    
+    def sync_journal(self, seq):
+        """Nothing to wait for, append() commits before returning"""
+    
+    def stage_snapshot(self, data):
+        """Same as write_snapshot(); returns a generation for sync_snapshot()"""
+        self.write_snapshot(data)
+        return 0
+    
+    def sync_snapshot(self, generation):
+        """Nothing to wait for, write_snapshot() commits before returning"""
+    
+    def maybe_compact(self):
+        """SQLite checkpoints its own write-ahead log"""
+        return False
+    
+    def written_rows(self):
+        """What is stored in each table, read from the database the first time"""
+        if self.written is None:
+            written = {}
+            for table, (keys, columns) in KEYED_TABLES.items():
+                written[table] = {}
+                for row in self.conn.execute(f"SELECT {', '.join(keys)}, data FROM {table} ORDER BY rowid"):
+                    written[table][row[0] if len(keys) == 1 else row[:-1]] = row[-1]
+            for table in LOG_TABLES:
+                written[table] = dict(self.conn.execute(f"SELECT seq, data FROM {table} ORDER BY seq"))
+            self.written = written
+        return self.written
+    
+    def upsert(self, table, rows):
+        """Insert or update rows of a keyed table in place, so they keep their position"""
+        keys, columns = KEYED_TABLES[table]
+        placeholders = ", ".join("?" * (len(keys) + len(columns)))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        self.conn.executemany(
+            f"INSERT INTO {table} ({', '.join(keys + columns)}) VALUES ({placeholders}) ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+            rows
+        )
+        written = self.written_rows()[table]
+        for row in rows:
+            written[row[0] if len(keys) == 1 else row[:len(keys)]] = row[-1]
+    
+    def insert_log_row(self, table, row):
+        """Append a row to a log table and return its seq"""
+        columns = LOG_TABLES[table]
+        cursor = self.conn.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", row)
+        self.written_rows()[table][cursor.lastrowid] = row[-1]
+        return cursor.lastrowid
+    
+    def sync_keyed_table(self, table, rows):
+        """Write the changed rows of a keyed table and delete the ones that are gone"""
+        keys, columns = KEYED_TABLES[table]
+        written = self.written_rows()[table]
+        
+        # Loads return rows in insertion order, so that order has to match the dict; otherwise rewrite the table
+        kept = [key for key in written if key in rows]
+        if kept != list(rows)[:len(kept)]:
+            self.conn.execute(f"DELETE FROM {table}")
+            written.clear()
+        
+        gone = [key for key in written if key not in rows]
+        self.conn.executemany(
+            f"DELETE FROM {table} WHERE {' AND '.join(f'{key} = ?' for key in keys)}",
+            [key if len(keys) > 1 else (key,) for key in gone]
+        )
+        for key in gone:
+            del written[key]
+        self.upsert(table, [row for key, row in rows.items() if written.get(key) != row[-1]])
+    
+    def sync_log_table(self, table, rows):
+        """Keep the stored rows that match the start of rows and replace everything after the first difference"""
+        written = self.written_rows()[table]
+        seqs = list(written)
+        stored = list(written.values())
+        same = 0
+        while same < len(stored) and same < len(rows) and stored[same] == rows[same][-1]:
+            same += 1
+        
+        if same < len(seqs):
+            self.conn.execute(f"DELETE FROM {table} WHERE seq >= ?", (seqs[same],))
+            for seq in seqs[same:]:
+                del written[seq]
+        for row in rows[same:]:
+            self.insert_log_row(table, row)
+    
+    def write_snapshot(self, data):
+        """Bring the stored data in line with a full copy of the application state, writing only what changed"""
+        with self.lock, self.conn:
+            try:
+                for table, rows in keyed_rows(data).items():
+                    self.sync_keyed_table(table, rows)
+                self.sync_log_table("transactions", [transaction_row(t) for t in data.get("transactions", [])])
+                self.sync_log_table("return_transactions", [return_transaction_row(t) for t in data.get("return_transactions", [])])
+            
+                self.set_meta("daily_opening_stock", data.get("daily_opening_stock", {}))
+                self.set_meta("daily_activity", data.get("daily_activity", {}))
+                self.set_meta("last_updated", data.get("last_updated"))
+                self.set_meta("next_transaction_id", data.get("next_transaction_id"))
+                self.set_meta("initialized", True)
+            except BaseException:
+                # The database transaction rolls back, so what is stored is no longer known
+                self.written = None
+                raise
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+def migrate_json_to_sqlite(data_file="stock_data.json", journal_file="stock_data.journal", db_file="stock_data.db"):
+    """Copy the JSON snapshot and its journal into a SQLite database"""
+    data = JournalStore(data_file, journal_file).load()
+    if data is None:
+        raise FileNotFoundError(f"No data file found at {data_file}")
+    
+    store = SQLiteStore(db_file, fsync=DEFAULT_SETTINGS.get("fsync_writes", True))
+    try:
+        store.write_snapshot(data)
+    finally:
+        store.close()
+    return len(data.get("transactions", []))
+
+if __name__ == "__main__":
+    count = migrate_json_to_sqlite(*sys.argv[1:4])
+    print(f"Migrated {count} transactions to SQLite.")
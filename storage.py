@@ -0,0 +1,416 @@
+"""
+Persistence layer for the Stock Tracker application
+
+The data file holds a full snapshot of the application state. Changes made
+after the snapshot (new transactions and the stock levels they touched) are
+appended to a journal file, one JSON document per line, and replayed on top
+of the snapshot when the data is loaded.
+
+Once the journal passes a size or entry threshold it is compacted in the
+background: the journal is moved aside as a segment, folded into a fresh
+snapshot, and the segment is deleted. Loading therefore only has to replay
+the short tail written since the last checkpoint.
+
+Snapshots are written to a temp file, fsynced and renamed over the data file,
+so a crash mid-write leaves the previous snapshot intact. Journal appends and
+snapshots use group commit: writers arriving within a few milliseconds of
+each other share a single fsync.
+
+Writing and waiting are separate steps. enqueue() and stage_snapshot() only
+hand the change to the store and return a ticket, so the inventory can call
+them under its lock and wait for sync_journal() / sync_snapshot() after
+letting go of it. append() and write_snapshot() do both in one call.
+"""
+
+import json
+import os
+import shutil
+import threading
+from config import DEFAULT_SETTINGS
+from metrics import count
+
+# One store per data file, shared by every session in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_journal_store(data_file, journal_file):
+    """Get the shared journal store for a data file"""
+    key = (os.path.abspath(data_file), os.path.abspath(journal_file))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = JournalStore(
+                data_file,
+                journal_file,
+                compact_entries=DEFAULT_SETTINGS.get("journal_compact_entries"),
+                compact_bytes=DEFAULT_SETTINGS.get("journal_compact_bytes"),
+                fsync=DEFAULT_SETTINGS.get("fsync_writes", True),
+                group_commit_window=DEFAULT_SETTINGS.get("group_commit_window_ms", 0) / 1000.0
+            )
+        return _stores[key]
+
+def apply_journal_entry(data, entry):
+    """Apply a single journal entry to a loaded data dict"""
+    if entry.get("op") == "transaction":
+        data.setdefault("transactions", []).append(entry["transaction"])
+    elif entry.get("op") == "batch":
+        data.setdefault("transactions", []).extend(entry["transactions"])
+    elif entry.get("op") == "undo":
+        # Drop the first transaction with each undone ID, as the lookup by ID finds it
+        undone = set(entry["transaction_ids"])
+        kept = []
+        for transaction in data.get("transactions", []):
+            if transaction.get("id") in undone:
+                undone.discard(transaction.get("id"))
+            else:
+                kept.append(transaction)
+        data["transactions"] = kept
+        # IDs never go backwards, even when the newest transactions are undone
+        data["next_transaction_id"] = max(data.get("next_transaction_id") or 1, entry.get("next_transaction_id") or 1)
+    
+    # Stock levels are journaled as the full record of each touched parent,
+    # so replaying an entry twice leaves the same result
+    stock_data = data.setdefault("stock_data", {})
+    for parent_id, stock in entry.get("stock", {}).items():
+        stock_data[parent_id] = stock
+
+def read_journal(path):
+    """Read all complete entries from a journal file"""
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A crash mid-append leaves a partial line behind
+                continue
+    return entries
+
+def truncate_torn_tail(path):
+    """Cut off a partial last line so the next append starts on a fresh line"""
+    if not os.path.exists(path):
+        return
+    
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+def fsync_directory(path):
+    """Make a rename inside a directory durable (not supported on Windows)"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_temp_text(tmp_path, content, fsync=True):
+    """Write already serialized content to a temp file, flushed to disk"""
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+            count("bytes_written", f.tell())
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def write_temp_json(tmp_path, data, fsync=True):
+    """Write compact JSON to a temp file, flushed to disk"""
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+            count("bytes_written", f.tell())
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def replace_file(tmp_path, path, fsync=True):
+    """Atomically move a written temp file over the target"""
+    os.replace(tmp_path, path)
+    if fsync:
+        fsync_directory(path)
+
+def write_json_file(path, data, tmp_path=None, fsync=True):
+    """Write compact JSON to a temp file and atomically move it over the target"""
+    tmp_path = tmp_path or path + ".tmp"
+    write_temp_json(tmp_path, data, fsync)
+    replace_file(tmp_path, path, fsync)
+
+class JournalStore:
+    """Snapshot file plus an append-only journal of the changes made since"""
+    
+    def __init__(self, data_file, journal_file, compact_entries=None, compact_bytes=None, fsync=True, group_commit_window=0.0):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self.segment_file = journal_file + ".compacting"
+        self.compact_entries = compact_entries
+        self.compact_bytes = compact_bytes
+        self.lock = threading.RLock()
+        self.last_seq = 0
+        self.snapshot_seq = 0
+        self.journal_entries = 0
+        self.journal_bytes = 0
+        self.compacting = False
+        self.compaction_thread = None
+        
+        # Group commit: one writer at a time leads a flush, the others wait for it to cover their write
+        self.fsync = fsync
+        self.group_commit_window = group_commit_window
+        self.commit_cond = threading.Condition(self.lock)
+        self.journal_handle = None
+        self.synced_seq = 0
+        self.journal_syncing = False
+        self.snapshot_generation = 0
+        self.written_generation = 0
+        self.pending_snapshot = None
+        self.snapshot_writing = False
+    
+    def open_journal(self):
+        """Get the journal file handle, opening it for appending if needed"""
+        if self.journal_handle is None:
+            self.journal_handle = open(self.journal_file, 'a')
+        return self.journal_handle
+    
+    def close_journal(self):
+        """Close the journal handle before the file is moved or truncated"""
+        if self.journal_handle is not None:
+            if self.fsync and self.synced_seq < self.last_seq:
+                # Writers still waiting on sync_journal() will find no handle, so their entries go to disk now
+                self.journal_handle.flush()
+                os.fsync(self.journal_handle.fileno())
+                self.synced_seq = self.last_seq
+            self.journal_handle.close()
+            self.journal_handle = None
+    
+    def read_journal(self):
+        """Read all complete journal entries, including a segment left by an interrupted compaction"""
+        return read_journal(self.segment_file) + read_journal(self.journal_file)
+    
+    def load(self):
+        """Load the snapshot and replay the journal on top of it (None if there is no snapshot)"""
+        with self.lock:
+            if not os.path.exists(self.data_file):
+                return None
+            
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+            
+            self.close_journal()
+            truncate_torn_tail(self.journal_file)
+            
+            # Entries up to journal_seq are already part of the snapshot
+            self.snapshot_seq = data.get("journal_seq", 0)
+            self.last_seq = self.snapshot_seq
+            for entry in self.read_journal():
+                seq = entry.get("seq", 0)
+                if seq > self.snapshot_seq:
+                    apply_journal_entry(data, entry)
+                self.last_seq = max(self.last_seq, seq)
+            self.synced_seq = self.last_seq
+            
+            self.journal_entries = len(read_journal(self.journal_file))
+            self.journal_bytes = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        
+        self.maybe_compact()
+        return data
+    
+    def append(self, entry):
+        """Append one change to the journal and return its sequence number once it is on disk"""
+        seq = self.enqueue(entry)
+        self.sync_journal(seq)
+        self.maybe_compact()
+        return seq
+    
+    def enqueue(self, entry):
+        """Write one change to the journal without waiting for the disk and return its sequence number for sync_journal()"""
+        with self.lock:
+            self.last_seq += 1
+            seq = self.last_seq
+            line = json.dumps(dict(entry, seq=seq), separators=(",", ":")) + "\n"
+            self.open_journal().write(line)
+            line_bytes = len(line.encode("utf-8"))
+            self.journal_entries += 1
+            self.journal_bytes += line_bytes
+        count("bytes_written", line_bytes)
+        return seq
+    
+    def sync_journal(self, seq):
+        """Wait until the journal is flushed up to seq, leading the flush if nobody else is"""
+        with self.lock:
+            while self.synced_seq < seq:
+                if self.journal_syncing:
+                    self.commit_cond.wait()
+                    continue
+                
+                self.journal_syncing = True
+                try:
+                    if self.group_commit_window:
+                        # Give writers arriving right behind us a chance to share this flush
+                        self.commit_cond.wait(self.group_commit_window)
+                    target = self.last_seq
+                    if self.journal_handle is not None:
+                        self.journal_handle.flush()
+                        if self.fsync:
+                            # fsync a duplicate descriptor so appends can continue meanwhile
+                            fd = os.dup(self.journal_handle.fileno())
+                            self.lock.release()
+                            try:
+                                os.fsync(fd)
+                            finally:
+                                os.close(fd)
+                                self.lock.acquire()
+                    self.synced_seq = max(self.synced_seq, target)
+                finally:
+                    self.journal_syncing = False
+                    self.commit_cond.notify_all()
+    
+    def write_snapshot(self, data):
+        """Write a full snapshot and clear the journal it supersedes"""
+        self.sync_snapshot(self.stage_snapshot(data))
+    
+    def stage_snapshot(self, data):
+        """Serialize a snapshot as of the current journal position and queue it, returning its generation for sync_snapshot()"""
+        with self.lock:
+            seq = self.last_seq
+            content = json.dumps(dict(data, journal_seq=seq), separators=(",", ":"))
+            self.snapshot_generation += 1
+            self.pending_snapshot = (content, seq)
+            return self.snapshot_generation
+            
+    def sync_snapshot(self, generation):
+        """Wait until the snapshot of a generation (or a newer one) is on disk, leading the write if nobody else is"""
+        with self.lock:
+            while self.written_generation < generation:
+                if self.snapshot_writing:
+                    self.commit_cond.wait()
+                    continue
+                
+                self.snapshot_writing = True
+                try:
+                    if self.group_commit_window:
+                        # Snapshots are full copies, so only the newest one queued in the window is written
+                        self.commit_cond.wait(self.group_commit_window)
+                    target = self.snapshot_generation
+                    staged = self.pending_snapshot
+                    content, seq = staged
+                    
+                    # Write and fsync with the lock released so appends can continue meanwhile
+                    tmp_path = self.data_file + ".tmp"
+                    self.lock.release()
+                    try:
+                        write_temp_text(tmp_path, content, self.fsync)
+                    finally:
+                        self.lock.acquire()
+                    self.install_snapshot(tmp_path, seq)
+                    if self.pending_snapshot is staged:
+                        self.pending_snapshot = None
+                    self.written_generation = target
+                finally:
+                    self.snapshot_writing = False
+                    self.commit_cond.notify_all()
+    
+    def install_snapshot(self, tmp_path, seq):
+        """Move a written snapshot over the data file and clear the journal it covers (caller holds the lock)"""
+        replace_file(tmp_path, self.data_file, self.fsync)
+        self.snapshot_seq = seq
+        self.synced_seq = max(self.synced_seq, seq)
+        if seq < self.last_seq:
+            # Changes journaled after the snapshot was staged are still needed; load() skips the ones it covers
+            return
+        
+        # Everything journaled so far is now part of the snapshot
+        self.close_journal()
+        open(self.journal_file, 'w').close()
+        self.journal_entries = 0
+        self.journal_bytes = 0
+        if not self.compacting and os.path.exists(self.segment_file):
+            os.remove(self.segment_file)
+    
+    def needs_compaction(self):
+        """Check whether the journal has passed its size or entry threshold"""
+        if self.compact_entries and self.journal_entries >= self.compact_entries:
+            return True
+        if self.compact_bytes and self.journal_bytes >= self.compact_bytes:
+            return True
+        return False
+    
+    def maybe_compact(self):
+        """Start a background compaction if the journal is over threshold"""
+        with self.lock:
+            if self.compacting or not self.needs_compaction():
+                return False
+            self.compacting = True
+        
+        self.compaction_thread = threading.Thread(target=self._run_compaction, name="journal-compaction", daemon=True)
+        self.compaction_thread.start()
+        return True
+    
+    def _run_compaction(self):
+        """Compaction thread body"""
+        try:
+            self.compact()
+        except Exception:
+            # The journal is still intact, so the next threshold crossing simply retries
+            pass
+        finally:
+            with self.lock:
+                self.compacting = False
+    
+    def compact(self):
+        """Fold the journal into a new snapshot (checkpoint)"""
+        # Move the journal aside so appends can carry on while the snapshot is rebuilt
+        with self.lock:
+            # A full snapshot staged before this finishes can hold changes the journal doesn't (catalog edits), so it wins
+            generation = self.snapshot_generation
+            snapshot_idle = self.written_generation == generation
+            self.close_journal()
+            if os.path.exists(self.journal_file):
+                if os.path.exists(self.segment_file):
+                    with open(self.journal_file, 'r') as src, open(self.segment_file, 'a') as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, self.segment_file)
+            self.journal_entries = 0
+            self.journal_bytes = 0
+            
+            if not os.path.exists(self.data_file) or not os.path.exists(self.segment_file):
+                return False
+        
+        with open(self.data_file, 'r') as f:
+            data = json.load(f)
+        snapshot_seq = data.get("journal_seq", 0)
+        segment_seq = snapshot_seq
+        for entry in read_journal(self.segment_file):
+            seq = entry.get("seq", 0)
+            if seq > snapshot_seq:
+                apply_journal_entry(data, entry)
+            segment_seq = max(segment_seq, seq)
+        data["journal_seq"] = segment_seq
+        
+        tmp_path = self.data_file + ".compact.tmp"
+        write_temp_json(tmp_path, data, self.fsync)
+        
+        with self.lock:
+            if not snapshot_idle or self.snapshot_generation != generation or self.snapshot_seq >= segment_seq:
+                # A full snapshot written in the meantime supersedes this one
+                os.remove(tmp_path)
+            else:
+                replace_file(tmp_path, self.data_file, self.fsync)
+                self.snapshot_seq = segment_seq
+            if self.snapshot_seq >= segment_seq:
+                os.remove(self.segment_file)
+        return True
@@ -0,0 +1,14 @@
+"""
+Tests for the benchmark suite
+"""
+
+import benchmark
+
+def test_tiny_benchmark_run(monkeypatch):
+    monkeypatch.setitem(benchmark.SCALES, "tiny", {"parents": 3, "asins": 2, "transactions": 300, "days": 5, "returns": 10})
+    report = benchmark.run_benchmarks(["tiny"], [10], repeat=1)
+    
+    results = report["scales"]["tiny"]["results"]
+    assert {"save_data", "load_data", "undo_batch", "fba_upload_10_rows", "report_stock_report"} <= set(results)
+    assert results["undo_batch"]["runs"] == 1
+    assert all(result["min"] >= 0 for result in results.values())
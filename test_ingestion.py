@@ -0,0 +1,133 @@
+"""
+Tests for upload ingestion
+"""
+
+import io
+
+import pandas as pd
+
+from ingestion import UploadCache, aggregate_easy_ship, catalog_frame, drop_applied_orders, fba_review, iter_upload_chunks, normalize_easy_ship, order_lines, prepare_fba_review, read_fba_upload, resolve_columns, result_size, review_fba_upload, upload_digest
+
+def test_fba_review_joins_catalog(seeded_inventory):
+    upload = pd.DataFrame({
+        "ASIN": [" B000000001", "B000000005", "B00UNKNOWN", "B000000001"],
+        "Shipped": [2, 3, 1, 0],
+        "Merchant SKU": ["SKU-1", None, "SKU-X", "SKU-1"]
+    })
+    
+    review = prepare_fba_review(upload, catalog_frame(seeded_inventory))
+    
+    assert review["ASIN"].tolist() == ["B000000001", "B000000005", "B00UNKNOWN"]
+    assert review["Product Name"].tolist() == ["Rice 1kg", "5kg Rice", "Unknown Product"]
+    assert review["Current Stock"].tolist() == [5, 1, "Unknown"]
+    assert review["Status"].tolist() == ["Ready", "Ready", "Not Found"]
+    assert review["Insufficient Stock"].tolist() == [False, True, False]
+    assert review["Merchant SKU"].tolist() == ["SKU-1", "", "SKU-X"]
+    assert review["FNSKU"].tolist() == ["", "", ""]
+
+def test_easy_ship_orders_aggregate_per_asin_and_date(seeded_inventory):
+    upload = pd.DataFrame({
+        "order-id": ["A-1", "A-2", "A-3", "A-4", "A-5"],
+        "ASIN": ["B000000001", "B000000001", "B000000005", "B000000001", "B000000001"],
+        "Quantity-Purchased": [1, 2, 1, 3, 0],
+        "purchase-date": pd.to_datetime(["2025-06-20 10:00", "2025-06-20 11:00", "2025-06-20 12:00", "2025-06-21 09:00", "2025-06-21 09:30"])
+    })
+    
+    column_mapping, missing_cols = resolve_columns(upload.columns, "easy_ship_sales")
+    assert missing_cols == []
+    orders = normalize_easy_ship(upload, column_mapping)
+    review = aggregate_easy_ship(orders, catalog_frame(seeded_inventory))
+    
+    assert len(orders) == 4
+    assert review[["ASIN", "Sale Date", "Orders", "Quantity Purchased"]].values.tolist() == [
+        ["B000000001", "2025-06-20", 2, 3],
+        ["B000000005", "2025-06-20", 1, 1],
+        ["B000000001", "2025-06-21", 1, 3]
+    ]
+    # The second day needs 6 of the 5 packets in stock
+    assert review["Insufficient Stock"].tolist() == [False, False, True]
+    assert [line["order_id"] for line in order_lines(orders)[("B000000001", "2025-06-20")]] == ["A-1", "A-2"]
+
+def test_overlapping_easy_ship_upload_skips_recorded_orders(seeded_inventory):
+    seeded_inventory.record_transaction("Easy Ship Sale", "RICE", "B000000001", 1, orders=[{"order_id": "A-1", "sku": "", "quantity": 1}])
+    upload = pd.DataFrame({
+        "order-id": ["A-1", "A-1", "A-2", ""],
+        "asin": ["B000000001", "B000000005", "B000000001", "B000000001"],
+        "quantity-purchased": [1, 1, 2, 1]
+    })
+    
+    column_mapping, _ = resolve_columns(upload.columns, "easy_ship_sales")
+    orders, skipped_count = drop_applied_orders(normalize_easy_ship(upload, column_mapping), seeded_inventory.applied_orders, "Easy Ship Sale")
+    assert skipped_count == 1
+    assert orders[["Order ID", "ASIN"]].values.tolist() == [["A-1", "B000000005"], ["A-2", "B000000001"], ["", "B000000001"]]
+
+def test_xlsx_upload_streams_in_chunks(tmp_path):
+    path = tmp_path / "fba.xlsx"
+    frame = pd.DataFrame({"ASIN": [f"B00000000{i}" for i in range(7)], "Shipped": [1, 0, 2, 3, 0, 1, 4]})
+    frame.to_excel(path, index=False)
+    
+    with open(path, "rb") as f:
+        upload = io.BytesIO(f.read())
+    upload.name = "fba.xlsx"
+    
+    chunks = list(iter_upload_chunks(upload, chunk_rows=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), pd.read_excel(path))
+
+def test_tab_delimited_upload(tmp_path):
+    upload = io.BytesIO(b"order-id\tasin\tquantity-purchased\nA-1\tB000000001\t2\n")
+    upload.name = "orders.txt"
+    
+    chunks = list(iter_upload_chunks(upload))
+    assert chunks[0].to_dict("records") == [{"order-id": "A-1", "asin": "B000000001", "quantity-purchased": 2}]
+
+def test_fba_flat_file_report(seeded_inventory):
+    report = "﻿asin\tshipped\tfnsku\nB000000001\t2\tX001\nB000000005\t\tX005\nB000000005\t1\t\n"
+    upload = io.BytesIO(report.encode("utf-8"))
+    upload.name = "shipments.txt"
+    
+    chunks = list(iter_upload_chunks(upload, chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    column_mapping, missing_cols = resolve_columns(chunks[0].columns, "fba_sales")
+    assert column_mapping == {"asin": "asin", "quantity": "shipped"}
+    assert missing_cols == []
+    
+    review = pd.concat([prepare_fba_review(chunk, catalog_frame(seeded_inventory), column_mapping) for chunk in chunks], ignore_index=True)
+    assert review[["ASIN", "Shipped Qty", "Status"]].values.tolist() == [["B000000001", 2, "Ready"], ["B000000005", 1, "Ready"]]
+    
+    # Parsed once, then joined against the catalog again whenever stock changes
+    upload.seek(0)
+    columns, missing_cols, sales = read_fba_upload(upload)
+    assert sales[["ASIN", "Shipped Qty"]].values.tolist() == [["B000000001", 2], ["B000000005", 1]]
+    assert fba_review(sales, catalog_frame(seeded_inventory)).equals(review)
+
+def test_upload_cache_reuses_results_and_evicts_least_recent(seeded_inventory):
+    upload = io.BytesIO(b"ASIN,Shipped\nB000000001,2\n")
+    upload.name = "fba.csv"
+    key = ("fba_review", upload_digest(upload), seeded_inventory.version)
+    
+    cache = UploadCache()
+    builds = []
+    
+    def build():
+        builds.append(1)
+        return review_fba_upload(upload, catalog_frame(seeded_inventory))
+    
+    first = cache.get_or_build(key, build)
+    assert cache.get_or_build(key, build) is first
+    assert len(builds) == 1
+    assert first[2]["Status"].tolist() == ["Ready"]
+    
+    # Recording a sale changes the version, so the review is rebuilt against the new stock
+    seeded_inventory.record_transaction("fba_sale", "RICE", "B000000001", 1)
+    assert ("fba_review", upload_digest(upload), seeded_inventory.version) != key
+    
+    small = pd.DataFrame({"x": range(100)})
+    cache = UploadCache(max_bytes=result_size(small) * 2)
+    cache.put("a", small)
+    cache.put("b", small)
+    cache.get("a")
+    cache.put("c", small)
+    assert cache.get("b") is None
+    assert cache.get("a") is small and cache.get("c") is small
+    assert cache.size <= cache.max_bytes
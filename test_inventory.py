@@ -0,0 +1,240 @@
+"""
+Tests for the shared inventory
+"""
+
+import datetime
+import os
+import threading
+
+import pytest
+
+import storage
+from utils import ProgressThrottle, calculate_activity_summaries, calculate_daily_summary
+
+def sell(inventory, quantity, batch_id=None):
+    """Sell packed units the way the app does"""
+    inventory.stock_data["RICE"]["packed_stock"]["B000000001"] -= quantity
+    return inventory.record_transaction("FBA Sale", "RICE", "B000000001", quantity, quantity, batch_id=batch_id)
+
+def test_seeded_and_upgraded_on_first_load(seeded_inventory):
+    assert seeded_inventory.parent_items["RICE"]["reorder_level"] == 5.0
+    assert seeded_inventory.return_data["RICE"]["packed_return"]["B000000001"] == {"good": 0, "bad": 0}
+
+def test_empty_store_gets_a_first_snapshot(inventory):
+    assert inventory.parent_items == {}
+    assert inventory.transactions == []
+    assert os.path.exists(inventory.store.data_file)
+    
+def test_transactions_persist_across_reload(seeded_inventory, open_inventory):
+    assert sell(seeded_inventory, 2) == 1
+    
+    reloaded = open_inventory()
+    assert len(reloaded.transactions) == 1
+    assert reloaded.stock_data["RICE"]["packed_stock"]["B000000001"] == 3
+
+def test_batch_commits_once(seeded_inventory, open_inventory):
+    appends = []
+    real_enqueue = seeded_inventory.store.enqueue
+    seeded_inventory.store.enqueue = lambda entry: appends.append(entry) or real_enqueue(entry)
+    
+    with seeded_inventory.batch():
+        sell(seeded_inventory, 1, "B1")
+        sell(seeded_inventory, 2, "B1")
+    
+    assert len(appends) == 1
+    assert open_inventory().stock_data["RICE"]["packed_stock"]["B000000001"] == 2
+
+def test_batch_rolls_back_on_error(seeded_inventory, open_inventory):
+    with pytest.raises(KeyError):
+        with seeded_inventory.batch():
+            sell(seeded_inventory, 1)
+            seeded_inventory.record_transaction("FBA Sale", "MISSING")
+    
+    assert seeded_inventory.transactions == []
+    assert seeded_inventory.stock_data["RICE"]["packed_stock"]["B000000001"] == 5
+    assert open_inventory().transactions == []
+    
+def test_concurrent_transactions_share_fsync(open_inventory, monkeypatch):
+    fsync_calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(storage.os, "fsync", lambda fd: (fsync_calls.append(fd), real_fsync(fd)))
+    
+    inventory = open_inventory(group_commit_window=0.02)
+    inventory.stock_data["RICE"]["packed_stock"]["B000000001"] = 100
+    fsync_calls.clear()
+    
+    def sell_five():
+        for _ in range(5):
+            # The fsync is waited for after the lock is released, so writers queued behind it share it
+            with inventory.lock:
+                sell(inventory, 1)
+    
+    threads = [threading.Thread(target=sell_five) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(fsync_calls) < 40
+    assert open_inventory().stock_data["RICE"]["packed_stock"]["B000000001"] == 60
+
+def test_snapshots_are_independent_copies(seeded_inventory):
+    stock_data = seeded_inventory.snapshot("stock_data")
+    variations = seeded_inventory.variations("RICE")
+    
+    # Writes after the copy was taken don't show up in it
+    sell(seeded_inventory, 2)
+    seeded_inventory.add_variation("RICE", "B000000002", {"weight": 2})
+    assert stock_data["RICE"]["packed_stock"]["B000000001"] == 5
+    assert list(variations) == ["B000000001", "B000000005"]
+    assert seeded_inventory.variations("DAL") == {}
+
+def test_asin_index_follows_catalog_changes(seeded_inventory):
+    assert seeded_inventory.find_parent("B000000001") == "RICE"
+    assert seeded_inventory.find_parent("B000000002") is None
+    
+    seeded_inventory.add_variation("DAL", "B000000002", {"weight": 2})
+    assert seeded_inventory.find_parent("B000000002") == "DAL"
+    
+    seeded_inventory.remove_variation("RICE", "B000000001")
+    assert seeded_inventory.find_parent("B000000001") is None
+    
+    seeded_inventory.remove_variations("DAL")
+    assert seeded_inventory.find_parent("B000000002") is None
+    assert "DAL" not in seeded_inventory.packet_variations
+
+def test_asin_index_rebuilt_on_load(seeded_inventory, open_inventory):
+    seeded_inventory.add_variation("DAL", "B000000002", {"weight": 2})
+    seeded_inventory.save()
+    
+    assert open_inventory().find_parent("B000000002") == "DAL"
+
+def test_transaction_ids_never_reused(seeded_inventory, open_inventory):
+    sell(seeded_inventory, 1)
+    second = sell(seeded_inventory, 1)
+    
+    # Undo the newest transaction, then record another
+    seeded_inventory.remove_transactions(lambda t: t["id"] == second)
+    seeded_inventory.save()
+    third = sell(seeded_inventory, 1)
+    assert third == second + 1
+    
+    reloaded = open_inventory()
+    assert reloaded.next_transaction_id == third + 1
+    assert reloaded.get_transaction(third)["id"] == third
+    assert reloaded.get_transaction(second) is None
+
+def test_transaction_index_tracks_positions(seeded_inventory):
+    ids = [sell(seeded_inventory, 1, batch_id="B1" if n < 2 else None) for n in range(4)]
+    
+    seeded_inventory.remove_transactions(lambda t: t.get("batch_id") == "B1")
+    assert seeded_inventory.transaction_position(ids[2]) == 0
+    assert seeded_inventory.transaction_position(ids[3]) == 1
+    assert seeded_inventory.get_transaction(ids[0]) is None
+
+def test_date_index_buckets(seeded_inventory):
+    today = datetime.date.today()
+    seeded_inventory.record_transaction("Stock Inward", "RICE", weight=1, transaction_date=today - datetime.timedelta(days=3))
+    seeded_inventory.record_transaction("Stock Inward", "RICE", weight=2, transaction_date=today)
+    seeded_inventory.record_transaction("Stock Inward", "RICE", weight=3, transaction_date=today - datetime.timedelta(days=10))
+    
+    assert [t["weight"] for t in seeded_inventory.transactions_on(today.isoformat())] == [2]
+    assert [t["weight"] for t in seeded_inventory.transactions_since(today - datetime.timedelta(days=5))] == [1, 2]
+    
+    seeded_inventory.remove_transactions(lambda t: t["weight"] == 2)
+    assert seeded_inventory.transactions_on(today.isoformat()) == []
+    
+    summary = calculate_daily_summary(None, today - datetime.timedelta(days=3), date_index=seeded_inventory.date_index)
+    assert summary["stock_inward"] == {"count": 1, "total_weight": 1}
+
+def test_batch_index_and_undo(seeded_inventory):
+    sell(seeded_inventory, 1)
+    sell(seeded_inventory, 1, "B1")
+    sell(seeded_inventory, 1, "B1")
+    seeded_inventory.record_transaction("Stock Inward", "RICE", weight=2)
+    
+    assert [t["id"] for t in seeded_inventory.get_batch("B1")] == [2, 3]
+    assert seeded_inventory.last_transaction_for_asin("B000000001")["id"] == 3
+    
+    removed = seeded_inventory.remove_batch("B1")
+    assert [t["id"] for t in removed] == [2, 3]
+    assert [t["id"] for t in seeded_inventory.transactions] == [1, 4]
+    assert seeded_inventory.transaction_position(4) == 1
+    assert seeded_inventory.transaction_position(2) is None
+    assert seeded_inventory.get_batch("B1") == []
+    assert seeded_inventory.last_transaction_for_asin("B000000001")["id"] == 1
+    assert len(seeded_inventory.transactions_on(datetime.date.today())) == 2
+    
+    # The incremental update leaves the same indexes as a full rebuild
+    indexes = (seeded_inventory.transaction_index, seeded_inventory.date_index, seeded_inventory.batch_index, seeded_inventory.asin_transactions)
+    seeded_inventory.rebuild_transaction_index()
+    assert indexes == (seeded_inventory.transaction_index, seeded_inventory.date_index, seeded_inventory.batch_index, seeded_inventory.asin_transactions)
+
+def test_applied_orders_persist_and_undo(seeded_inventory, open_inventory):
+    orders = [{"order_id": "A-1", "sku": "", "quantity": 1}, {"order_id": "A-2", "sku": "", "quantity": 1}]
+    seeded_inventory.record_transaction("Easy Ship Sale", "RICE", "B000000001", 2, batch_id="B1", orders=orders)
+    
+    reloaded = open_inventory()
+    assert reloaded.order_applied("Easy Ship Sale", "A-2", "B000000001")
+    assert not reloaded.order_applied("FBA Sale", "A-2", "B000000001")
+    
+    # Undoing the upload lets the same orders be applied again
+    reloaded.remove_batch("B1")
+    assert reloaded.applied_orders == {}
+
+def test_activity_summaries_for_all_parents(seeded_inventory):
+    seeded_inventory.parent_items["DAL"] = {"name": "Dal", "unit": "kg"}
+    seeded_inventory.record_transaction("Stock Inward", "RICE", weight=2.5)
+    seeded_inventory.record_transaction("Packing", "RICE", "B000000001", quantity=3, weight=3.0)
+    sell(seeded_inventory, 1)
+    seeded_inventory.record_transaction("Easy Ship Sale (Bulk)", "RICE", "B000000001", quantity=2)
+    seeded_inventory.record_transaction("Stock Adjustment", "DAL", weight=-1.5)
+    
+    activities = calculate_activity_summaries(seeded_inventory.transactions_on(datetime.date.today()))
+    rice = activities["RICE"]
+    assert rice["stock_inward"] == 2.5
+    assert rice["packing_out"] == 3.0
+    assert rice["packing_in"] == {"B000000001": 3}
+    assert rice["fba_sales"] == {"B000000001": 1}
+    assert rice["easy_ship_sales"] == {"B000000001": 2}
+    assert [d["type"] for d in rice["activity_details"]] == ["Stock Inward", "Packing", "FBA Sale", "Easy Ship Sale"]
+    assert activities["DAL"]["other_changes"] == -1.5
+    assert calculate_activity_summaries([]) == {}
+
+def test_activity_view_follows_ledger(seeded_inventory, open_inventory):
+    today = datetime.date.today()
+    sell(seeded_inventory, 1)
+    sell(seeded_inventory, 2, "B1")
+    assert seeded_inventory.activity_on(today)["RICE"]["fba_sales"] == {"B000000001": 3}
+    
+    # Pages get a copy, which later sales don't change under them
+    view = seeded_inventory.activity_on(today)
+    sell(seeded_inventory, 1)
+    assert view["RICE"]["fba_sales"] == {"B000000001": 3}
+    seeded_inventory.remove_transactions(lambda t: t["id"] == 3)
+    
+    seeded_inventory.remove_batch("B1")
+    assert seeded_inventory.activity_on(today)["RICE"]["fba_sales"] == {"B000000001": 1}
+    seeded_inventory.remove_transactions(lambda t: True)
+    assert seeded_inventory.activity_on(today) == {}
+    
+    # Journaled transactions missing from the persisted view are picked up on load
+    seeded_inventory.save()
+    sell(seeded_inventory, 4)
+    reloaded = open_inventory()
+    assert reloaded.activity_on(today)["RICE"]["fba_sales"] == {"B000000001": 4}
+    assert reloaded.daily_activity == seeded_inventory.daily_activity
+
+def test_progress_throttle_coalesces_updates():
+    updates = []
+    progress = ProgressThrottle(lambda fraction, message: updates.append((fraction, message)), rate=0.001)
+    for done in range(1, 1001):
+        progress(done, 1000, f"Row {done}")
+    # Only the first and the final update get through within the interval
+    assert updates == [(0.001, "Row 1"), (1.0, "Row 1000")]
+    
+    updates.clear()
+    progress = ProgressThrottle(lambda fraction, message: updates.append(fraction), rate=0.001, step=0.25)
+    for done in range(1, 101):
+        progress(done, 100)
+    assert updates == [0.01, 0.26, 0.51, 0.76, 1.0]
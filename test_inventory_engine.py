@@ -0,0 +1,107 @@
+"""
+Tests for the headless inventory engine
+"""
+
+import pytest
+
+from inventory_engine import InventoryEngine, InventoryError
+
+def test_operations_update_stock_and_persist(seeded_inventory, open_inventory):
+    engine = InventoryEngine(seeded_inventory)
+    engine.inventory.add_variation("RICE", "B000000002", {"weight": 0.5})
+    
+    engine.stock_inward("RICE", 5, "Delivery")
+    engine.pack("RICE", "B000000002", 4)
+    engine.sell("RICE", "B000000001", 2, "Easy Ship Sale", orders=[{"order_id": "ORDER-1", "quantity": 2}])
+    engine.set_loose_stock("RICE", 12, lambda old, new: f"Count {old} -> {new}")
+    engine.set_packed_stock("RICE", "B000000001", 1, lambda old, new: f"Count {old} -> {new}")
+    
+    assert engine.loose_stock("RICE") == 12
+    assert engine.packed_stock("RICE", "B000000001") == 1
+    assert engine.packed_stock("RICE", "B000000002") == 4
+    assert [t["type"] for t in engine.inventory.transactions] == ["Stock Inward", "Packing", "Easy Ship Sale", "LOOSE_STOCK_ADJUSTMENT", "STOCK_ADJUSTMENT"]
+    assert engine.inventory.transactions[3]["weight"] == -1
+    assert engine.inventory.transactions[3]["notes"] == "Count 13.0 -> 12"
+    assert engine.inventory.order_applied("Easy Ship Sale", "ORDER-1", "B000000001")
+    
+    reopened = InventoryEngine(open_inventory())
+    assert reopened.loose_stock("RICE") == 12
+    assert reopened.packed_stock("RICE", "B000000001") == 1
+    assert len(reopened.inventory.transactions) == 5
+
+def test_rejected_operations_change_nothing(seeded_inventory):
+    engine = InventoryEngine(seeded_inventory)
+    
+    with pytest.raises(InventoryError, match="Insufficient stock"):
+        engine.sell("RICE", "B000000001", 6)
+    with pytest.raises(InventoryError, match="Not enough loose stock"):
+        engine.pack("RICE", "B000000001", 11)
+    with pytest.raises(InventoryError, match="not found"):
+        engine.sell("RICE", "B00UNKNOWN", 1)
+    
+    assert engine.loose_stock("RICE") == 10
+    assert engine.packed_stock("RICE", "B000000001") == 5
+    assert engine.inventory.transactions == []
+
+def test_batch_rolls_back_on_error(seeded_inventory):
+    engine = InventoryEngine(seeded_inventory)
+    
+    with pytest.raises(InventoryError):
+        with engine.batch():
+            engine.sell("RICE", "B000000001", 3, batch_id="BATCH_1")
+            engine.sell("RICE", "B000000001", 3, batch_id="BATCH_1")
+    
+    assert engine.packed_stock("RICE", "B000000001") == 5
+    assert engine.inventory.get_batch("BATCH_1") == []
+
+def test_undo_transaction_and_batch(seeded_inventory):
+    engine = InventoryEngine(seeded_inventory)
+    inward_id = engine.stock_inward("RICE", 5)
+    with engine.batch():
+        engine.sell("RICE", "B000000001", 2, batch_id="BATCH_1")
+        engine.sell("RICE", "B000000001", 1, batch_id="BATCH_1")
+    
+    removed = engine.undo_batch("BATCH_1")
+    assert len(removed) == 2
+    assert engine.packed_stock("RICE", "B000000001") == 5
+    
+    assert engine.undo_transaction(inward_id)["type"] == "Stock Inward"
+    assert engine.loose_stock("RICE") == 10
+    assert engine.inventory.transactions == []
+    
+    with pytest.raises(InventoryError, match="not found"):
+        engine.undo_transaction(inward_id)
+    assert engine.can_undo_batch("BATCH_1") == (False, "Batch not found")
+
+def test_undo_is_journaled_without_snapshot(seeded_inventory, open_inventory, monkeypatch):
+    engine = InventoryEngine(seeded_inventory)
+    first = engine.sell("RICE", "B000000001", 1)
+    middle = engine.sell("RICE", "B000000001", 2)
+    last = engine.stock_inward("RICE", 3)
+    
+    # Undo writes one journal entry instead of a full snapshot
+    monkeypatch.setattr(engine.inventory, "save", lambda: pytest.fail("undo wrote a snapshot"))
+    engine.undo_transaction(middle)
+    assert engine.inventory.transaction_position(last) == 1
+    assert engine.inventory.get_transaction(middle) is None
+    
+    reopened = InventoryEngine(open_inventory())
+    assert [t["id"] for t in reopened.inventory.transactions] == [first, last]
+    assert reopened.packed_stock("RICE", "B000000001") == 4
+    assert reopened.loose_stock("RICE") == 13
+    assert reopened.inventory.next_transaction_id == last + 1
+
+def test_returns_and_transfers(seeded_inventory):
+    engine = InventoryEngine(seeded_inventory)
+    
+    engine.record_return("RICE", 3, "Good", "Amazon", "Customer return", "packets", "1kg Rice", asin="B000000001")
+    engine.record_return("RICE", 2, "Bad", "Amazon", "Damaged", "kg", "Rice")
+    assert engine.inventory.return_data["RICE"]["packed_return"]["B000000001"] == {"good": 3, "bad": 0}
+    assert engine.inventory.return_data["RICE"]["loose_return"]["bad"] == 2
+    assert [t["type"] for t in engine.inventory.return_transactions] == ["RETURN_PACKED", "RETURN_LOOSE"]
+    
+    engine.transfer_good_return("RICE", "B000000001")
+    assert engine.packed_stock("RICE", "B000000001") == 8
+    assert engine.inventory.return_data["RICE"]["packed_return"]["B000000001"]["good"] == 0
+    with pytest.raises(InventoryError):
+        engine.transfer_good_return("RICE", "B000000001")
@@ -0,0 +1,100 @@
+"""
+Tests for the background job runner and the bulk functions it runs
+"""
+
+import datetime
+
+import pandas as pd
+
+from bulk import BULK_JOBS, apply_stock_updates
+from config import DEFAULT_SETTINGS
+from ingestion import catalog_frame, prepare_fba_review
+from inventory_engine import InventoryEngine
+from jobs import JobRunner
+
+def test_fba_job_runs_in_background(seeded_inventory, tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"), seeded_inventory, BULK_JOBS)
+    upload = pd.DataFrame({"ASIN": ["B000000001", "B00UNKNOWN", "B000000001"], "Shipped": [2, 1, 0]})
+    review = prepare_fba_review(upload, catalog_frame(seeded_inventory))
+    
+    job_id = runner.submit("fba_sales", review[review["Status"] == "Ready"], "FBA_1")
+    runner.wait()
+    
+    job = runner.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"]["processed_count"] == 1
+    assert job["result"]["error_details"] == []
+    assert job["result"]["batch_id"] == "FBA_1"
+    assert seeded_inventory.stock_data["RICE"]["packed_stock"]["B000000001"] == 3
+    
+    # The upload is undone as one batch, like Easy Ship uploads
+    InventoryEngine(seeded_inventory).undo_batch("FBA_1")
+    assert seeded_inventory.stock_data["RICE"]["packed_stock"]["B000000001"] == 5
+
+def test_easy_ship_job_keeps_order_lines(seeded_inventory, tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"), seeded_inventory, BULK_JOBS)
+    ready_rows = pd.DataFrame({
+        "ASIN": ["B000000001"],
+        "parent_id": ["RICE"],
+        "Quantity Purchased": [3],
+        "Sale Date": ["2025-06-20"],
+        "Product Name": ["Rice 1kg"],
+        "SKU": ["SKU-1"],
+        "Order Lines": [[{"order_id": "A-1", "sku": "SKU-1", "quantity": 1}, {"order_id": "A-2", "sku": "SKU-1", "quantity": 2}]]
+    })
+    
+    job_id = runner.submit("easy_ship_sales", ready_rows, "EASY_SHIP_TEST")
+    runner.wait()
+    
+    assert runner.get(job_id)["result"]["processed_count"] == 1
+    transaction = seeded_inventory.get_batch("EASY_SHIP_TEST")[0]
+    # Recorded as today; the report's sale date goes in the notes
+    assert transaction["date"] == datetime.date.today().isoformat()
+    assert "Sale Date: 2025-06-20" in transaction["notes"]
+    assert [line["order_id"] for line in transaction["orders"]] == ["A-1", "A-2"]
+    assert seeded_inventory.order_applied("Easy Ship Sale", "A-2", "B000000001")
+    assert seeded_inventory.stock_data["RICE"]["packed_stock"]["B000000001"] == 2
+
+def test_failed_job_changes_nothing(seeded_inventory, tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"), seeded_inventory, BULK_JOBS)
+    
+    # Not a reviewed upload, so the job fails before touching stock
+    job_id = runner.submit("fba_sales", pd.DataFrame({"ASIN": ["B000000001"]}))
+    runner.wait()
+    
+    job = runner.get(job_id)
+    assert job["status"] == "failed"
+    assert "parent_id" in job["error"]
+    assert seeded_inventory.transactions == []
+
+def test_queued_jobs_survive_restart(seeded_inventory, tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"), seeded_inventory, BULK_JOBS)
+    # Stop the first worker from picking the job up, as if the process ended first
+    runner.run_job = lambda job_id: None
+    
+    changes = pd.DataFrame({"Type": ["PARENT_LOOSE"], "Parent_ID": ["RICE"], "New_Stock": [7.5]})
+    job_id = runner.submit("stock_updates", changes)
+    runner.wait()
+    runner.close()
+    assert seeded_inventory.stock_data["RICE"]["loose_stock"] == 10
+    
+    restarted = JobRunner(str(tmp_path / "jobs.db"), seeded_inventory, BULK_JOBS)
+    restarted.wait()
+    job = restarted.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"updated_count": 1, "errors": []}
+    assert seeded_inventory.stock_data["RICE"]["loose_stock"] == 7.5
+    assert [job["id"] for job in restarted.recent()] == [job_id]
+
+def test_stock_updates_commit_per_chunk(seeded_inventory, open_inventory, monkeypatch):
+    monkeypatch.setitem(DEFAULT_SETTINGS, "bulk_commit_rows", 2)
+    entries = []
+    real_enqueue = seeded_inventory.store.enqueue
+    seeded_inventory.store.enqueue = lambda entry: entries.append(entry) or real_enqueue(entry)
+    
+    changes = pd.DataFrame({"Type": ["PARENT_LOOSE"] * 5, "Parent_ID": ["RICE"] * 5, "New_Stock": [1.0, 2.0, 3.0, 4.0, 5.0]})
+    result = apply_stock_updates(seeded_inventory, changes)
+    
+    assert result == {"updated_count": 5, "errors": []}
+    assert [len(entry["transactions"]) for entry in entries] == [2, 2, 1]
+    assert open_inventory().stock_data["RICE"]["loose_stock"] == 5.0
@@ -0,0 +1,40 @@
+"""
+Tests for the metrics recorder and the instrumented save/load paths
+"""
+
+import json
+
+import pytest
+
+from metrics import MetricsRecorder, recorder
+
+def test_timings_go_to_buffer_and_log(tmp_path):
+    metrics = MetricsRecorder(capacity=3)
+    metrics.log_to(str(tmp_path / "metrics.jsonl"))
+    
+    for rows in range(4):
+        with metrics.timer("work", rows=rows):
+            pass
+    with pytest.raises(ValueError):
+        with metrics.timer("broken"):
+            raise ValueError("boom")
+    metrics.count("rows_processed", 10)
+    metrics.count("rows_processed", 5)
+    
+    # The ring buffer keeps only the newest timings; the log keeps them all
+    assert [event.get("rows") for event in metrics.recent()] == [None, 3, 2]
+    assert metrics.recent(1)[0]["error"] == "ValueError"
+    assert {row["name"]: row["calls"] for row in metrics.summary()} == {"work": 2, "broken": 1}
+    assert metrics.counter_values() == {"rows_processed": 15}
+    
+    lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["work"] * 4 + ["broken"]
+
+def test_save_and_load_are_instrumented(open_inventory):
+    recorder.clear()
+    inventory = open_inventory(lambda inventory: None)
+    inventory.save()
+    
+    names = [event["name"] for event in recorder.recent()]
+    assert "load_data" in names and names.count("save_data") == 2
+    assert recorder.counter_values()["bytes_written"] > 0
@@ -0,0 +1,61 @@
+"""
+Tests for the Prometheus metrics exporter
+"""
+
+import urllib.request
+
+from inventory_engine import InventoryEngine
+from metrics import MetricsRecorder, recorder
+from metrics_exporter import MetricsExporter, SessionTracker, start_http_exporter
+
+def samples(text):
+    """Metric line -> value, without the comment lines"""
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line and not line.startswith("#")}
+
+def test_render_histograms_and_gauges():
+    metrics = MetricsRecorder()
+    for seconds in [0.003, 0.02, 0.02, 2]:
+        metrics.record("save_data", seconds)
+    metrics.record('page: Live "Stock" View', 0.3)
+    metrics.record("bulk_fba_sales", 2.0)
+    metrics.count("rows_processed", 1000)
+    metrics.count("undo_batch")
+    
+    class Ledger:
+        transactions = [{}, {}, {}]
+    sessions = SessionTracker()
+    sessions.touch("a")
+    sessions.touch("b")
+    
+    values = samples(MetricsExporter(Ledger(), [], sessions, metrics).render())
+    assert values['stock_tracker_save_data_seconds_bucket{le="0.005"}'] == 1
+    assert values['stock_tracker_save_data_seconds_bucket{le="0.025"}'] == 3
+    assert values['stock_tracker_save_data_seconds_bucket{le="+Inf"}'] == 4
+    assert values["stock_tracker_save_data_seconds_count"] == 4
+    assert values['stock_tracker_page_render_seconds_count{page="Live \\"Stock\\" View"}'] == 1
+    assert values['stock_tracker_bulk_seconds_sum{job="fba_sales"}'] == 2.0
+    assert values["stock_tracker_bulk_rows_per_second"] == 500.0
+    assert values['stock_tracker_undo_total{kind="batch"}'] == 1
+    assert values["stock_tracker_transactions"] == 3
+    assert values["stock_tracker_active_sessions"] == 2
+
+def test_http_exporter_serves_inventory_metrics(seeded_inventory):
+    store = seeded_inventory.store
+    engine = InventoryEngine(seeded_inventory)
+    before = recorder.counter_values().get("transactions_recorded", 0)
+    engine.sell("RICE", "B000000001", 2)
+    
+    exporter = MetricsExporter(engine.inventory, [store.data_file, store.journal_file])
+    server = start_http_exporter(exporter, 0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            values = samples(response.read().decode("utf-8"))
+    finally:
+        server.shutdown()
+    
+    assert values["stock_tracker_transactions"] == 1
+    assert values["stock_tracker_transactions_recorded_total"] == before + 1
+    assert values['stock_tracker_data_file_bytes{file="stock_data.json"}'] > 0
+    assert values['stock_tracker_data_file_bytes{file="stock_data.journal"}'] > 0
+    assert values["stock_tracker_save_data_seconds_count"] >= 1
@@ -0,0 +1,29 @@
+"""
+Tests for on-demand profiling of a single call
+"""
+
+import marshal
+import pickle
+import tracemalloc
+
+from profiling import profile_call
+
+def build_rows(count):
+    """Something to profile that allocates memory"""
+    return [{"row": i, "label": str(i)} for i in range(count)]
+
+def test_profile_call_captures_stats_and_snapshot():
+    rows, capture = profile_call("Live Stock View", build_rows, 20000)
+    
+    assert len(rows) == 20000
+    assert capture.seconds > 0
+    assert capture.peak_bytes > 0
+    assert "build_rows" in capture.top_functions(5)
+    assert capture.top_allocations(1)[0]["line"].endswith(f"test_profiling.py:{build_rows.__code__.co_firstlineno + 2}")
+    assert capture.file_name("pstats").startswith("live_stock_view_")
+    
+    # The downloads load with the standard tools
+    assert any(key[2] == "build_rows" for key in marshal.loads(capture.stats_bytes()))
+    assert isinstance(pickle.loads(capture.snapshot_bytes()), tracemalloc.Snapshot)
+    # Tracing is switched off again unless it was already on
+    assert not tracemalloc.is_tracing()
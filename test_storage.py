@@ -0,0 +1,281 @@
+"""
+Tests for the Stock Tracker persistence layer
+"""
+
+import json
+import os
+import threading
+
+import storage
+from storage import JournalStore
+from sqlite_store import SQLiteStore, migrate_json_to_sqlite
+
+def make_store(tmp_path, **kwargs):
+    """Create a store in a temporary folder"""
+    return JournalStore(str(tmp_path / "stock_data.json"), str(tmp_path / "stock_data.journal"), **kwargs)
+
+def sample_data():
+    """Minimal data file contents"""
+    return {
+        "stock_data": {"RICE": {"loose_stock": 10, "packed_stock": {"B000000001": 4}}},
+        "transactions": [],
+        "parent_items": {"RICE": {"name": "Rice"}},
+        "packet_variations": {"RICE": {"B000000001": {"weight": 1}}}
+    }
+
+def sale_entry(transaction_id, packed_units):
+    """Journal entry for a one unit sale"""
+    return {
+        "op": "transaction",
+        "transaction": {"id": transaction_id, "type": "FBA Sale", "parent_id": "RICE", "asin": "B000000001", "quantity": 1},
+        "stock": {"RICE": {"loose_stock": 10, "packed_stock": {"B000000001": packed_units}}}
+    }
+
+def test_load_without_snapshot(tmp_path):
+    assert make_store(tmp_path).load() is None
+
+def test_journal_replayed_on_load(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    store.append(sale_entry(2, 2))
+    
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [1, 2]
+    assert data["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 2
+
+def test_snapshot_clears_journal(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    
+    data = store.load()
+    store.write_snapshot(data)
+    assert os.path.getsize(store.journal_file) == 0
+    
+    reloaded = make_store(tmp_path).load()
+    assert len(reloaded["transactions"]) == 1
+
+def test_entries_already_in_snapshot_are_skipped(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    journal = open(store.journal_file).read()
+    
+    # Simulate a crash between writing the snapshot and clearing the journal
+    store.write_snapshot(store.load())
+    with open(store.journal_file, 'w') as f:
+        f.write(journal)
+    
+    data = make_store(tmp_path).load()
+    assert len(data["transactions"]) == 1
+
+def test_batch_entry_replayed_as_one(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    batch = {
+        "op": "batch",
+        "transactions": [sale_entry(1, 3)["transaction"], sale_entry(2, 2)["transaction"]],
+        "stock": sale_entry(2, 2)["stock"]
+    }
+    store.append(batch)
+    
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [1, 2]
+    assert data["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 2
+
+def test_torn_journal_line_ignored(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    with open(store.journal_file, 'a') as f:
+        f.write(json.dumps(sale_entry(2, 2))[:20])
+    
+    data = make_store(tmp_path).load()
+    assert len(data["transactions"]) == 1
+    assert data["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 3
+
+def test_torn_tail_truncated_before_next_append(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    with open(store.journal_file, 'a') as f:
+        f.write(json.dumps(sale_entry(1, 3))[:20])
+    
+    store = make_store(tmp_path)
+    store.load()
+    store.append(sale_entry(2, 2))
+    
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [2]
+
+def test_compact_folds_journal_into_snapshot(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    store.append(sale_entry(2, 2))
+    
+    assert store.compact()
+    assert not os.path.exists(store.journal_file)
+    assert not os.path.exists(store.segment_file)
+    
+    with open(store.data_file) as f:
+        snapshot = json.load(f)
+    assert snapshot["journal_seq"] == 2
+    assert len(snapshot["transactions"]) == 2
+    
+    # Appends after the checkpoint continue the sequence
+    store.append(sale_entry(3, 1))
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [1, 2, 3]
+    assert data["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 1
+
+def test_interrupted_compaction_segment_replayed(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    
+    # Simulate a crash after the journal was moved aside
+    os.replace(store.journal_file, store.segment_file)
+    store = make_store(tmp_path)
+    store.load()
+    store.append(sale_entry(2, 2))
+    
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [1, 2]
+    
+    store.compact()
+    data = make_store(tmp_path).load()
+    assert [t["id"] for t in data["transactions"]] == [1, 2]
+
+def test_compaction_starts_in_background_over_threshold(tmp_path):
+    store = make_store(tmp_path, compact_entries=3)
+    store.write_snapshot(sample_data())
+    for transaction_id in range(1, 4):
+        store.append(sale_entry(transaction_id, 4 - transaction_id))
+    
+    store.compaction_thread.join(5)
+    assert not store.compacting
+    assert store.snapshot_seq == 3
+    
+    data = make_store(tmp_path).load()
+    assert len(data["transactions"]) == 3
+
+def test_sqlite_round_trip(tmp_path):
+    store = SQLiteStore(str(tmp_path / "stock_data.db"))
+    assert store.load() is None
+    
+    data = sample_data()
+    data["return_data"] = {"RICE": {"loose_return": {"good": 1, "bad": 0}, "packed_return": {}}}
+    store.write_snapshot(data)
+    store.append(sale_entry(1, 3))
+    
+    loaded = store.load()
+    assert loaded["parent_items"] == data["parent_items"]
+    assert loaded["packet_variations"] == data["packet_variations"]
+    assert loaded["return_data"] == data["return_data"]
+    assert loaded["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 3
+    assert [t["id"] for t in loaded["transactions"]] == [1]
+    store.close()
+
+def test_sqlite_undo_entry(tmp_path):
+    store = SQLiteStore(str(tmp_path / "stock_data.db"))
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 4))
+    store.append(sale_entry(2, 3))
+    store.append({"op": "undo", "transaction_ids": [1], "next_transaction_id": 3,
+                  "stock": {"RICE": {"loose_stock": 10, "packed_stock": {"B000000001": 4}}}})
+    
+    loaded = store.load()
+    assert [t["id"] for t in loaded["transactions"]] == [2]
+    assert loaded["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 4
+    assert loaded["next_transaction_id"] == 3
+    store.close()
+
+def test_sqlite_snapshot_writes_only_changes(tmp_path):
+    store = SQLiteStore(str(tmp_path / "stock_data.db"))
+    data = sample_data()
+    data["parent_items"]["DAL"] = {"name": "Dal"}
+    data["stock_data"]["DAL"] = {"loose_stock": 2, "packed_stock": {}}
+    data["transactions"] = [sale_entry(i, 4)["transaction"] for i in range(1, 101)]
+    store.write_snapshot(data)
+    
+    # One stock record changed, one transaction undone from the end and one recorded
+    data["stock_data"]["RICE"]["loose_stock"] = 7
+    data["transactions"] = data["transactions"][:-1] + [sale_entry(101, 4)["transaction"]]
+    before = store.conn.total_changes
+    store.write_snapshot(data)
+    # 1 stock update + 1 delete + 1 insert + 5 meta rows
+    assert store.conn.total_changes - before == 8
+    
+    # Moving a parent to the end of the catalog rewrites that table in the new order
+    del data["parent_items"]["RICE"]
+    data["parent_items"]["RICE"] = {"name": "Rice"}
+    store.write_snapshot(data)
+    assert store.conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+    store.close()
+    
+    reopened = SQLiteStore(str(tmp_path / "stock_data.db"), fsync=False)
+    loaded = reopened.load()
+    assert list(loaded["parent_items"]) == ["DAL", "RICE"]
+    assert loaded["stock_data"] == data["stock_data"]
+    assert [t["id"] for t in loaded["transactions"]] == list(range(1, 100)) + [101]
+    assert reopened.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    reopened.close()
+
+def test_sqlite_indexes_filtered_columns(tmp_path):
+    store = SQLiteStore(str(tmp_path / "stock_data.db"))
+    indexes = set(name for (name,) in store.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    for column in ["id", "date", "batch_id", "asin", "parent_id", "type"]:
+        assert f"idx_transactions_{column}" in indexes
+    
+    # Ad-hoc queries use the indexes rather than scanning the table
+    plan = store.conn.execute("EXPLAIN QUERY PLAN SELECT data FROM transactions WHERE batch_id = ?", ("FBA_1",)).fetchall()
+    assert "idx_transactions_batch_id" in str(plan)
+    store.close()
+
+def test_migrate_json_to_sqlite(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    store.append(sale_entry(1, 3))
+    
+    db_file = str(tmp_path / "stock_data.db")
+    assert migrate_json_to_sqlite(store.data_file, store.journal_file, db_file) == 1
+    
+    migrated = SQLiteStore(db_file)
+    data = migrated.load()
+    assert data["stock_data"]["RICE"]["packed_stock"]["B000000001"] == 3
+    migrated.close()
+
+def test_failed_snapshot_keeps_previous_file(tmp_path):
+    store = make_store(tmp_path)
+    store.write_snapshot(sample_data())
+    
+    # Something that can't be serialized fails halfway through the dump
+    broken = dict(sample_data(), stock_data={"RICE": {"loose_stock": object()}})
+    try:
+        store.write_snapshot(broken)
+    except TypeError:
+        pass
+    
+    assert not os.path.exists(store.data_file + ".tmp")
+    data = make_store(tmp_path).load()
+    assert data["stock_data"]["RICE"]["loose_stock"] == 10
+
+def test_group_commit_shares_fsync(tmp_path, monkeypatch):
+    fsync_calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(storage.os, "fsync", lambda fd: (fsync_calls.append(fd), real_fsync(fd)))
+    
+    store = make_store(tmp_path, group_commit_window=0.02)
+    store.write_snapshot(sample_data())
+    fsync_calls.clear()
+    
+    threads = [threading.Thread(target=store.append, args=(sale_entry(i, 0),)) for i in range(1, 21)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(fsync_calls) < 20
+    data = make_store(tmp_path).load()
+    assert sorted(t["id"] for t in data["transactions"]) == list(range(1, 21))
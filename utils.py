@@ -6,7 +6,8 @@ import pandas as pd
 import datetime
 import json
 import os
-from config import EXCEL_COLUMN_MAPPINGS, TRANSACTION_TYPES
+import time
+from config import DEFAULT_SETTINGS, EXCEL_COLUMN_MAPPINGS, TRANSACTION_TYPES
 
 def find_column(df, possible_names):
     """Find a column in DataFrame using possible column names"""
@@ -244,13 +245,16 @@ def restore_data(backup_file_path):
     except Exception as e:
         return None, None, None, None
 
-def calculate_daily_summary(transactions, target_date=None):
-    """Calculate daily summary of transactions"""
+def calculate_daily_summary(transactions, target_date=None, date_index=None):
+    """Calculate daily summary of transactions (date_index maps ISO dates to that day's transactions)"""
     if target_date is None:
         target_date = datetime.date.today()
     
     target_date_str = target_date.isoformat()
-    daily_transactions = [t for t in transactions if t.get("date") == target_date_str]
+    if date_index is not None:
+        daily_transactions = date_index.get(target_date_str, [])
+    else:
+        daily_transactions = [t for t in transactions if t.get("date") == target_date_str]
     
     summary = {
         "date": target_date_str,
@@ -279,11 +283,15 @@ def calculate_daily_summary(transactions, target_date=None):
     
     return summary
 
-def get_top_selling_products(transactions, parent_items, packet_variations, days=30):
-    """Get top selling products in the last N days"""
+def get_top_selling_products(transactions, parent_items, packet_variations, days=30, date_index=None):
+    """Get top selling products in the last N days (date_index maps ISO dates to that day's transactions)"""
     cutoff_date = datetime.date.today() - datetime.timedelta(days=days)
     cutoff_date_str = cutoff_date.isoformat()
     
+    # Only the buckets inside the window need looking at
+    if date_index is not None:
+        transactions = [t for d, day in date_index.items() if d and d >= cutoff_date_str for t in day]
+    
     # Filter sales transactions
     sales_transactions = [
         t for t in transactions 
@@ -330,6 +338,124 @@ def get_top_selling_products(transactions, parent_items, packet_variations, days
     
     return top_products
 
+# Activity summary key each category's weights are totalled under, and the one its units per ASIN go under
+ACTIVITY_WEIGHT_KEYS = {"stock_inward": "stock_inward", "packing": "packing_out", "other": "other_changes"}
+ACTIVITY_UNIT_KEYS = {"packing": "packing_in", "fba_sale": "fba_sales", "easy_ship_sale": "easy_ship_sales"}
+ACTIVITY_DETAIL_TYPES = {"stock_inward": "Stock Inward", "packing": "Packing", "fba_sale": "FBA Sale", "easy_ship_sale": "Easy Ship Sale"}
+
+def empty_activity_summary(details=True):
+    """Activity summary of a product with no transactions"""
+    summary = {
+        "stock_inward": 0,
+        "packing_out": 0,  # loose stock used in packing
+        "packing_in": {},  # units created by packing per ASIN
+        "packing_operations": 0,
+        "fba_sales": {},   # FBA sales per ASIN
+        "easy_ship_sales": {},  # Easy Ship sales per ASIN
+        "other_changes": 0
+    }
+    if details:
+        summary["activity_details"] = []
+    return summary
+
+def activity_category(transaction_type):
+    """Activity summary category of a transaction type"""
+    if transaction_type == "Stock Inward":
+        return "stock_inward"
+    elif transaction_type == "Packing":
+        return "packing"
+    elif "FBA Sale" in transaction_type:
+        return "fba_sale"
+    elif "Easy Ship Sale" in transaction_type:
+        return "easy_ship_sale"
+    return "other"
+
+def add_activity(summary, transaction):
+    """Add one transaction to an activity summary's totals"""
+    category = activity_category(transaction.get("type", ""))
+    if category in ACTIVITY_WEIGHT_KEYS:
+        summary[ACTIVITY_WEIGHT_KEYS[category]] += transaction.get("weight", 0) or 0
+    if category in ACTIVITY_UNIT_KEYS:
+        units = summary[ACTIVITY_UNIT_KEYS[category]]
+        asin = transaction.get("asin") or ""
+        units[asin] = units.get(asin, 0) + (transaction.get("quantity", 0) or 0)
+    if category == "packing":
+        summary["packing_operations"] += 1
+
+def calculate_activity_summaries(transactions, details=True):
+    """Calculate the activity summary of every parent product in one pass (parent_id -> summary)"""
+    summaries = {}
+    if not transactions:
+        return summaries
+    
+    df = pd.DataFrame(transactions, columns=["parent_id", "type", "asin", "quantity", "weight", "timestamp"])
+    df["type"] = df["type"].fillna("")
+    df["asin"] = df["asin"].fillna("")
+    df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0)
+    df["weight"] = pd.to_numeric(df["weight"], errors="coerce").fillna(0)
+    
+    # Only a handful of distinct types, so classify those rather than every row
+    df["category"] = df["type"].map({t: activity_category(t) for t in df["type"].unique()})
+    times = pd.to_datetime(df["timestamp"], errors="coerce", format="ISO8601").dt.strftime("%H:%M").fillna("00:00")
+    
+    weights = df[df["category"].isin(list(ACTIVITY_WEIGHT_KEYS))].groupby(["parent_id", "category"], sort=False)["weight"].sum()
+    for (parent_id, category), total in zip(weights.index, weights.tolist()):
+        summaries.setdefault(parent_id, empty_activity_summary(details))[ACTIVITY_WEIGHT_KEYS[category]] += total
+    
+    units = df[df["category"].isin(list(ACTIVITY_UNIT_KEYS))].groupby(["parent_id", "category", "asin"], sort=False)["quantity"].sum()
+    for (parent_id, category, asin), total in zip(units.index, units.tolist()):
+        summaries.setdefault(parent_id, empty_activity_summary(details))[ACTIVITY_UNIT_KEYS[category]][asin] = total
+    
+    packings = df[df["category"] == "packing"].groupby("parent_id", sort=False).size()
+    for parent_id, count in zip(packings.index, packings.tolist()):
+        summaries[parent_id]["packing_operations"] = count
+    
+    if not details:
+        return summaries
+    
+    # Details keep the values exactly as recorded
+    for transaction, category, time_str in zip(transactions, df["category"].tolist(), times.tolist()):
+        parent_id = transaction.get("parent_id")
+        if parent_id is None:
+            continue
+        weight = transaction.get("weight", 0)
+        quantity = transaction.get("quantity", 0)
+        asin = transaction.get("asin", "")
+        detail = {"time": time_str, "type": ACTIVITY_DETAIL_TYPES.get(category, transaction.get("type", ""))}
+        if category == "stock_inward":
+            detail.update({"amount": weight, "unit": "kg"})
+        elif category == "packing":
+            detail.update({"amount": f"-{weight}kg → +{quantity} units", "asin": asin})
+        elif category == "other":
+            detail.update({"amount": weight if weight else quantity, "asin": asin})
+        else:
+            detail.update({"amount": quantity, "asin": asin})
+        detail["notes"] = transaction.get("notes", "")
+        summaries.setdefault(parent_id, empty_activity_summary())["activity_details"].append(detail)
+    
+    return summaries
+
+class ProgressThrottle:
+    """Progress callback for bulk loops that passes at most `rate` updates a second on to callback(fraction, message)"""
+    
+    def __init__(self, callback, rate=None, step=None):
+        self.callback = callback
+        self.interval = 1.0 / (rate or DEFAULT_SETTINGS.get("progress_updates_per_second", 5))
+        # Optionally also report every time progress moves on by this fraction
+        self.step = step
+        self.last_time = None
+        self.last_fraction = 0.0
+    
+    def __call__(self, done, total, message=""):
+        """Report that done of total items are processed; the first and last updates are always passed on"""
+        fraction = min(done / total, 1.0) if total else 1.0
+        now = time.monotonic()
+        if (self.last_time is None or fraction >= 1.0 or now - self.last_time >= self.interval
+                or (self.step and fraction - self.last_fraction >= self.step)):
+            self.last_time = now
+            self.last_fraction = fraction
+            self.callback(fraction, message)
+
 def format_currency(amount, currency="₹"):
     """Format amount as currency"""
     return f"{currency}{amount:,.2f}"